@@ -1,5 +1,33 @@
+from functools import lru_cache
+
+from sqlalchemy import DateTime, Float, Integer, Numeric, text
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.dialects.postgresql import insert
 
+from .records import AggOrderBatch, Record, model_of, row_count
+
+# approximate on-disk sizes used to estimate the amount of data written
+ROW_OVERHEAD_BYTES = 24
+FIXED_COLUMN_BYTES = 8
+VARIABLE_COLUMN_BYTES = 16
+
+
+@lru_cache()
+def estimate_row_size(model):
+    """returns the approximate number of bytes of a row of the given model
+
+    >>> from antalla import models
+    >>> estimate_row_size(models.Coin)
+    72
+    """
+    size = ROW_OVERHEAD_BYTES
+    for column in model.__table__.columns:
+        if isinstance(column.type, (DateTime, Float, Integer, Numeric)):
+            size += FIXED_COLUMN_BYTES
+        else:
+            size += VARIABLE_COLUMN_BYTES
+    return size
+
 
 class Action:
     def execute(self, session) -> int:
@@ -7,15 +35,48 @@ class Action:
         """
         raise NotImplementedError()
 
+    def size_hint(self) -> int:
+        """returns the approximate number of bytes written by the action
+        """
+        return 0
+
 
 class InsertAction(Action):
+    @classmethod
+    def merge(cls, actions):
+        """merges insert actions of the same item type into a single action,
+        keeping only the first item for each value of the index elements;
+        the rows of columnar batches are left to the conflict clause
+        """
+        items = []
+        seen = set()
+        for action in actions:
+            if not action.items:
+                continue
+            index_elements = action.item_type.index_elements()
+            for item in action.items:
+                if isinstance(item, AggOrderBatch):
+                    items.append(item)
+                    continue
+                key = tuple(getattr(item, element, None) for element in index_elements)
+                if None not in key:
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                items.append(item)
+        return cls(items)
+
     def __init__(self, items):
+        """items are instances of the same model, or records and batches of this model
+        """
         super().__init__()
         self.items = items
         self.item_type = None
         if self.items:
-            self.item_type = type(items[0])
-            if not all(isinstance(item, self.item_type) for item in self.items):
+            item_class = type(items[0])
+            self.item_type = model_of(item_class)
+            if not all(type(item) is item_class for item in self.items) and not all(
+                    model_of(type(item)) is self.item_type for item in self.items):
                 raise ValueError("all items should be of the same type")
 
     def execute(self, session):
@@ -25,13 +86,28 @@ class InsertAction(Action):
         items = set(self.items)
         index_elements = self.item_type.index_elements()
         for item in items:
+            if isinstance(item, Record):
+                values.append(item.to_dict())
+                continue
+            if isinstance(item, AggOrderBatch):
+                values.extend(item.to_dicts())
+                continue
             data = vars(item)
             data.pop("_sa_instance_state", None)
             values.append(data)
         insert_stmt = insert(self.item_type).values(values) \
                                             .on_conflict_do_nothing(index_elements=index_elements)
         session.execute(insert_stmt)
-        return len(items)
+        return len(values)
+
+    @property
+    def row_count(self) -> int:
+        return row_count(self.items)
+
+    def size_hint(self):
+        if not self.items:
+            return 0
+        return self.row_count * estimate_row_size(self.item_type)
 
 
 class UpdateAction(Action):
@@ -41,6 +117,50 @@ class UpdateAction(Action):
         self.query = query
         self.update = update
 
+    @classmethod
+    def execute_many(cls, session, actions) -> int:
+        """executes update actions with one ``UPDATE ... FROM (VALUES ...)`` statement
+        per model and set of query and updated columns, and returns the number of rows
+        affected. When several actions match the same row, the last one wins.
+        """
+        groups = {}
+        for action in actions:
+            key = (action.model, tuple(sorted(action.query)), tuple(sorted(action.update)))
+            query_values = tuple(action.query[column] for column in key[1])
+            groups.setdefault(key, {})[query_values] = action
+        n = 0
+        for (model, query_columns, update_columns), group in groups.items():
+            statement, params = cls._compile_update_from_values(
+                model, query_columns, update_columns, list(group.values()))
+            n += session.execute(statement, params).rowcount
+        return n
+
+    @staticmethod
+    def _compile_update_from_values(model, query_columns, update_columns, actions):
+        table = model.__table__
+        dialect = postgresql.dialect()
+        columns = query_columns + update_columns
+        params = {}
+        rows = []
+        for i, action in enumerate(actions):
+            values = dict(action.query, **action.update)
+            row = []
+            for j, column in enumerate(columns):
+                name = f"v{i}_{j}"
+                params[name] = values[column]
+                column_type = table.columns[column].type.compile(dialect=dialect)
+                row.append(f"cast(:{name} as {column_type})")
+            rows.append("(" + ", ".join(row) + ")")
+        assignments = ", ".join(f'"{column}" = v."{column}"' for column in update_columns)
+        conditions = " and ".join(f't."{column}" = v."{column}"' for column in query_columns)
+        column_names = ", ".join(f'"{column}"' for column in columns)
+        statement = text(
+            f"""update {table.name} as t set {assignments}
+            from (values {", ".join(rows)}) as v({column_names})
+            where {conditions}"""
+        )
+        return statement, params
+
     def execute(self, session):
         n = 0
         for instance in session.query(self.model).filter_by(**self.query):
@@ -49,3 +169,6 @@ class UpdateAction(Action):
                 setattr(instance, key, value)
         return n
 
+    def size_hint(self):
+        return ROW_OVERHEAD_BYTES + len(self.update) * FIXED_COLUMN_BYTES
+
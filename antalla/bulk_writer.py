@@ -0,0 +1,159 @@
+import io
+import logging
+from datetime import datetime
+
+import numpy as np
+
+from . import models
+from .actions import InsertAction
+from .records import AggOrderBatch, row_count
+from .timestamps import to_datetime
+
+BULK_INSERT_MODELS = (models.AggOrder, models.Trade)
+
+_COPY_ESCAPES = str.maketrans({
+    "\\": "\\\\",
+    "\t": "\\t",
+    "\n": "\\n",
+    "\r": "\\r",
+})
+
+
+def _copy_value(value):
+    """formats a value for the text format of ``COPY FROM STDIN``
+
+    >>> _copy_value(None)
+    '\\\\N'
+    >>> _copy_value(0.1)
+    '0.1'
+    >>> _copy_value(datetime(2019, 5, 1, 1, 2, 3))
+    '2019-05-01 01:02:03'
+    >>> _copy_value("a\\tb")
+    'a\\\\tb'
+    """
+    if value is None:
+        return "\\N"
+    if isinstance(value, datetime):
+        return value.isoformat(" ")
+    if isinstance(value, float):
+        return repr(value)
+    return str(value).translate(_COPY_ESCAPES)
+
+
+def _copy_timestamp(value):
+    """formats a datetime or an epoch in milliseconds
+    """
+    return _copy_value(to_datetime(value))
+
+
+def _copy_formatters(model, columns):
+    """returns the function formatting the values of each column
+    """
+    return [
+        _copy_timestamp if isinstance(model.__table__.columns[name].type, models.EpochDateTime)
+        else _copy_value
+        for name in columns
+    ]
+
+
+def _copy_batch(batch, columns, formatters=None):
+    """formats the rows of a columnar batch for ``COPY FROM STDIN``, column
+    by column, without creating an object per row
+
+    >>> batch = AggOrderBatch.from_levels([["0.5", "10"]], [["2", "1.5"]],
+    ...                                   buy_sym_id="ETH", sell_sym_id="BTC", last_update_id=3)
+    >>> _copy_batch(batch, ["order_type", "price", "size", "last_update_id", "exchange_id"])
+    'bid\\t0.5\\t10.0\\t3\\t\\\\N\\nask\\t2.0\\t1.5\\t3\\t\\\\N\\n'
+    """
+    if not len(batch):
+        return ""
+    if formatters is None:
+        formatters = [_copy_value] * len(columns)
+    lines = None
+    for name, format_value in zip(columns, formatters):
+        values = batch.column(name)
+        if isinstance(values, np.ndarray):
+            # floats are formatted as their shortest repr, like _copy_value
+            values = values.astype(str)
+        else:
+            values = format_value(values)
+        lines = values if lines is None else np.char.add(np.char.add(lines, "\t"), values)
+    return "\n".join(np.broadcast_to(lines, (len(batch),)).tolist()) + "\n"
+
+
+class BulkWriter:
+    """buffers the rows of high-volume tables and loads them with ``COPY FROM STDIN``
+    into a temporary staging table, followed by a single set-based
+    ``INSERT ... SELECT ... ON CONFLICT DO NOTHING`` into the target table
+    """
+
+    def __init__(self, bulk_models=BULK_INSERT_MODELS):
+        self.models = set(bulk_models)
+        self._buffers = {}
+
+    def accepts(self, action) -> bool:
+        return isinstance(action, InsertAction) and action.item_type in self.models
+
+    def add(self, action: InsertAction) -> int:
+        """buffers the items of an insert action and returns the number of rows added
+        """
+        if not action.items:
+            return 0
+        self._buffers.setdefault(action.item_type, []).extend(action.items)
+        return action.row_count
+
+    @property
+    def pending_rows(self) -> int:
+        return sum(row_count(items) for items in self._buffers.values())
+
+    def flush(self, session) -> int:
+        """writes all buffered rows using the session connection and returns
+        the number of rows inserted
+        """
+        if not self._buffers:
+            return 0
+        cursor = session.connection().connection.cursor()
+        inserted = 0
+        try:
+            for model, items in self._buffers.items():
+                inserted += self._copy_rows(cursor, model, items)
+        finally:
+            cursor.close()
+        self._buffers = {}
+        return inserted
+
+    def _copy_rows(self, cursor, model, items):
+        table = model.__tablename__
+        staging_table = "staging_" + table
+        columns = model.insert_columns()
+        column_list = ", ".join(f'"{name}"' for name in columns)
+        conflict_list = ", ".join(f'"{name}"' for name in model.index_elements())
+        formatters = _copy_formatters(model, columns)
+        buffer = io.StringIO()
+        for item in items:
+            if isinstance(item, AggOrderBatch):
+                buffer.write(_copy_batch(item, columns, formatters))
+                continue
+            buffer.write("\t".join(format_value(getattr(item, name, None))
+                                   for name, format_value in zip(columns, formatters)))
+            buffer.write("\n")
+        buffer.seek(0)
+        cursor.execute(
+            f"""
+            create temporary table if not exists {staging_table}
+            on commit delete rows
+            as select {column_list} from {table} with no data
+            """
+        )
+        cursor.copy_expert(f"copy {staging_table} ({column_list}) from stdin", buffer)
+        cursor.execute(
+            f"""
+            insert into {table} ({column_list})
+            select {column_list} from {staging_table}
+            on conflict ({conflict_list}) do nothing
+            """
+        )
+        inserted = cursor.rowcount
+        cursor.execute(f"truncate {staging_table}")
+        logging.debug("bulk insert - %s: %d rows copied, %d inserted", table, row_count(items), inserted)
+        return inserted
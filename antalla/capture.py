@@ -0,0 +1,69 @@
+import gzip
+import logging
+import struct
+import time
+from typing import Iterator, NamedTuple, Union
+
+MAGIC = b"ANTCAP1\n"
+
+# receive time, length of the exchange name, binary flag and length of the frame
+FRAME_HEADER = struct.Struct(">dBBI")
+
+
+class CapturedFrame(NamedTuple):
+    received_at: float
+    exchange: str
+    data: Union[str, bytes]
+
+
+class CaptureWriter:
+    """appends the raw frames received by the websocket listeners, with their
+    receive time, to a gzip compressed file of length-prefixed records
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.frames = 0
+        self._file = gzip.open(path, "wb")
+        self._file.write(MAGIC)
+
+    def write(self, exchange: str, data: Union[str, bytes], received_at=None):
+        if received_at is None:
+            received_at = time.time()
+        binary = isinstance(data, (bytes, bytearray))
+        payload = bytes(data) if binary else data.encode()
+        name = exchange.encode()
+        self._file.write(FRAME_HEADER.pack(received_at, len(name), binary, len(payload)))
+        self._file.write(name)
+        self._file.write(payload)
+        self.frames += 1
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+            logging.info("capture - %d frames written to %s", self.frames, self.path)
+
+
+def read_capture(path) -> Iterator[CapturedFrame]:
+    """yields the frames of a capture file; an incomplete record at the end
+    of the file, e.g. when the capture was interrupted, is skipped
+    """
+    with gzip.open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a capture file")
+        while True:
+            try:
+                header = f.read(FRAME_HEADER.size)
+                if not header:
+                    return
+                if len(header) < FRAME_HEADER.size:
+                    raise EOFError()
+                received_at, name_size, binary, size = FRAME_HEADER.unpack(header)
+                name = f.read(name_size)
+                payload = f.read(size)
+                if len(name) < name_size or len(payload) < size:
+                    raise EOFError()
+            except EOFError:
+                logging.warning("capture - skipping incomplete frame at the end of %s", path)
+                return
+            yield CapturedFrame(received_at, name.decode(), payload if binary else payload.decode())
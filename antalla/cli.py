@@ -3,6 +3,13 @@ import logging
 
 from . import commands
 from .exchange_listener import ExchangeListener
+from .db_writer import (
+    DEFAULT_COMMIT_INTERVAL,
+    DEFAULT_COMMIT_BYTES,
+    DEFAULT_COMMIT_MAX_AGE,
+    DEFAULT_QUEUE_SIZE,
+)
+from .ob_snapshot_generator import BACKENDS
 from . import settings
 
 LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
@@ -15,18 +22,103 @@ parser.add_argument(
 subparsers = parser.add_subparsers(dest="command")
 migrations_parser = subparsers.add_parser("migrations")
 
-run_parser = subparsers.add_parser("run", help="Runs antalla to fetch data")
-run_parser.add_argument("--exchange", nargs="*", choices=ExchangeListener.registered())
-run_parser.add_argument(
+listener_options = argparse.ArgumentParser(add_help=False)
+listener_options.add_argument("--exchange", nargs="*", choices=ExchangeListener.registered())
+listener_options.add_argument(
     "--event-type",
     choices=["trade", "depth"],
     help="which event type to listen to; defaults to all events",
 )
-run_parser.add_argument(
+
+writer_options = argparse.ArgumentParser(add_help=False)
+writer_options.add_argument(
+    "--bulk-insert",
+    default=False,
+    action="store_true",
+    help="loads agg orders and trades with COPY through a staging table instead of one INSERT per event",
+)
+writer_options.add_argument(
+    "--writer-threads",
+    type=int,
+    default=1,
+    help="number of threads writing to the db outside of the event loop; 0 writes from the event loop",
+)
+writer_options.add_argument(
+    "--writer-queue-size",
+    type=int,
+    default=DEFAULT_QUEUE_SIZE,
+    help="maximum number of pending messages before listeners are slowed down",
+)
+writer_options.add_argument(
+    "--commit-rows",
+    type=int,
+    default=DEFAULT_COMMIT_INTERVAL,
+    help="commits once this number of rows has been modified",
+)
+writer_options.add_argument(
+    "--commit-bytes",
+    type=int,
+    default=DEFAULT_COMMIT_BYTES,
+    help="commits once approximately this number of bytes has been written",
+)
+writer_options.add_argument(
+    "--commit-max-age",
+    type=int,
+    default=int(DEFAULT_COMMIT_MAX_AGE * 1000),
+    help="maximum time in milliseconds a change stays uncommitted",
+)
+
+run_options = argparse.ArgumentParser(add_help=False, parents=[listener_options, writer_options])
+run_options.add_argument(
     "--markets-files",
     help="files to use to select the markets for each exchange",
     nargs="*",
 )
+run_options.add_argument(
+    "--workers",
+    type=int,
+    default=1,
+    help="number of processes the exchanges and markets are split across",
+)
+run_options.add_argument(
+    "--spool-file",
+    default=settings.SPOOL_FILE,
+    help="file receiving the events while the db is unavailable or lagging, replayed once it recovers",
+)
+
+run_options.add_argument(
+    "--snapshot-interval",
+    type=float,
+    help="takes order book snapshots of the markets being ingested every this number of seconds",
+)
+run_options.add_argument(
+    "--snapshot-depth",
+    type=float,
+    help="order book depth of the live snapshots, expressed in percentage relative to the mid price; "
+         "defaults to the quartiles",
+)
+
+run_parser = subparsers.add_parser("run", parents=[run_options], help="Runs antalla to fetch data")
+
+record_parser = subparsers.add_parser(
+    "record", parents=[run_options],
+    help="Runs antalla and records the raw websocket frames received to a capture file"
+)
+record_parser.add_argument(
+    "capture_file", help="capture file to write; with several workers, one file per worker is written"
+)
+
+replay_parser = subparsers.add_parser(
+    "replay", parents=[listener_options, writer_options],
+    help="Feeds the frames of a capture file through the listeners and writes them to the db"
+)
+replay_parser.add_argument("capture_file", help="capture file written by the record command")
+replay_parser.add_argument(
+    "--speed",
+    type=float,
+    help="replays the frames this number of times faster than they were received; "
+         "replays as fast as possible by default",
+)
 
 markets = subparsers.add_parser("markets")
 markets.add_argument(
@@ -71,6 +163,40 @@ snapshots_parser.add_argument(
     action="store_true",
     help="includes orders ranging from upper quartile bids to lower quartile asks",
 )
+snapshots_parser.add_argument(
+    "--backend",
+    choices=BACKENDS,
+    default="replay",
+    help="'replay' reads the orders of each market once, 'sql' computes an hour of snapshots per query",
+)
+snapshots_parser.add_argument(
+    "--jobs",
+    type=int,
+    default=1,
+    help="number of worker processes generating the snapshots of different markets",
+)
+
+partitions_parser = subparsers.add_parser(
+    "partitions", help="creates future daily partitions and expires old ones"
+)
+partitions_parser.add_argument(
+    "--days-ahead",
+    type=int,
+    default=settings.PARTITION_DAYS_AHEAD,
+    help="number of daily partitions to create from today",
+)
+partitions_parser.add_argument(
+    "--retention-days",
+    type=int,
+    default=settings.PARTITION_RETENTION_DAYS,
+    help="partitions older than this number of days are expired; keeps all partitions by default",
+)
+partitions_parser.add_argument(
+    "--detach-only",
+    default=False,
+    action="store_true",
+    help="detaches expired partitions instead of dropping them",
+)
 
 plot_order_book_parser = subparsers.add_parser(
     "plot-order-book", help="plot the order book"
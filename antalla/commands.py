@@ -5,7 +5,7 @@ import json
 import pkg_resources
 import asyncio
 import logging
-from datetime import datetime
+from datetime import date, datetime, timedelta
 import re
 import sys
 
@@ -18,11 +18,14 @@ from .exchange_listener import ExchangeListener
 from .orchestrator import Orchestrator
 from . import market_crawler
 from .ob_snapshot_generator import OBSnapshotGenerator
+from .partitions import PartitionManager
+from .supervisor import Supervisor, shard_markets
 from .web.websocket_handler import handle_connection
 
 
 
 def run(args):
+    db.use_profile("ingest")
     if args["exchange"]:
         exchanges = args["exchange"]
     else:
@@ -37,7 +40,20 @@ def run(args):
     else:
         for exchange in exchanges:
             markets[exchange] = settings.MARKETS
-    orchestrator = Orchestrator(exchanges, event_type=args["event_type"], markets=markets)
+    options = dict(
+        _writer_options(args),
+        event_type=args["event_type"],
+        spool_file=args["spool_file"],
+        capture_file=args.get("capture_file"),
+        snapshot_interval=args["snapshot_interval"],
+        snapshot_depth=args["snapshot_depth"],
+    )
+    if args["workers"] > 1:
+        markets = {exchange: markets.get(exchange, settings.MARKETS) for exchange in exchanges}
+        supervisor = Supervisor(shard_markets(markets, args["workers"]), options)
+        supervisor.run()
+        return
+    orchestrator = Orchestrator(exchanges, markets=markets, **options)
     def handler(_signum, _frame):
         orchestrator.stop()
     signal.signal(signal.SIGINT, handler)
@@ -46,6 +62,31 @@ def run(args):
     except KeyboardInterrupt:
         orchestrator.stop()
 
+def record(args):
+    run(args)
+
+def replay(args):
+    db.use_profile("ingest")
+    exchanges = args["exchange"] or ExchangeListener.registered()
+    orchestrator = Orchestrator(exchanges, event_type=args["event_type"], **_writer_options(args))
+    try:
+        result = asyncio.get_event_loop().run_until_complete(
+            orchestrator.replay(args["capture_file"], speed=args["speed"]))
+    finally:
+        orchestrator.stop()
+    logging.info("replayed %d frames in %.2f seconds (%.0f frames/s)", result["frames"],
+                 result["elapsed"], result["frames"] / max(result["elapsed"], 1e-9))
+
+def _writer_options(args):
+    return dict(
+        bulk_insert=args["bulk_insert"],
+        writer_threads=args["writer_threads"],
+        writer_queue_size=args["writer_queue_size"],
+        commit_interval=args["commit_rows"],
+        commit_bytes=args["commit_bytes"],
+        commit_max_age=args["commit_max_age"] / 1000,
+    )
+
 def markets(args):
     try:
         asyncio.get_event_loop().run_until_complete(_markets(args))
@@ -162,13 +203,27 @@ def snapshot(args):
         exchanges = args["exchange"]
     else:
         exchanges = ExchangeListener.registered()
+    db.use_profile("snapshot")
     stop_time = datetime.now()
-    obs_generator = OBSnapshotGenerator(exchanges, stop_time, args["depth"]) 
+    obs_generator = OBSnapshotGenerator(exchanges, stop_time, args["depth"], backend=args["backend"])
     try:
-        obs_generator.run()
+        if args["jobs"] > 1:
+            obs_generator.run_parallel(args["jobs"])
+        else:
+            obs_generator.run()
     except KeyboardInterrupt:
         logging.warning("KeybaordInterrupt - 'obs_generator.run()'")
 
+def partitions(args):
+    manager = PartitionManager(db.session)
+    today = date.today()
+    created = manager.create_partitions(today, args["days_ahead"])
+    logging.info("partitions - %d partitions created", len(created))
+    if args["retention_days"] is not None:
+        expired = manager.expire_partitions(today - timedelta(days=args["retention_days"]),
+                                            drop=not args["detach_only"])
+        logging.info("partitions - %d partitions expired", len(expired))
+
 def plot_order_book(args):
     if args["exchange"] and args["market"]:
         exchange = args["exchange"]
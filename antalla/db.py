@@ -6,7 +6,60 @@ from sqlalchemy.ext.declarative import declarative_base
 from . import settings
 
 
-engine = create_engine(settings.DB_URL)
+def engine_options(profile):
+    """returns the url and the ``create_engine`` arguments of an engine profile
+
+    >>> url, options = engine_options("analytics")
+    >>> options["connect_args"]["options"]
+    '-c statement_timeout=30000 -c default_transaction_read_only=on'
+    """
+    options = dict(settings.DB_ENGINE_PROFILES[profile])
+    url = options.pop("url", settings.DB_URL)
+    server_options = []
+    statement_timeout = options.pop("statement_timeout", None)
+    if statement_timeout is not None:
+        server_options.append(f"-c statement_timeout={statement_timeout}")
+    if options.pop("read_only", False):
+        server_options.append("-c default_transaction_read_only=on")
+    if server_options:
+        options["connect_args"] = dict(options.get("connect_args", {}),
+                                       options=" ".join(server_options))
+    return url, options
+
+
+def create_profile_engine(profile):
+    url, options = engine_options(profile)
+    return create_engine(url, **options)
+
+
+_engines = {}
+
+
+def get_engine(profile):
+    if profile not in _engines:
+        _engines[profile] = create_profile_engine(profile)
+    return _engines[profile]
+
+
+def use_profile(profile):
+    """binds ``session`` and ``Session`` to the engine of the given profile;
+    to be called by a command before any session is used
+    """
+    engine = get_engine(profile)
+    session.remove()
+    session.configure(bind=engine)
+    Session.configure(bind=engine)
+    return engine
+
+
+engine = get_engine("default")
 Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 session: DBSession = scoped_session(Session)
+
+# read-only sessions for queries which are not part of the ingestion, in
+# autocommit mode so that they never stay idle in a transaction
+analytics_engine = get_engine("analytics")
+AnalyticsSession = sessionmaker(autocommit=True, autoflush=False, bind=analytics_engine)
+analytics_session: DBSession = scoped_session(AnalyticsSession)
+
 Base = declarative_base()
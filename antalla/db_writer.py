@@ -0,0 +1,493 @@
+import asyncio
+import logging
+import os
+import queue
+import threading
+import time
+from typing import List
+
+import sqlalchemy
+
+from . import db
+from .actions import Action, InsertAction, UpdateAction
+from .bulk_writer import BulkWriter
+from .spool import Spool
+
+DEFAULT_COMMIT_INTERVAL = 100
+DEFAULT_COMMIT_BYTES = 1024 * 1024
+DEFAULT_COMMIT_MAX_AGE = 1.0
+DEFAULT_QUEUE_SIZE = 10000
+STOP_TIMEOUT = 30
+REPLAY_INTERVAL = 5.0
+REPLAY_COMMIT_ROWS = 10000
+# number of failed replays of a segment after which its batches are replayed
+# one by one, the failing ones being moved to a quarantine file
+REPLAY_MAX_ATTEMPTS = 3
+QUARANTINE_SUFFIX = ".failed"
+
+
+def is_connectivity_error(error) -> bool:
+    """tells whether an error is caused by the database being unavailable,
+    as opposed to the data written being rejected
+
+    >>> is_connectivity_error(sqlalchemy.exc.OperationalError("select 1", {}, None))
+    True
+    >>> is_connectivity_error(sqlalchemy.exc.IntegrityError("insert", {}, None))
+    False
+    """
+    if isinstance(error, sqlalchemy.exc.OperationalError):
+        return True
+    return isinstance(error, sqlalchemy.exc.DBAPIError) and error.connection_invalidated
+
+
+class FlushPolicy:
+    """decides when pending changes should be committed: after a number of rows,
+    after an approximate number of bytes or once the oldest pending change
+    reaches a maximum age (in seconds), whichever comes first
+
+    >>> policy = FlushPolicy(max_rows=100, max_bytes=1000, max_age=0.25)
+    >>> policy.should_flush(rows=10, size=100, age=0.1)
+    False
+    >>> policy.should_flush(rows=100, size=100, age=0.1)
+    True
+    >>> policy.should_flush(rows=10, size=100, age=0.3)
+    True
+    >>> policy.should_flush(rows=0, size=0, age=None)
+    False
+    """
+
+    def __init__(self,
+                 max_rows=DEFAULT_COMMIT_INTERVAL,
+                 max_bytes=DEFAULT_COMMIT_BYTES,
+                 max_age=DEFAULT_COMMIT_MAX_AGE):
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+    def should_flush(self, rows, size, age) -> bool:
+        if self.max_rows is not None and rows >= self.max_rows:
+            return True
+        if self.max_bytes is not None and size >= self.max_bytes:
+            return True
+        if self.max_age is not None and age is not None and age >= self.max_age:
+            return True
+        return False
+
+    def time_until_due(self, age):
+        """returns the number of seconds until pending changes of the given age
+        must be committed, or None if there is no pending change or no age limit
+        """
+        if self.max_age is None or age is None:
+            return None
+        return max(self.max_age - age, 0)
+
+
+class ActionExecutor:
+    """executes actions on a session and commits according to a flush policy
+    """
+
+    def __init__(self, session, flush_policy=None, bulk_insert=False):
+        if flush_policy is None:
+            flush_policy = FlushPolicy()
+        self.session = session
+        self.flush_policy = flush_policy
+        self.bulk_writer = BulkWriter() if bulk_insert else None
+        self._rows_modified = 0
+        self._bytes_modified = 0
+        self._pending_since = None
+        self._pending_inserts = {}
+        self._pending_updates = {}
+        self._uncommitted = []
+        self._stats = dict(commits=0, inserts=0, updates=0, statements=0)
+
+    def execute(self, actions: List[Action]):
+        """executes the given actions; insert and update actions are merged per table
+        and only executed when another action depends on them or on commit
+        """
+        self._uncommitted.append(actions)
+        for action in actions:
+            self._track_actions(action)
+            if self.bulk_writer and self.bulk_writer.accepts(action):
+                self._rows_modified += self.bulk_writer.add(action)
+            elif isinstance(action, InsertAction):
+                if action.items:
+                    self._execute_pending_updates(action.item_type)
+                    self._pending_inserts.setdefault(action.item_type, []).append(action)
+                    self._rows_modified += action.row_count
+            elif isinstance(action, UpdateAction):
+                self._execute_pending_inserts(action.model)
+                self._pending_updates.setdefault(action.model, []).append(action)
+                self._rows_modified += 1
+            else:
+                self._execute_pending_inserts()
+                self._execute_pending_updates()
+                self._rows_modified += action.execute(self.session)
+            if isinstance(action, Action):
+                self._bytes_modified += action.size_hint()
+        if self._pending_since is None and self._rows_modified:
+            self._pending_since = time.monotonic()
+
+        self.flush_if_due()
+
+    @property
+    def pending_age(self):
+        if self._pending_since is None:
+            return None
+        return time.monotonic() - self._pending_since
+
+    def time_until_due(self):
+        return self.flush_policy.time_until_due(self.pending_age)
+
+    def flush_if_due(self) -> bool:
+        if not self.flush_policy.should_flush(self._rows_modified,
+                                              self._bytes_modified,
+                                              self.pending_age):
+            return False
+        self.commit()
+        return True
+
+    def flush(self):
+        """executes the pending statements without committing them
+        """
+        self._execute_pending_inserts()
+        self._execute_pending_updates()
+        if self.bulk_writer:
+            self.bulk_writer.flush(self.session)
+
+    def commit(self):
+        self.flush()
+        logging.info(("commit number [%s]: committing changes "
+            "Insert Actions: %s, Update Actions: %s, Statements: %s"),
+            self._stats["commits"], self._stats["inserts"], self._stats["updates"],
+            self._stats["statements"])
+        self.session.commit()
+        self._reset_pending()
+        self._stats["commits"] += 1
+        self._stats["inserts"] = 0
+        self._stats["updates"] = 0
+        self._stats["statements"] = 0
+
+    def rollback(self) -> List[List[Action]]:
+        """discards the pending changes and returns the batches of actions
+        executed since the last commit
+        """
+        uncommitted = self._uncommitted
+        if self.bulk_writer:
+            self.bulk_writer = BulkWriter(self.bulk_writer.models)
+        self.session.rollback()
+        self._reset_pending()
+        return uncommitted
+
+    def _execute_pending_inserts(self, model=None):
+        """executes one merged statement per table for the pending insert actions,
+        in the order in which the tables were first seen, or only for the
+        given model. The table of the given model keeps its position, so that
+        rows referencing it which are still pending are inserted after it
+        """
+        if model is not None:
+            item_types = [model] if self._pending_inserts.get(model) else []
+        else:
+            item_types = list(self._pending_inserts)
+        for item_type in item_types:
+            if model is None:
+                pending = self._pending_inserts.pop(item_type)
+            else:
+                pending, self._pending_inserts[item_type] = self._pending_inserts[item_type], []
+            if not pending:
+                continue
+            merged_action = InsertAction.merge(pending)
+            merged_action.execute(self.session)
+            self._stats["statements"] += 1
+
+    def _execute_pending_updates(self, model=None):
+        """executes the pending update actions in bulk, or only those for the given model
+        """
+        if model is not None:
+            update_models = [model] if model in self._pending_updates else []
+        else:
+            update_models = list(self._pending_updates)
+        for update_model in update_models:
+            UpdateAction.execute_many(self.session, self._pending_updates.pop(update_model))
+            self._stats["statements"] += 1
+
+    def _reset_pending(self):
+        self._pending_inserts = {}
+        self._pending_updates = {}
+        self._uncommitted = []
+        self._rows_modified = 0
+        self._bytes_modified = 0
+        self._pending_since = None
+
+    def _track_actions(self, action):
+        if isinstance(action, InsertAction):
+            self._stats["inserts"] += 1
+        elif isinstance(action, UpdateAction):
+            self._stats["updates"] += 1
+
+
+class DBWriter:
+    """drains batches of actions pushed by the exchange listeners from a bounded
+    queue and writes them to the database from dedicated threads, each one
+    with its own session
+
+    When the queue is full, ``submit`` blocks the caller until a writer thread
+    catches up, which applies backpressure to the listeners.
+    Batches are executed in submission order only when a single thread is used.
+
+    With a spool, batches are appended to the spool instead when the queue is
+    full or after a database error, until a replayer thread has loaded the
+    spool back into the database. Replaying may insert the same rows twice,
+    which is ignored by the conflict handling of the insert actions, but
+    spooled batches are executed after the batches of the queue.
+    """
+
+    _STOP = object()
+
+    def __init__(self,
+                 threads=1,
+                 session_factory=db.Session,
+                 flush_policy=None,
+                 max_queue_size=DEFAULT_QUEUE_SIZE,
+                 bulk_insert=False,
+                 spool=None,
+                 replay_interval=REPLAY_INTERVAL):
+        self.session_factory = session_factory
+        self.flush_policy = flush_policy
+        self.bulk_insert = bulk_insert
+        self.spool = spool
+        self.replay_interval = replay_interval
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._threads = [
+            threading.Thread(target=self._run, name=f"db-writer-{i}", daemon=True)
+            for i in range(threads)
+        ]
+        self._replayer = None
+        if spool is not None:
+            self._replayer = threading.Thread(target=self._replay, name="db-replayer", daemon=True)
+        self._spilling = threading.Event()
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+        self._metrics = dict(
+            submitted=0,
+            executed=0,
+            failed=0,
+            max_queue_depth=0,
+            blocked_submits=0,
+            blocked_seconds=0.0,
+            spilled=0,
+            replayed=0,
+            quarantined=0,
+        )
+        self._replay_attempts = {}
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+        if self._replayer:
+            self._replayer.start()
+
+    def submit(self, actions: List[Action]):
+        """queues a batch of actions. When the queue is full and there is no
+        spool, waits until a writer thread makes room; from a running event
+        loop, the wait happens in an executor thread and the returned future
+        should be awaited, so that the loop is not blocked
+        """
+        if not actions:
+            return None
+        try:
+            self._queue.put_nowait(actions)
+        except queue.Full:
+            if self.spool is not None:
+                self._spill([actions])
+                return None
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                self._put(actions)
+                return None
+            return loop.run_in_executor(None, self._put, actions)
+        self._count_submit()
+        return None
+
+    def _put(self, actions):
+        started_at = time.monotonic()
+        self._queue.put(actions)
+        with self._lock:
+            self._metrics["blocked_submits"] += 1
+            self._metrics["blocked_seconds"] += time.monotonic() - started_at
+        self._count_submit()
+
+    def _count_submit(self):
+        with self._lock:
+            self._metrics["submitted"] += 1
+            self._metrics["max_queue_depth"] = max(self._metrics["max_queue_depth"],
+                                                   self._queue.qsize())
+
+    def stop(self, timeout=STOP_TIMEOUT):
+        """flushes the queue, commits pending changes and waits for the writer threads
+        """
+        for _ in self._threads:
+            self._queue.put(self._STOP)
+        for thread in self._threads:
+            if thread.is_alive():
+                thread.join(timeout)
+        self._stopped.set()
+        if self._replayer and self._replayer.is_alive():
+            self._replayer.join(timeout)
+        if self.spool is not None:
+            self.spool.close()
+
+    def metrics(self):
+        with self._lock:
+            metrics = dict(self._metrics)
+        metrics["queue_depth"] = self._queue.qsize()
+        return metrics
+
+    def _run(self):
+        session = self.session_factory()
+        executor = ActionExecutor(session, self.flush_policy, self.bulk_insert)
+        try:
+            while True:
+                try:
+                    actions = self._queue.get(timeout=executor.time_until_due())
+                except queue.Empty:
+                    self._flush_if_due(executor)
+                    continue
+                if actions is self._STOP:
+                    self._commit(executor)
+                    break
+                self._execute(executor, actions)
+        finally:
+            session.close()
+
+    def _execute(self, executor, actions):
+        try:
+            if self._spilling.is_set():
+                self._spill([actions])
+                return
+            executor.execute(actions)
+            with self._lock:
+                self._metrics["executed"] += 1
+        except Exception as e:
+            logging.exception("db writer - error executing actions")
+            self._fail(executor, e)
+
+    def _flush_if_due(self, executor):
+        try:
+            executor.flush_if_due()
+        except Exception as e:
+            logging.exception("db writer - error on commit")
+            self._fail(executor, e)
+
+    def _commit(self, executor):
+        try:
+            executor.commit()
+        except Exception as e:
+            logging.exception("db writer - error on final commit")
+            self._fail(executor, e)
+
+    def _fail(self, executor, error):
+        """rolls back or spills the uncommitted actions after an error of any
+        type, so that the writer thread keeps draining the queue
+        """
+        with self._lock:
+            self._metrics["failed"] += 1
+        try:
+            self._rollback(executor, spill=is_connectivity_error(error))
+        except Exception:
+            logging.exception("db writer - rollback failed, uncommitted actions are lost")
+
+    def _rollback(self, executor, spill):
+        """discards the uncommitted actions, or spills them until the database
+        is available again; rows rejected by the database are not spilled as
+        they would be rejected again when replayed
+        """
+        uncommitted = executor.rollback()
+        if self.spool is not None and spill:
+            self._spilling.set()
+            self._spill(uncommitted)
+        else:
+            logging.error("db writer - %d uncommitted batches discarded", len(uncommitted))
+
+    def _spill(self, batches):
+        for actions in batches:
+            self.spool.append(actions)
+        with self._lock:
+            self._metrics["spilled"] += len(batches)
+
+    def _replay(self):
+        session = self.session_factory()
+        executor = ActionExecutor(session,
+                                  FlushPolicy(max_rows=REPLAY_COMMIT_ROWS, max_bytes=None, max_age=None),
+                                  bulk_insert=True)
+        try:
+            while not self._stopped.wait(self.replay_interval):
+                self._replay_spool(executor)
+            self._replay_spool(executor)
+        finally:
+            session.close()
+
+    def _replay_spool(self, executor):
+        """loads the spooled batches into the database and resumes writing
+        to the database once the spool is empty
+        """
+        for segment in self.spool.rotate():
+            try:
+                replayed = self._replay_segment(executor, segment)
+            except Exception as e:
+                executor.rollback()
+                attempts = self._replay_attempts.get(segment, 0) + 1
+                self._replay_attempts[segment] = attempts
+                if is_connectivity_error(e) or attempts < REPLAY_MAX_ATTEMPTS:
+                    logging.warning("db writer - replay of %s failed: %s", segment, e)
+                    return
+                logging.warning("db writer - replay of %s failed %d times, replaying it batch by batch",
+                                segment, attempts)
+                try:
+                    replayed = self._replay_batches(executor, segment)
+                except Exception as e:
+                    executor.rollback()
+                    logging.warning("db writer - replay of %s failed: %s", segment, e)
+                    return
+            self._replay_attempts.pop(segment, None)
+            os.remove(segment)
+            logging.info("db writer - replayed %d batches from %s", replayed, segment)
+            with self._lock:
+                self._metrics["replayed"] += replayed
+        if self._spilling.is_set() and not self.spool.pending:
+            logging.info("db writer - spool replayed, resuming database writes")
+            self._spilling.clear()
+
+    def _replay_segment(self, executor, segment):
+        replayed = 0
+        for actions in self.spool.read(segment):
+            executor.execute(actions)
+            replayed += 1
+        executor.commit()
+        return replayed
+
+    def _replay_batches(self, executor, segment):
+        """replays the batches of a segment in separate transactions, moving
+        the batches rejected by the database to a quarantine file next to the
+        segment; stops at the first connectivity error
+        """
+        quarantine = Spool(segment + QUARANTINE_SUFFIX)
+        replayed = 0
+        try:
+            for actions in self.spool.read(segment):
+                try:
+                    executor.execute(actions)
+                    executor.commit()
+                    replayed += 1
+                except Exception as e:
+                    executor.rollback()
+                    if is_connectivity_error(e):
+                        raise
+                    logging.error("db writer - moving a batch of %s to %s: %s",
+                                  segment, quarantine.path, e)
+                    quarantine.append(actions)
+                    with self._lock:
+                        self._metrics["quarantined"] += 1
+        finally:
+            quarantine.close()
+        return replayed
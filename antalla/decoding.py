@@ -0,0 +1,59 @@
+import json
+import re
+
+from . import settings
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+DECODERS = {"json": json.loads}
+if orjson is not None:
+    DECODERS["orjson"] = orjson.loads
+
+
+def get_decoder(name=None):
+    """returns the function decoding JSON frames; ``auto`` picks the fastest
+    decoder installed
+
+    >>> get_decoder("json")('{"type": "match"}')
+    {'type': 'match'}
+    """
+    if name is None:
+        name = settings.JSON_DECODER
+    if name == "auto":
+        name = "orjson" if "orjson" in DECODERS else "json"
+    if name not in DECODERS:
+        raise ValueError(f"unknown or unavailable JSON decoder: {name}")
+    return DECODERS[name]
+
+
+class TypeFilter:
+    """cheap check of the type of a message on the raw frame, used to skip
+    frames which would be discarded after being decoded. The first string
+    value of ``key`` in the frame is taken as the type of the message;
+    frames without it are always accepted
+
+    >>> frame_filter = TypeFilter("type", {"match", "l2update"})
+    >>> frame_filter.accepts('{"type": "open", "price": "1"}')
+    False
+    >>> frame_filter.accepts(b'{"type":"match"}'), frame_filter.accepts('{"price": "1"}')
+    (True, True)
+    """
+
+    def __init__(self, key, types):
+        self.key = key
+        self.types = frozenset(types)
+        self._bytes_types = frozenset(t.encode() for t in self.types)
+        pattern = r'"%s"\s*:\s*"([^"\\]*)"' % re.escape(key)
+        self._pattern = re.compile(pattern)
+        self._bytes_pattern = re.compile(pattern.encode())
+
+    def accepts(self, frame) -> bool:
+        if isinstance(frame, (bytes, bytearray)):
+            match = self._bytes_pattern.search(frame)
+            return match is None or match.group(1) in self._bytes_types
+        match = self._pattern.search(frame)
+        return match is None or match.group(1) in self.types
@@ -1,13 +1,14 @@
+import asyncio
 import aiohttp
 import uuid
 import json
 import logging
-import re
 from datetime import datetime
 from .base_factory import BaseFactory
 from . import models
 from . import actions
 from . import db
+from .symbols import SymbolRegistry, split_market
 
 
 class ExchangeListener(BaseFactory):
@@ -16,9 +17,17 @@ class ExchangeListener(BaseFactory):
         self.exchange = exchange
         self.event_type = event_type
         self.on_event = on_event
+        # called with each connection event logged, once it is committed
+        self.on_connection_event = None
+        # called with the db errors raised while handling events, instead of
+        # rolling back the session of the listener
+        self.on_db_error = None
         self.session = session
         self._session_id = uuid.uuid4()
         self._all_symbols = None
+        self.symbols = SymbolRegistry.for_exchange(exchange.name)
+        if not self.symbols.loaded:
+            self.symbols.load(session, exchange.id)
         self.markets = self._get_existing_markets(markets)
 
     def _get_existing_markets(self, markets):
@@ -45,7 +54,16 @@ class ExchangeListener(BaseFactory):
             markets = await self._fetch(http_session, markets_uri)
             logging.debug("markets retrieved from %s: %s", self.exchange.name, markets)
             actions = self._parse_markets(markets)
-            self.on_event(actions)
+            self._register_markets(actions)
+            await self._dispatch(actions)
+
+    async def _dispatch(self, actions):
+        """passes actions to the event handler and waits while it applies
+        backpressure, without blocking the event loop
+        """
+        pending = self.on_event(actions)
+        if asyncio.isfuture(pending):
+            await pending
 
     async def _fetch(self, http_session, url):
         async with http_session.get(url) as response:
@@ -59,32 +77,21 @@ class ExchangeListener(BaseFactory):
         raise NotImplementedError()
 
     def _parse_market_to_symbols(self, pair, all_symbols):
+        """returns the individual coin symbols of a market, from the symbol
+        registry or by splitting the market name
+        """
+        symbols = self.symbols.get(pair)
+        if symbols is None:
+            symbols = split_market(pair, all_symbols)
+            self.symbols.add(pair, symbols)
+        return symbols
+
+    def _register_markets(self, parsed_actions):
+        """adds the exchange markets inserted by the given actions to the symbol registry
         """
-        returns the individual coin symbols from a pair string of any possible length
-
-        >>> from types import SimpleNamespace
-        >>> symbols = ["BTC", "ETH", "WAVE", "USD"]
-        >>> dummy_self = SimpleNamespace(all_symbols=symbols)
-        >>> ExchangeListener._parse_market_to_symbols(dummy_self, "BTC_ETH", symbols)
-        ('BTC', 'ETH')
-        >>> ExchangeListener._parse_market_to_symbols(dummy_self, "BTCETH", symbols)
-        ('BTC', 'ETH')
-        >>> ExchangeListener._parse_market_to_symbols(dummy_self, "WAVEETH", symbols)
-        ('WAVE', 'ETH')
-        >>> ExchangeListener._parse_market_to_symbols(dummy_self, "USDWAVE", symbols)
-        ('USD', 'WAVE')
-        """   
-        split_at = lambda string, n: (string[:n], string[n:])
-        symbols = re.split("[_-]", pair)
-        if len(symbols) == 2:
-            return tuple(symbols)
-        if len(pair) % 2 == 0:
-            return split_at(pair, len(pair) // 2)
-        for split_index in range(2, 10):
-            symbols = split_at(pair, split_index)
-            if all(sym in all_symbols for sym in symbols):
-                return symbols
-        raise Exception("unknown pair {} to parse".format(pair))
+        for action in parsed_actions:
+            if isinstance(action, actions.InsertAction) and action.item_type is models.ExchangeMarket:
+                self.symbols.add_exchange_markets(action.items)
 
     @property
     def all_symbols(self):
@@ -107,6 +114,8 @@ class ExchangeListener(BaseFactory):
         action.execute(self.session)
         self.session.commit()
         logging.info("event log - {0} - commited to 'events' table".format(self.exchange.name))
+        if self.on_connection_event:
+            self.on_connection_event(event)
 
     def _compute_events(self, event_type, events):
         if event_type is None:
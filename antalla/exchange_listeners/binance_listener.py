@@ -2,11 +2,11 @@
 from os import path
 import json
 import logging
+import math
 
 from datetime import datetime
 import time
 
-from dateutil.parser import parse as parse_date
 import websockets
 import aiohttp
 import asyncio
@@ -15,15 +15,21 @@ from .. import settings
 from .. import db
 from .. import models
 from .. import actions
+from ..order_book import OrderBook, SequenceGap
+from ..records import AggOrderBatch, TradeRecord
 from ..exchange_listener import ExchangeListener
 from ..websocket_listener import WebsocketListener
 
 # needs to be 5, 10, 20, 50, 100, 500 or 1000
 DEPTH_SNAPSHOT_LIMIT = 1000
+# minimum interval between two requests of depth snapshots, in seconds
+SNAPSHOT_REQUEST_INTERVAL = 0.4
 
 
 @ExchangeListener.register("binance")
 class BinanceListener(WebsocketListener):
+    message_type_key = "e"
+
     def __init__(
         self,
         exchange,
@@ -32,26 +38,68 @@ class BinanceListener(WebsocketListener):
         ws_url=None,
         session=db.session,
         event_type=None,
+        connections=settings.BINANCE_CONNECTIONS,
+        max_streams_per_connection=settings.BINANCE_MAX_STREAMS_PER_CONNECTION,
     ):
         super().__init__(
             exchange, on_event, markets, ws_url, session=session, event_type=event_type
         )
         self.running = False
-        self._get_ws_url()
+        self.connections = connections
+        self.max_streams_per_connection = max_streams_per_connection
+        self._shards = self._get_shards()
+        self._connected_shards = set()
         self._api_url = settings.BINANCE_API
         self._all_symbols = []
+        self._symbols_lock = asyncio.Lock()
+        # in-memory books of the markets, by upper case market name without separator
+        self.order_books = {}
+        self._resyncing = set()
+        self._snapshot_lock = asyncio.Lock()
+
+    def _get_shards(self):
+        """spreads the markets over the combined stream connections, keeping
+        all the streams of a market on the same connection unless they do
+        not fit on a single one; returns the (market, stream) pairs of each
+        connection by URL
+        """
+        events = self._get_events()
+        per_connection = self.max_streams_per_connection // len(events)
+        if per_connection:
+            units = [[(pair, stream) for stream in events] for pair in self.markets]
+        else:
+            # the streams of a market alone exceed the limit of a connection
+            per_connection = 1
+            units = [[(pair, stream) for stream in events[i:i + self.max_streams_per_connection]]
+                     for pair in self.markets
+                     for i in range(0, len(events), self.max_streams_per_connection)]
+        if not units:
+            return {}
+        count = min(max(self.connections, math.ceil(len(units) / per_connection)), len(units))
+        size = math.ceil(len(units) / count)
+        shards = {}
+        for i in range(0, len(units), size):
+            shard = [pair_stream for unit in units[i:i + size] for pair_stream in unit]
+            names = ["".join(pair.lower().split("_")) + "@" + stream for pair, stream in shard]
+            shards[settings.BINANCE_COMBINED_STREAM + "/".join(names)] = shard
+        return shards
 
-    async def _listen(self):
-        initial_actions = await self._setup_listener()
-        self.on_event(initial_actions)
-        await super()._listen()
+    def _get_ws_urls(self):
+        return list(self._shards)
 
-    def _get_ws_url(self):
-        streams = []
-        for stream in self._get_events():
-            for pair in self.markets:
-                streams.append("".join(pair.lower().split("_")) + "@" + stream)
-        self._ws_url = settings.BINANCE_COMBINED_STREAM + "/".join(streams)
+    async def _listen(self, ws_url):
+        async with self._symbols_lock:
+            if not self._all_symbols:
+                async with aiohttp.ClientSession() as session:
+                    self._all_symbols = await self.fetch_all_symbols(session)
+        # updates may have been missed while the connection was down: the
+        # books are loaded from a new snapshot once their first diff is
+        # received, the diffs received in the meantime are buffered
+        for pair, stream in self._shards[ws_url]:
+            if stream == "depth":
+                market = self._get_market_key(pair)
+                self.order_books[market] = OrderBook(market)
+        await super()._listen(ws_url)
 
     def _get_events(self):
         if self.event_type is None:
@@ -59,10 +107,26 @@ class BinanceListener(WebsocketListener):
         return [self.event_type]
 
     async def _setup_connection(self, websocket):
-        for stream in self._get_events():
-            for pair in self.markets:
-                collected_data = self._get_event_data_collected(stream)
-                self._log_event(pair, "connect", collected_data)
+        # the streams are subscribed to through the URL of the connection
+        pass
+
+    def _on_connected(self, ws_url):
+        for pair, stream in self._shards[ws_url]:
+            self._log_event(pair, "connect", self._get_event_data_collected(stream))
+        self._connected_shards.add(ws_url)
+        self._connected = True
+
+    def _on_disconnected(self, ws_url):
+        if ws_url not in self._connected_shards:
+            return
+        self._connected_shards.discard(ws_url)
+        self._connected = bool(self._connected_shards)
+        for pair in dict.fromkeys(pair for pair, _stream in self._shards[ws_url]):
+            self._log_event(pair, "disconnect", "all")
+
+    def _log_disconnection(self):
+        for ws_url in list(self._connected_shards):
+            self._on_disconnected(ws_url)
 
     def _get_event_data_collected(self, data_type):
         if data_type == "trade":
@@ -75,33 +139,55 @@ class BinanceListener(WebsocketListener):
             )
             return "Unknown"
 
-    async def _setup_listener(self):
-        actions = []
-        async with aiohttp.ClientSession() as session:
-            self._all_symbols = await self.fetch_all_symbols(session)
-            events = self._get_events()
-            if "depth" in events:
-                requests = 0
-                for pair in self.markets:
-                    if requests % 10 == 0:
-                        await asyncio.sleep(4)
-                    uri = (
-                        settings.BINANCE_API
-                        + "/api/v1/depth?symbol="
-                        + "".join(pair.upper().split("_"))
-                        + "&limit="
-                        + str(DEPTH_SNAPSHOT_LIMIT)
-                    )
-                    snapshot = await self._fetch(session, uri)
-                    logging.debug("GET orderbook snapshot for '%s': %s", pair, snapshot)
-                    actions.extend(self._parse_snapshot(snapshot, pair))
-                    requests += 1
-        return actions
+    @staticmethod
+    def _get_market_key(pair):
+        return "".join(pair.upper().split("_"))
+
+    def _get_snapshot_uri(self, pair):
+        return (
+            settings.BINANCE_API
+            + "/api/v1/depth?symbol="
+            + self._get_market_key(pair)
+            + "&limit="
+            + str(DEPTH_SNAPSHOT_LIMIT)
+        )
+
+    def _request_resync(self, market):
+        """fetches a new snapshot of the book of a market in the background,
+        unless one is already being fetched
+        """
+        if market in self._resyncing:
+            return
+        self._resyncing.add(market)
+        asyncio.ensure_future(self._resync(market))
+
+    async def _resync(self, market):
+        try:
+            async with self._snapshot_lock:
+                async with aiohttp.ClientSession() as session:
+                    snapshot = await self._fetch(session, self._get_snapshot_uri(market))
+                await asyncio.sleep(SNAPSHOT_REQUEST_INTERVAL)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            # the book stays out of sync and is resynced on its next diff
+            logging.error("failed to fetch the order book snapshot of '%s': %s", market, e)
+            return
+        finally:
+            self._resyncing.discard(market)
+        logging.debug("GET orderbook snapshot for '%s': %s", market, snapshot)
+        try:
+            await self._dispatch(self._parse_snapshot(snapshot, market))
+        except Exception:
+            # e.g. an error payload without levels: the book is resynced on
+            # its next diff
+            logging.exception("failed to load the order book snapshot of '%s'", market)
+            book = self.order_books.get(market)
+            if book is not None:
+                book.invalidate()
 
     def _parse_snapshot(self, snapshot, pair):
         order_info = {
             "pair": pair,
-            "timestamp": time.time(),
+            "timestamp": int(time.time() * 1000),
             "last_update_id": snapshot["lastUpdateId"],
         }
         orders = self._convert_raw_orders(snapshot, "bids", "asks", order_info)
@@ -110,16 +196,31 @@ class BinanceListener(WebsocketListener):
             len(orders),
             pair.lower(),
         )
-        return self._parse_agg_orders(orders)
+        diffs = []
+        book = self.order_books.get(self._get_market_key(pair))
+        if book is not None:
+            try:
+                diffs = book.load_snapshot(orders)
+            except SequenceGap as e:
+                logging.warning("gap in the buffered depth updates of %s: %s", self.exchange.name, e)
+                book.invalidate()
+                self._request_resync(book.market)
+                return []
+            if diffs:
+                # the snapshot must come before the diffs which follow it
+                orders.timestamp = min(orders.timestamp, diffs[0].timestamp - 1)
+        return [actions.InsertAction([batch for batch in [orders] + diffs if len(batch)])]
 
     def _parse_depthUpdate(self, update):
-        # FIXME: could check for last "U" = "u+1" from previous update
         order_info = {
             "pair": update["s"],
             "timestamp": update["E"],
             "last_update_id": update["u"],
         }
         orders = self._convert_raw_orders(update, "b", "a", order_info)
+        book = self.order_books.get(self._get_market_key(update["s"]))
+        if book is not None and not self._apply_to_book(book, orders, update["U"]):
+            return []
         pair = self._parse_market_to_symbols(update["s"], self._all_symbols)
         logging.debug(
             "parsed %d orders in 'depth update' for pair '%s'",
@@ -128,38 +229,38 @@ class BinanceListener(WebsocketListener):
         )
         return self._parse_agg_orders(orders)
 
+    def _apply_to_book(self, book, orders, first_update_id):
+        """applies a diff to the book of its market; a gap in the update ids
+        invalidates the book and resyncs it. Returns whether the diff was
+        applied, i.e. if it should be stored
+        """
+        try:
+            applied = book.apply(orders, first_update_id)
+        except SequenceGap as e:
+            logging.warning("gap in the depth updates of %s: %s", self.exchange.name, e)
+            book.invalidate()
+            applied = book.apply(orders, first_update_id)
+        if not book.synced:
+            self._request_resync(book.market)
+        return applied
+
     def _get_uri(self, endpoint):
         return path.join(settings.BINANCE_API, settings.BINANCE_PUBLIC_API, endpoint)
 
-    def _create_agg_order(self, order_info, order_type, price, size):
+    def _convert_raw_orders(self, orders, bid_key, ask_key, order_info):
         pair = self._parse_market_to_symbols(order_info["pair"], self._all_symbols)
-        return models.AggOrder(
-            timestamp=datetime.fromtimestamp(order_info["timestamp"] / 1000),
+        # timestamps are kept as epochs in milliseconds until they are written
+        values = dict(
+            timestamp=order_info["timestamp"],
             last_update_id=order_info["last_update_id"],
             buy_sym_id=pair[0],
             sell_sym_id=pair[1],
             exchange_id=self.exchange.id,
-            order_type=order_type,
-            price=price,
-            size=size,
         )
+        return AggOrderBatch.from_levels(orders[bid_key], orders[ask_key], **values)
 
-    def _convert_raw_orders(self, orders, bid_key, ask_key, order_info):
-        all_orders = []
-        for bid in orders[bid_key]:
-            new_bid_order = self._create_agg_order(
-                order_info, "bid", float(bid[0]), float(bid[1])
-            )
-            all_orders.append(new_bid_order)
-        for ask in orders[ask_key]:
-            new_ask_order = self._create_agg_order(
-                order_info, "ask", float(ask[0]), float(ask[1])
-            )
-            all_orders.append(new_ask_order)
-        return all_orders
-
-    def _parse_agg_orders(self, orders):
-        return [actions.InsertAction(orders)]
+    def _parse_agg_orders(self, batch):
+        return [actions.InsertAction([batch] if len(batch) else [])]
 
     def _parse_message(self, message):
         event, payload = message["data"]["e"], message["data"]
@@ -175,8 +276,8 @@ class BinanceListener(WebsocketListener):
         return [actions.InsertAction([trade])]
 
     def _convert_raw_trade(self, raw_trade, buy_sym, sell_sym):
-        return models.Trade(
-            timestamp=datetime.fromtimestamp(raw_trade["T"] / 1000),
+        return TradeRecord(
+            timestamp=raw_trade["T"],
             exchange_id=self.exchange.id,
             buy_sym_id=buy_sym,
             sell_sym_id=sell_sym,
@@ -195,6 +296,8 @@ class BinanceListener(WebsocketListener):
         for symbol_info in exchange_info["symbols"]:
             all_symbols.add(symbol_info["baseAsset"])
             all_symbols.add(symbol_info["quoteAsset"])
+            self.symbols.add(symbol_info["symbol"],
+                             (symbol_info["baseAsset"], symbol_info["quoteAsset"]))
         return set(all_symbols)
 
     async def get_markets(self):
@@ -206,7 +309,8 @@ class BinanceListener(WebsocketListener):
             )
             logging.debug("markets retrieved from %s: %s", self.exchange.name, markets)
             actions = self._parse_markets(markets)
-            self.on_event(actions)
+            self._register_markets(actions)
+            await self._dispatch(actions)
 
     def _parse_markets(self, markets):
         new_markets = []
@@ -3,21 +3,25 @@ import logging
 
 from datetime import datetime
 
-from dateutil.parser import parse as parse_date
 import websockets
 import aiohttp
 import asyncio
+import numpy as np
 
 from .. import db
 from .. import settings
 from .. import models
 from .. import actions
+from ..records import AggOrderBatch, TradeRecord
+from ..timestamps import parse_iso
 from ..exchange_listener import ExchangeListener
 from ..websocket_listener import WebsocketListener
 
 
 @ExchangeListener.register("coinbase")
 class CoinbaseListener(WebsocketListener):
+    message_type_key = "type"
+
     def __init__(
         self,
         exchange,
@@ -67,7 +71,6 @@ class CoinbaseListener(WebsocketListener):
         return []
 
     def _parse_snapshot(self, snapshot):
-        agg_orders = []
         buy_sym_id, sell_sym_id = snapshot["product_id"].split("-")
         timestamp = datetime.now()
         order_info = dict(
@@ -82,44 +85,23 @@ class CoinbaseListener(WebsocketListener):
         )
         if market_key not in self.last_update_ids.keys():
             self.last_update_ids[market_key] = 0
-        bids = self._create_agg_orders("bid", order_info, snapshot["bids"])
-        asks = self._create_agg_orders("ask", order_info, snapshot["asks"])
-        agg_orders.extend(bids)
-        agg_orders.extend(asks)
-        if len(agg_orders) > 0:
+        batch = AggOrderBatch.from_levels(
+            snapshot["bids"],
+            snapshot["asks"],
+            last_update_id=self.last_update_ids[market_key],
+            **order_info
+        )
+        if len(batch) > 0:
             self.last_update_ids[market_key] += 1
         logging.debug(
             " {} - aggregated order book snapshot - agg orders: {}".format(
-                self.exchange.name, len(agg_orders)
+                self.exchange.name, len(batch)
             )
         )
-        return [actions.InsertAction(agg_orders)]
-
-    def _create_agg_orders(self, order_type, order_info, orders):
-        parsed_orders = []
-        market_key = (
-            self.exchange.name.lower()
-            + order_info["buy_sym_id"].upper()
-            + order_info["sell_sym_id"].upper()
-        )
-        for order in orders:
-            parsed_orders.append(
-                models.AggOrder(
-                    timestamp=order_info["timestamp"],
-                    exchange_id=self.exchange.id,
-                    order_type=order_type,
-                    price=float(order[0]),
-                    size=float(order[1]),
-                    buy_sym_id=order_info["buy_sym_id"],
-                    sell_sym_id=order_info["sell_sym_id"],
-                    last_update_id=self.last_update_ids[market_key],
-                )
-            )
-        return parsed_orders
+        return [actions.InsertAction([batch] if len(batch) else [])]
 
     # TODO: add check for valid market
     def _parse_l2update(self, update):
-        agg_orders = []
         buy_sym_id, sell_sym_id = update["product_id"].split("-")
         market_key = (
             self.exchange.name.lower() + buy_sym_id.upper() + sell_sym_id.upper()
@@ -127,24 +109,22 @@ class CoinbaseListener(WebsocketListener):
         # TODO: remove if statement below
         if market_key not in self.last_update_ids.keys():
             self.last_update_ids[market_key] = 0
-        timestamp = datetime.now()
-        for order in update["changes"]:
-            order[0] = "bid" if order[0] == "buy" else "ask"
-            agg_orders.append(
-                models.AggOrder(
-                    timestamp=timestamp,
-                    exchange_id=self.exchange.id,
-                    order_type=order[0],
-                    price=float(order[1]),
-                    size=float(order[2]),
-                    buy_sym_id=buy_sym_id,
-                    sell_sym_id=sell_sym_id,
-                    last_update_id=self.last_update_ids[market_key],
-                )
-            )
-        if agg_orders:
-            self.last_update_ids[market_key] += 1
-        return [actions.InsertAction(agg_orders)]
+        if not update["changes"]:
+            return [actions.InsertAction([])]
+        # changes are [side, price, size] triples
+        changes = np.array(update["changes"])
+        batch = AggOrderBatch(
+            changes[:, 1].astype(float),
+            changes[:, 2].astype(float),
+            changes[:, 0] == "buy",
+            timestamp=datetime.now(),
+            exchange_id=self.exchange.id,
+            buy_sym_id=buy_sym_id,
+            sell_sym_id=sell_sym_id,
+            last_update_id=self.last_update_ids[market_key],
+        )
+        self.last_update_ids[market_key] += 1
+        return [actions.InsertAction([batch])]
 
     def _get_markets_uri(self):
         return settings.COINBASE_API + "/" + settings.COINBASE_API_PRODUCTS
@@ -163,7 +143,8 @@ class CoinbaseListener(WebsocketListener):
             markets = await self._get_volume(incomplete_markets)
             logging.debug("retrieved complete markets: %s", markets)
             actions = self._parse_markets(markets)
-            self.on_event(actions)
+            self._register_markets(actions)
+            await self._dispatch(actions)
 
     async def _get_volume(self, markets):
         complete_markets = []
@@ -237,8 +218,8 @@ class CoinbaseListener(WebsocketListener):
         return [actions.InsertAction([self._convert_raw_match(match)])]
 
     def _convert_raw_match(self, match):
-        return models.Trade(
-            timestamp=parse_date(match["time"]),
+        return TradeRecord(
+            timestamp=parse_iso(match["time"]),
             exchange_id=self.exchange.id,
             trade_type=match["side"],
             buy_sym_id=match["product_id"].split("-")[0],
@@ -4,7 +4,6 @@ import logging
 from datetime import datetime
 from os import path
 
-from dateutil.parser import parse as parse_date
 import websockets
 import aiohttp
 import asyncio
@@ -13,6 +12,8 @@ from .. import db
 from .. import settings
 from .. import models
 from .. import actions
+from ..records import AggOrderRecord, TradeRecord
+from ..timestamps import TimestampCache, parse_iso
 from ..exchange_listener import ExchangeListener
 from ..websocket_listener import WebsocketListener
 
@@ -20,6 +21,8 @@ TRADES_LIMIT = 1000
 
 @ExchangeListener.register("hitbtc")
 class HitBTCListener(WebsocketListener):
+    message_type_key = "method"
+
     def __init__(self,
                  exchange,
                  on_event,
@@ -43,6 +46,7 @@ class HitBTCListener(WebsocketListener):
                 baseCurrency=symbol_info["baseCurrency"],
                 quoteCurrency=symbol_info["quoteCurrency"]
                 ))
+            self.symbols.add(symbol_info["id"], self._get_symbols(symbol_info["id"], symbol_info))
         return all_symbols
 
     async def get_markets(self):
@@ -54,20 +58,30 @@ class HitBTCListener(WebsocketListener):
             markets = await self._fetch(session, markets_uri)
             logging.debug("hitbtc - markets retrieved: %s", markets)
             actions = self._parse_markets(markets)
-            self.on_event(actions)
+            self._register_markets(actions)
+            await self._dispatch(actions)
 
     def _parse_market_to_symbols(self, market, all_symbols):
+        pair = self.symbols.get(market)
+        if pair is not None:
+            return pair
         for m in all_symbols:
             if m["id"] == market.upper():
-                base, quote = m["baseCurrency"], m["quoteCurrency"]
-                # edge case with USDTUSD pair
-                if base == "USD" and market.startswith("USDT") and quote != "TUSD":
-                    base = "USDT"
-                if quote == "USD" and market.endswith("USDT"):
-                    quote = "USDT"
-                return base, quote
+                pair = self._get_symbols(market, m)
+                self.symbols.add(market, pair)
+                return pair
         return None, None
 
+    @staticmethod
+    def _get_symbols(market, symbol_info):
+        base, quote = symbol_info["baseCurrency"], symbol_info["quoteCurrency"]
+        # edge case with USDTUSD pair
+        if base == "USD" and market.startswith("USDT") and quote != "TUSD":
+            base = "USDT"
+        if quote == "USD" and market.endswith("USDT"):
+            quote = "USDT"
+        return base, quote
+
     def _parse_markets(self, markets):
         add_markets = []
         add_exchange_markets = []
@@ -93,7 +107,7 @@ class HitBTCListener(WebsocketListener):
                     exchange_id=self.exchange.id,
                     first_coin_id=pair[0],
                     second_coin_id=pair[1],
-                    quoted_vol_timestamp=parse_date(market["timestamp"]),
+                    quoted_vol_timestamp=parse_iso(market["timestamp"]),
                     original_name=market["symbol"]
                 ))
             else:
@@ -134,37 +148,28 @@ class HitBTCListener(WebsocketListener):
             logging.warning("unable to parse market '%s' to two symbols", raw_orders["symbol"])
             return []
 
-    def _create_agg_order(self, order_info, order_type, price, size):
-        pair = self._parse_market_to_symbols(order_info["pair"], self._all_symbols)
-        if pair is not None:
-            return models.AggOrder(
-                timestamp=parse_date(order_info["timestamp"]),
-                last_update_id=order_info["last_update_id"],
-                buy_sym_id=pair[0],
-                sell_sym_id=pair[1],
-                exchange_id=self.exchange.id,
-                order_type=order_type,
-                price=price,
-                size=size 
-            )
-        else:
-            logging.warning("no market found for: '%s'", order_info["pair"])
-
     def _parse_updateOrderbook(self, orders):
         return self._handle_raw_orders(orders)
 
     def _convert_raw_orders(self, orders, bid_key, ask_key, order_info, sequence):
+        pair = self._parse_market_to_symbols(order_info["pair"], self._all_symbols)
+        if pair is None:
+            logging.warning("no market found for: '%s'", order_info["pair"])
+            return []
+        values = dict(
+            timestamp=parse_iso(order_info["timestamp"]),
+            last_update_id=order_info["last_update_id"],
+            buy_sym_id=pair[0],
+            sell_sym_id=pair[1],
+            exchange_id=self.exchange.id,
+        )
         all_orders = []
         for bid in orders[bid_key]:
-            new_bid_order = self._create_agg_order(
-                order_info, "bid", float(bid["price"]), float(bid["size"]))
-            if new_bid_order is not None:
-                all_orders.append(new_bid_order)
+            all_orders.append(AggOrderRecord(
+                order_type="bid", price=float(bid["price"]), size=float(bid["size"]), **values))
         for ask in orders[ask_key]:
-            new_ask_order = self._create_agg_order(
-                order_info, "ask", float(ask["price"]), float(ask["size"]))
-            if new_ask_order is not None:
-                all_orders.append(new_ask_order)       
+            all_orders.append(AggOrderRecord(
+                order_type="ask", price=float(ask["price"]), size=float(ask["size"]), **values))
         return all_orders
 
     def _parse_agg_orders(self, orders):
@@ -206,9 +211,10 @@ class HitBTCListener(WebsocketListener):
     def _parse_raw_trades(self, snapshot):
         market = self._parse_market_to_symbols(snapshot["symbol"], self._all_symbols)
         trades = []
+        timestamps = TimestampCache()
         for trade in snapshot["data"]:
-            trades.append(models.Trade(
-                timestamp=parse_date(trade["timestamp"]),
+            trades.append(TradeRecord(
+                timestamp=timestamps.parse_iso(trade["timestamp"]),
                 trade_type=trade["side"],
                 exchange_id=self.exchange.id,
                 buy_sym_id= market[0],
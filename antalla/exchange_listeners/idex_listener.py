@@ -4,7 +4,6 @@ import logging
 from datetime import datetime
 import time
 
-from dateutil.parser import parse as parse_date
 from sqlalchemy.sql.expression import tuple_
 import websockets
 
@@ -12,6 +11,8 @@ from .. import db
 from .. import settings
 from .. import models
 from .. import actions
+from ..records import TradeRecord
+from ..timestamps import TimestampCache, parse_iso
 from ..exchange_listener import ExchangeListener
 from ..websocket_listener import WebsocketListener
 
@@ -23,6 +24,8 @@ MAX_MARKETS = 100
 
 @ExchangeListener.register("idex")
 class IdexListener(WebsocketListener):
+    message_type_key = "event"
+
     def __init__(self,
                  exchange,
                  on_event,
@@ -92,7 +95,7 @@ class IdexListener(WebsocketListener):
             return "Unknown"
 
     def _parse_message(self, message):
-        event, payload = message["event"], json.loads(message["payload"])
+        event, payload = message["event"], self._decode(message["payload"])
         func = getattr(self, f"_parse_{event}", None)
         if func:
             return func(payload)
@@ -102,15 +105,17 @@ class IdexListener(WebsocketListener):
         buy_sym, sell_sym = payload["market"].split("_")
         orders = []
         order_sizes = []
+        timestamps = TimestampCache()
         for order in payload["orders"]:
-            orders.append(self._convert_raw_order(order, buy_sym, sell_sym))
+            timestamp = timestamps.parse_iso(order["createdAt"])
+            orders.append(self._convert_raw_order(order, buy_sym, sell_sym, timestamp))
             order_sizes.append(self._new_order_size(
-                order["createdAt"], float(order["amountBuy"]), order["hash"]))
+                timestamp, float(order["amountBuy"]), order["hash"]))
         return [actions.InsertAction(orders), actions.InsertAction(order_sizes)]
 
-    def _convert_raw_order(self, raw_order, buy_sym, sell_sym):
+    def _convert_raw_order(self, raw_order, buy_sym, sell_sym, timestamp):
         return models.Order(
-            timestamp=parse_date(raw_order["createdAt"]),
+            timestamp=timestamp,
             exchange_id=self.exchange.id,
             buy_sym_id=buy_sym,
             sell_sym_id=sell_sym,
@@ -122,7 +127,7 @@ class IdexListener(WebsocketListener):
 
     def _new_order_size(self, timestamp, size, order_id):
         return models.OrderSize(
-            timestamp=parse_date(timestamp),
+            timestamp=timestamp,
             exchange_id=self.exchange.id,
             exchange_order_id=order_id,
             size=float(size)
@@ -134,7 +139,7 @@ class IdexListener(WebsocketListener):
                 update_actions.append(actions.UpdateAction(
                     models.Order,
                     {"exchange_order_id": cancel["orderHash"], "exchange_id": self.exchange.id},
-                    {"cancelled_at": parse_date(cancel["createdAt"])}
+                    {"cancelled_at": parse_iso(cancel["createdAt"])}
                 ))
         return update_actions
 
@@ -142,19 +147,21 @@ class IdexListener(WebsocketListener):
         update_actions = []
         buy_sym, sell_sym = payload["market"].split("_")
         trades = []
+        timestamps = TimestampCache()
         for trade in payload["trades"]:
-            trades.append(self._convert_raw_trade(trade, buy_sym, sell_sym))
+            timestamp = timestamps.from_epoch(trade["timestamp"])
+            trades.append(self._convert_raw_trade(trade, buy_sym, sell_sym, timestamp))
             update_actions.append(actions.UpdateAction(
                     models.Order,
                     {"exchange_order_id": trade["orderHash"], "exchange_id": self.exchange.id},
-                    {"filled_at": datetime.fromtimestamp(trade["timestamp"])}
+                    {"filled_at": timestamp}
                 ))
         insert_actions = [actions.InsertAction(trades)]
         return insert_actions + update_actions
 
-    def _convert_raw_trade(self, raw_trade, buy_sym, sell_sym):
-        return models.Trade(
-            timestamp=datetime.fromtimestamp(raw_trade["timestamp"]),
+    def _convert_raw_trade(self, raw_trade, buy_sym, sell_sym, timestamp):
+        return TradeRecord(
+            timestamp=timestamp,
             trade_type=raw_trade["type"],
             exchange_id=self.exchange.id,
             # idex market pairs are not following the normal convention, i.e. ETH/BTC does not mean price is expressed in BTC (but ETH)
@@ -0,0 +1,86 @@
+import math
+import logging
+
+from . import models
+from .actions import InsertAction
+from .records import AggOrderBatch
+from .ob_snapshot_generator import OrderBookReplay, create_snapshots
+
+
+class LiveSnapshots:
+    """order books of the markets being ingested, kept in memory from the agg
+    orders received, from which order book snapshots are taken every
+    ``interval`` seconds without reading the orders back from the db
+
+    >>> from datetime import datetime
+    >>> live = LiveSnapshots(interval=1)
+    >>> live.observe([InsertAction([AggOrderBatch.from_levels(
+    ...     [["1.0", "2"], ["2.0", "1"]], [["3.0", "1"]], last_update_id=1,
+    ...     exchange_id=1, buy_sym_id="ETH", sell_sym_id="BTC")])])
+    >>> [(snapshot.max_bid_price, snapshot.min_ask_price, snapshot.spread)
+    ...  for snapshot in live.take_snapshots(datetime(2020, 1, 1))]
+    [(2.0, 3.0, 1.0)]
+    """
+
+    def __init__(self, interval, mid_price_range=None):
+        self.interval = interval
+        if mid_price_range is None:
+            mid_price_range = 0
+        self.mid_price_range = mid_price_range
+        self.books = {}
+
+    def observe(self, actions):
+        """applies the agg orders inserted by the given actions to the books
+        of their markets
+        """
+        for action in actions:
+            if not isinstance(action, InsertAction) or action.item_type is not models.AggOrder:
+                continue
+            for item in action.items:
+                if item.last_update_id is None:
+                    continue
+                book = self._get_book(item.exchange_id, item.buy_sym_id, item.sell_sym_id)
+                if isinstance(item, AggOrderBatch):
+                    for price, size, is_bid in zip(item.prices.tolist(), item.sizes.tolist(),
+                                                   item.is_bid.tolist()):
+                        book.apply("bid" if is_bid else "ask", price, size, item.last_update_id)
+                else:
+                    book.apply(item.order_type, item.price, item.size, item.last_update_id)
+
+    def on_connection_event(self, event):
+        """discards the book of a market once it is disconnected, as the
+        orders received after reconnecting start a new book
+        """
+        if event.connection_event != "disconnect":
+            return
+        for key in [(event.exchange_id, event.buy_sym_id, event.sell_sym_id),
+                    (event.exchange_id, event.sell_sym_id, event.buy_sym_id)]:
+            self.books.pop(key, None)
+
+    def next_snapshot_time(self, now):
+        """returns the first multiple of the interval after ``now``, given
+        in seconds since the epoch
+        """
+        return (math.floor(now / self.interval) + 1) * self.interval
+
+    def take_snapshots(self, timestamp):
+        """returns the snapshots of the books with both bids and asks at
+        ``timestamp``
+        """
+        books = []
+        for (exchange_id, buy_sym_id, sell_sym_id), book in self.books.items():
+            levels = book.snapshot_levels(self.mid_price_range)
+            if levels is None:
+                logging.debug("no bids or asks in order book of %s_%s", buy_sym_id, sell_sym_id)
+                continue
+            metadata = dict(exchange_id=exchange_id, buy_sym_id=buy_sym_id,
+                            sell_sym_id=sell_sym_id, timestamp=timestamp)
+            books.append((metadata, levels))
+        return create_snapshots(books, self.mid_price_range)
+
+    def _get_book(self, exchange_id, buy_sym_id, sell_sym_id):
+        key = (exchange_id, buy_sym_id, sell_sym_id)
+        book = self.books.get(key)
+        if book is None:
+            book = self.books[key] = OrderBookReplay()
+        return book
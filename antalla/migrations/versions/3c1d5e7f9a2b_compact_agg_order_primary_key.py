@@ -0,0 +1,44 @@
+"""compact agg order primary key
+
+Replaces the SHA-256 hex 'hash_id' primary key of the aggregate orders with a
+bigint identity key. Uniqueness of the orders is enforced by latest_orders_index.
+
+Revision ID: 3c1d5e7f9a2b
+Revises: 4070698d0213
+Create Date: 2026-10-18 10:12:31.204518
+
+"""
+from antalla.settings import TABLE_PREFIX
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "3c1d5e7f9a2b"
+down_revision = "4070698d0213"
+branch_labels = None
+depends_on = None
+
+TABLE_NAME = TABLE_PREFIX + "aggregate_orders"
+
+
+def upgrade():
+    op.drop_constraint(TABLE_NAME + "_pkey", TABLE_NAME, type_="primary")
+    op.execute(f"ALTER TABLE {TABLE_NAME} ADD COLUMN id BIGSERIAL PRIMARY KEY")
+    op.drop_column(TABLE_NAME, "hash_id")
+
+
+def downgrade():
+    op.add_column(TABLE_NAME, sa.Column("hash_id", sa.String))
+    # same input as the former AggOrder.pk_hash, up to the formatting of the price
+    op.execute(
+        f"""
+    UPDATE {TABLE_NAME}
+    SET hash_id = encode(sha256(convert_to(
+        coalesce(last_update_id::text, 'None') || exchange_id::text || order_type || price::text,
+        'UTF8')), 'hex')
+    """
+    )
+    op.drop_constraint(TABLE_NAME + "_pkey", TABLE_NAME, type_="primary")
+    op.create_primary_key(TABLE_NAME + "_pkey", TABLE_NAME, ["hash_id"])
+    op.drop_column(TABLE_NAME, "id")
@@ -0,0 +1,58 @@
+"""create order book checkpoint table
+
+Stores the price levels of the order books rebuilt by the snapshot
+generator, so that it can resume from the nearest checkpoint.
+
+Revision ID: 5b8e2f4a7c91
+Revises: 9e2b6c4d8f13
+Create Date: 2026-10-18 17:21:08.413752
+
+"""
+from antalla.settings import TABLE_PREFIX
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = "5b8e2f4a7c91"
+down_revision = "9e2b6c4d8f13"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        TABLE_PREFIX + "order_book_checkpoints",
+        sa.Column(
+            "exchange_id",
+            sa.Integer,
+            sa.ForeignKey(TABLE_PREFIX + "exchanges.id"),
+            nullable=False,
+            primary_key=True,
+        ),
+        sa.Column(
+            "buy_sym_id",
+            sa.String,
+            sa.ForeignKey(TABLE_PREFIX + "coins.symbol"),
+            nullable=False,
+            primary_key=True,
+        ),
+        sa.Column(
+            "sell_sym_id",
+            sa.String,
+            sa.ForeignKey(TABLE_PREFIX + "coins.symbol"),
+            nullable=False,
+            primary_key=True,
+        ),
+        sa.Column("timestamp", sa.DateTime, nullable=False, primary_key=True),
+        sa.Column("connect_time", sa.DateTime, nullable=False),
+        sa.Column("is_bid", postgresql.ARRAY(sa.Boolean), nullable=False),
+        sa.Column("prices", postgresql.ARRAY(sa.Float), nullable=False),
+        sa.Column("sizes", postgresql.ARRAY(sa.Float), nullable=False),
+        sa.Column("last_update_ids", postgresql.ARRAY(sa.BigInteger), nullable=False),
+    )
+
+
+def downgrade():
+    op.drop_table(TABLE_PREFIX + "order_book_checkpoints")
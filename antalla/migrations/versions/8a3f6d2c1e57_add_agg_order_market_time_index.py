@@ -0,0 +1,39 @@
+"""add agg order market time index
+
+Covering index of the aggregate orders of a market by time, used to
+replay the orders of a market and to compute snapshots in SQL without
+reading the table rows.
+
+Revision ID: 8a3f6d2c1e57
+Revises: 5b8e2f4a7c91
+Create Date: 2026-10-18 19:02:46.118305
+
+"""
+from antalla.settings import TABLE_PREFIX
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "8a3f6d2c1e57"
+down_revision = "5b8e2f4a7c91"
+branch_labels = None
+depends_on = None
+
+TABLE_NAME = TABLE_PREFIX + "aggregate_orders"
+INDEX_NAME = "market_time_orders_index"
+
+
+def upgrade():
+    # created on the partitioned table, so that it is created on each of its
+    # partitions, including the ones created later
+    op.execute(
+        f"""
+    CREATE INDEX {INDEX_NAME} ON {TABLE_NAME}
+        (exchange_id, first_coin_id, second_coin_id, "timestamp")
+        INCLUDE (id, buy_sym_id, sell_sym_id, order_type, price, size, last_update_id)
+    """
+    )
+
+
+def downgrade():
+    op.execute(f"DROP INDEX {INDEX_NAME}")
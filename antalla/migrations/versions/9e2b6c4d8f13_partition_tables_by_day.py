@@ -0,0 +1,218 @@
+"""partition tables by day
+
+Converts the aggregate orders, trades and order book snapshots tables to
+native range partitioning on 'timestamp', with one partition per day and a
+default partition for rows outside of the existing partitions.
+Unique indexes of partitioned tables must contain the partition key, so
+'timestamp' is added to the primary keys and to latest_orders_index.
+
+Requires PostgreSQL 11 or later.
+
+Revision ID: 9e2b6c4d8f13
+Revises: 3c1d5e7f9a2b
+Create Date: 2026-10-18 14:03:52.771930
+
+"""
+from antalla.settings import TABLE_PREFIX
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "9e2b6c4d8f13"
+down_revision = "3c1d5e7f9a2b"
+branch_labels = None
+depends_on = None
+
+# number of daily partitions created ahead of the current date,
+# further partitions are created with 'antalla partitions'
+PRECREATED_DAYS = 7
+
+AGG_ORDERS = TABLE_PREFIX + "aggregate_orders"
+TRADES = TABLE_PREFIX + "trades"
+SNAPSHOTS = TABLE_PREFIX + "order_book_snapshots"
+
+COINS = TABLE_PREFIX + "coins"
+EXCHANGES = TABLE_PREFIX + "exchanges"
+
+TABLES = [
+    dict(
+        name=AGG_ORDERS,
+        primary_key=["id", "timestamp"],
+        previous_primary_key=["id"],
+        unique_indexes={
+            "latest_orders_index": ["order_type", "price", "last_update_id", "exchange_id", "timestamp"],
+        },
+        previous_unique_indexes={
+            "latest_orders_index": ["order_type", "price", "last_update_id", "exchange_id"],
+        },
+        indexes={
+            f"ix_{AGG_ORDERS}_buy_sym_id": ["buy_sym_id"],
+            f"ix_{AGG_ORDERS}_exchange_id": ["exchange_id"],
+            f"ix_{AGG_ORDERS}_first_coin_id": ["first_coin_id"],
+            f"ix_{AGG_ORDERS}_price": ["price"],
+            f"ix_{AGG_ORDERS}_second_coin_id": ["second_coin_id"],
+            f"ix_{AGG_ORDERS}_sell_sym_id": ["sell_sym_id"],
+            f"ix_{AGG_ORDERS}_timestamp": ["timestamp"],
+            "market_orders_index": ["first_coin_id", "second_coin_id", "exchange_id"],
+        },
+        foreign_keys={
+            "buy_sym_id": (COINS, "symbol"),
+            "sell_sym_id": (COINS, "symbol"),
+            "first_coin_id": (COINS, "symbol"),
+            "second_coin_id": (COINS, "symbol"),
+            "exchange_id": (EXCHANGES, "id"),
+        },
+        sequence=AGG_ORDERS + "_id_seq",
+    ),
+    dict(
+        name=TRADES,
+        primary_key=["exchange_trade_id", "exchange_id", "timestamp"],
+        previous_primary_key=["exchange_trade_id", "exchange_id"],
+        indexes={
+            f"ix_{TRADES}_buy_sym_id": ["buy_sym_id"],
+            f"ix_{TRADES}_exchange_order_id": ["exchange_order_id"],
+            f"ix_{TRADES}_maker_order_id": ["maker_order_id"],
+            f"ix_{TRADES}_sell_sym_id": ["sell_sym_id"],
+            f"ix_{TRADES}_taker_order_id": ["taker_order_id"],
+            f"ix_{TRADES}_timestamp": ["timestamp"],
+        },
+        foreign_keys={
+            "buy_sym_id": (COINS, "symbol"),
+            "sell_sym_id": (COINS, "symbol"),
+            "exchange_id": (EXCHANGES, "id"),
+        },
+    ),
+    dict(
+        name=SNAPSHOTS,
+        primary_key=["timestamp", "snapshot_type", "mid_price_range",
+                     "buy_sym_id", "sell_sym_id", "exchange_id"],
+        indexes={
+            f"ix_{SNAPSHOTS}_buy_sym_id": ["buy_sym_id"],
+            f"ix_{SNAPSHOTS}_exchange_id": ["exchange_id"],
+            f"ix_{SNAPSHOTS}_sell_sym_id": ["sell_sym_id"],
+            f"ix_{SNAPSHOTS}_spread": ["spread"],
+        },
+        foreign_keys={
+            "buy_sym_id": (COINS, "symbol"),
+            "sell_sym_id": (COINS, "symbol"),
+            "exchange_id": (EXCHANGES, "id"),
+        },
+    ),
+]
+
+
+def _columns(columns):
+    return ", ".join(f'"{column}"' for column in columns)
+
+
+def _create_daily_partitions(table, source):
+    """creates one partition per day from the first day with data in the source
+    table until PRECREATED_DAYS after the current date, named <table>_pYYYYMMDD
+    as expected by antalla.partitions
+    """
+    op.execute(
+        f"""
+    DO $$
+    DECLARE
+        day date;
+    BEGIN
+        FOR day IN
+            SELECT generate_series(
+                coalesce((SELECT min("timestamp")::date FROM {source}), current_date),
+                current_date + {PRECREATED_DAYS},
+                interval '1 day')::date
+        LOOP
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF {table} FOR VALUES FROM (%L) TO (%L)',
+                '{table}_p' || to_char(day, 'YYYYMMDD'), day, day + 1);
+        END LOOP;
+    END
+    $$;
+    """
+    )
+    op.execute(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT")
+
+
+def _create_keys(spec, primary_key, unique_indexes):
+    table = spec["name"]
+    op.execute(
+        f"ALTER TABLE {table} ADD CONSTRAINT {table}_pkey PRIMARY KEY ({_columns(primary_key)})"
+    )
+    for name, columns in unique_indexes.items():
+        op.execute(f"CREATE UNIQUE INDEX {name} ON {table} ({_columns(columns)})")
+
+
+def _create_dependents(spec):
+    table = spec["name"]
+    for name, columns in spec["indexes"].items():
+        op.execute(f"CREATE INDEX {name} ON {table} ({_columns(columns)})")
+    for column, (referred_table, referred_column) in spec["foreign_keys"].items():
+        op.create_foreign_key(
+            f"{table}_{column}_fkey", table, referred_table, [column], [referred_column]
+        )
+    if spec.get("sequence"):
+        op.execute(f"ALTER SEQUENCE {spec['sequence']} OWNED BY {table}.id")
+    if table == AGG_ORDERS:
+        op.execute(
+            f"""
+        CREATE TRIGGER update_exchange_markets_agg_orders_count
+        AFTER INSERT ON {table}
+        FOR EACH ROW
+        EXECUTE PROCEDURE update_agg_orders_count();
+        """
+        )
+
+
+def _release_names(spec, unique_indexes):
+    """renames the table and drops its key and indexes, so that their names
+    can be used by the rebuilt table
+    """
+    table = spec["name"]
+    old_table = table + "_old"
+    op.execute(f"ALTER TABLE {table} RENAME TO {old_table}")
+    op.execute(f"ALTER TABLE {old_table} DROP CONSTRAINT {table}_pkey")
+    for name in list(unique_indexes) + list(spec["indexes"]):
+        op.execute(f"DROP INDEX {name}")
+    return old_table
+
+
+def _check_server_version():
+    connection = op.get_bind()
+    version = connection.execute("SHOW server_version_num").scalar()
+    if int(version) < 110000:
+        raise RuntimeError("partitioned tables require PostgreSQL 11 or later")
+
+
+def upgrade():
+    _check_server_version()
+    for spec in TABLES:
+        table = spec["name"]
+        old_table = _release_names(spec, spec.get("previous_unique_indexes", {}))
+        op.execute(
+            f"""
+        CREATE TABLE {table} (LIKE {old_table} INCLUDING DEFAULTS)
+        PARTITION BY RANGE ("timestamp")
+        """
+        )
+        _create_daily_partitions(table, old_table)
+        op.execute(f"INSERT INTO {table} SELECT * FROM {old_table}")
+        # indexes are built once the data is copied, which is faster than
+        # maintaining them during the copy
+        _create_keys(spec, spec["primary_key"], spec.get("unique_indexes", {}))
+        _create_dependents(spec)
+        op.execute(f"DROP TABLE {old_table}")
+
+
+def downgrade():
+    for spec in TABLES:
+        table = spec["name"]
+        old_table = _release_names(spec, spec.get("unique_indexes", {}))
+        op.execute(f"CREATE TABLE {table} (LIKE {old_table} INCLUDING DEFAULTS)")
+        # the previous keys are stricter, so rows which only differ by
+        # their timestamp are dropped
+        _create_keys(spec,
+                     spec.get("previous_primary_key", spec["primary_key"]),
+                     spec.get("previous_unique_indexes", {}))
+        op.execute(f"INSERT INTO {table} SELECT * FROM {old_table} ON CONFLICT DO NOTHING")
+        _create_dependents(spec)
+        op.execute(f"DROP TABLE {old_table}")
@@ -1,7 +1,7 @@
-import hashlib
 from typing import Any, Dict
 
 from sqlalchemy import (
+    Boolean,
     Column,
     DateTime,
     Float,
@@ -11,7 +11,9 @@ from sqlalchemy import (
     Integer,
     PrimaryKeyConstraint,
     String,
+    TypeDecorator,
 )
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.ext.declarative import declared_attr
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql.sqltypes import BigInteger
@@ -19,6 +21,18 @@ from sqlalchemy.sql.sqltypes import BigInteger
 from antalla.settings import TABLE_PREFIX
 
 from .db import Base as AbstractBase
+from .timestamps import to_datetime
+
+
+class EpochDateTime(TypeDecorator):
+    """datetime column also accepting epochs in milliseconds, so that
+    listeners can leave the conversion to the writers
+    """
+
+    impl = DateTime
+
+    def process_bind_param(self, value, dialect):
+        return to_datetime(value)
 
 
 class Base(AbstractBase):
@@ -28,6 +42,20 @@ class Base(AbstractBase):
     def index_elements(cls):
         return [v.name for v in cls.__table__.primary_key]
 
+    @classmethod
+    def insert_columns(cls):
+        """returns the names of the columns provided when inserting rows,
+        i.e. all columns except a primary key generated by the database
+        """
+        primary_key = list(cls.__table__.primary_key)
+        generated = set()
+        for column in primary_key:
+            if not isinstance(column.type, Integer):
+                continue
+            if column.autoincrement is True or (len(primary_key) == 1 and column.autoincrement == "auto"):
+                generated.add(column.name)
+        return [column.name for column in cls.__table__.columns if column.name not in generated]
+
 
 class BelongsToOrder:
     @declared_attr
@@ -253,6 +281,7 @@ class ExchangeMarket(Base):
 
 class Trade(Base):
     __tablename__ = TABLE_PREFIX + "trades"
+    __table_args__ = {"postgresql_partition_by": "RANGE (timestamp)"}
 
     exchange_trade_id = Column(String, primary_key=True)
     exchange_id = Column(
@@ -261,7 +290,8 @@ class Trade(Base):
 
     exchange = relationship("Exchange")
 
-    timestamp = Column(DateTime, nullable=False, index=True)
+    # partition key, see PARTITIONED_TABLES in antalla.partitions
+    timestamp = Column(EpochDateTime, nullable=False, index=True, primary_key=True)
     trade_type = Column(String)
     buy_sym_id = Column(String, ForeignKey(Coin.symbol), nullable=False, index=True)
     buy_sym = relationship("Coin", foreign_keys=[buy_sym_id])
@@ -288,7 +318,6 @@ class AggOrder(Base):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.hash_id = self.pk_hash()
         self.first_coin_id, self.second_coin_id = self.buy_sym_id, self.sell_sym_id
         if self.first_coin_id > self.second_coin_id:
             self.first_coin_id, self.second_coin_id = (
@@ -296,16 +325,11 @@ class AggOrder(Base):
                 self.first_coin_id,
             )
 
-    def pk_hash(self):
-        pk = f"{self.last_update_id}{self.exchange_id}{self.order_type}{self.price}".encode(
-            "utf-8"
-        )
-        hash_obj = hashlib.sha256(pk)
-        return hash_obj.hexdigest()
-
-    hash_id = Column(String, primary_key=True)
+    # uniqueness is enforced by latest_orders_index, see index_elements
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
     last_update_id = Column(BigInteger)
-    timestamp = Column(DateTime, index=True, nullable=False)
+    # partition key, see PARTITIONED_TABLES in antalla.partitions
+    timestamp = Column(EpochDateTime, index=True, nullable=False, primary_key=True)
     buy_sym_id = Column(String, ForeignKey(Coin.symbol), nullable=False, index=True)
     buy_sym = relationship("Coin", foreign_keys=[buy_sym_id])
     sell_sym_id = Column(String, ForeignKey(Coin.symbol), nullable=False, index=True)
@@ -328,9 +352,13 @@ class AggOrder(Base):
             "price",
             "last_update_id",
             "exchange_id",
+            "timestamp",
             unique=True,
         ),
         Index("market_orders_index", "first_coin_id", "second_coin_id", "exchange_id"),
+        # the migration also includes the other columns read when replaying
+        # a market, which SQLAlchemy 1.3 cannot declare
+        Index("market_time_orders_index", "exchange_id", "first_coin_id", "second_coin_id", "timestamp"),
         ForeignKeyConstraint(
             ["first_coin_id", "second_coin_id", "exchange_id"],
             [
@@ -339,18 +367,20 @@ class AggOrder(Base):
                 ExchangeMarket.exchange_id,
             ],
         ),
+        {"postgresql_partition_by": "RANGE (timestamp)"},
     )
 
     @classmethod
     def index_elements(cls):
-        return ["order_type", "price", "last_update_id", "exchange_id"]
+        return ["order_type", "price", "last_update_id", "exchange_id", "timestamp"]
 
     def __repr__(self):
-        return f"AggOrder(id={self.hash_id})"
+        return f"AggOrder(id={self.id})"
 
 
 class OrderBookSnapshot(Base):
     __tablename__ = TABLE_PREFIX + "order_book_snapshots"
+    __table_args__ = {"postgresql_partition_by": "RANGE (timestamp)"}
 
     timestamp = Column(DateTime, nullable=False, primary_key=True)
     snapshot_type = Column(String, nullable=False, primary_key=True)
@@ -388,6 +418,33 @@ class OrderBookSnapshot(Base):
     ask_price_median = Column(Float, nullable=False)
 
 
+class OrderBookCheckpoint(Base):
+    """price levels of a market rebuilt by the snapshot generator, from which
+    it resumes instead of replaying the whole connection window; levels
+    removed from the book are kept with a size of 0
+    """
+
+    __tablename__ = TABLE_PREFIX + "order_book_checkpoints"
+
+    exchange_id = Column(Integer, ForeignKey(Exchange.id), nullable=False, primary_key=True)
+    exchange = relationship("Exchange", foreign_keys=[exchange_id])
+    buy_sym_id = Column(String, ForeignKey(Coin.symbol), nullable=False, primary_key=True)
+    buy_sym = relationship("Coin", foreign_keys=[buy_sym_id])
+    sell_sym_id = Column(String, ForeignKey(Coin.symbol), nullable=False, primary_key=True)
+    sell_sym = relationship("Coin", foreign_keys=[sell_sym_id])
+    timestamp = Column(DateTime, nullable=False, primary_key=True)
+    # start of the connection window the levels were rebuilt from
+    connect_time = Column(DateTime, nullable=False)
+    is_bid = Column(ARRAY(Boolean), nullable=False)
+    prices = Column(ARRAY(Float), nullable=False)
+    sizes = Column(ARRAY(Float), nullable=False)
+    last_update_ids = Column(ARRAY(BigInteger), nullable=False)
+
+    def __repr__(self):
+        return f"OrderBookCheckpoint(exchange_id={self.exchange_id}, buy_sym_id='{self.buy_sym_id}', " \
+            f"sell_sym_id='{self.sell_sym_id}', timestamp='{self.timestamp}')"
+
+
 class Event(Base):
     __tablename__ = TABLE_PREFIX + "events"
 
@@ -5,7 +5,7 @@ import re
 import seaborn as sns
 import matplotlib.pyplot as plt
 
-from antalla.db import session
+from antalla.db import analytics_session as session
 
 
 sns.set_style("darkgrid")
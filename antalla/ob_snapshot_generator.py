@@ -1,6 +1,8 @@
 from datetime import datetime
 from datetime import timedelta
 from collections import defaultdict
+import math
+import multiprocessing
 
 import numpy as np
 import logging
@@ -8,9 +10,283 @@ import logging
 from . import db
 from . import models
 from . import actions
+from .order_book import OrderBookSide
 
 SNAPSHOT_INTERVAL_SECONDS = 1
 DEFAULT_COMMIT_INTERVAL = 100
+# number of agg orders fetched per query when replaying a market
+STREAM_BATCH_SIZE = 10000
+# interval between the order book checkpoints written while generating snapshots
+CHECKPOINT_INTERVAL_SECONDS = 3600
+# larger than any agg order id, to stream the orders after a timestamp
+MAX_ORDER_ID = 2 ** 63 - 1
+# "replay" streams the orders of a market once and keeps its book in memory,
+# "sql" computes the snapshots of a window of time in a single query
+BACKENDS = ["replay", "sql"]
+# length of the windows of snapshots computed per query by the sql backend
+SQL_WINDOW_SECONDS = 3600
+
+
+class OrderBookReplay:
+    """order book of a market rebuilt from its agg orders, read once in
+    timestamp order
+
+    Each price level keeps the size of the order with the highest update id.
+
+    >>> replay = OrderBookReplay(iter([
+    ...     (1, "bid", 1.0, 2.0, 1), (1, "ask", 2.0, 1.0, 1),
+    ...     (2, "bid", 1.5, 3.0, 2), (3, "bid", 1.0, 0.0, 3)]))
+    >>> replay.advance(2)
+    >>> replay.bids.top(2), replay.asks.top(1)
+    ([(1.5, 3.0), (1.0, 2.0)], [(2.0, 1.0)])
+    >>> replay.advance(3)
+    >>> replay.bids.top(2)
+    [(1.5, 3.0)]
+    """
+
+    def __init__(self, orders=(), checkpoint=None):
+        self.bids = OrderBookSide(is_bid=True)
+        self.asks = OrderBookSide(is_bid=False)
+        self._update_ids = {}
+        if checkpoint is not None:
+            for is_bid, price, size, last_update_id in zip(
+                    checkpoint.is_bid, checkpoint.prices, checkpoint.sizes, checkpoint.last_update_ids):
+                self.apply("bid" if is_bid else "ask", price, size, last_update_id)
+        self._orders = iter(orders)
+        self._next = next(self._orders, None)
+
+    def advance(self, timestamp):
+        """applies the orders received up to ``timestamp`` included
+        """
+        while self._next is not None and self._next[0] <= timestamp:
+            self.apply(*self._next[1:])
+            self._next = next(self._orders, None)
+
+    def apply(self, order_type, price, size, last_update_id):
+        key = (order_type, price)
+        if last_update_id < self._update_ids.get(key, last_update_id):
+            return
+        self._update_ids[key] = last_update_id
+        (self.bids if order_type == "bid" else self.asks).update(price, size)
+
+    def checkpoint(self, market, timestamp, connect_time):
+        """returns the levels of the book, including the removed ones, as a
+        checkpoint of the given market
+        """
+        levels = [
+            (order_type == "bid", price, (self.bids if order_type == "bid" else self.asks).size(price),
+             last_update_id)
+            for (order_type, price), last_update_id in self._update_ids.items()
+        ]
+        is_bid, prices, sizes, last_update_ids = (list(values) for values in zip(*levels)) \
+            if levels else ([], [], [], [])
+        return models.OrderBookCheckpoint(
+            exchange_id=market["exchange_id"],
+            buy_sym_id=market["buy_sym_id"],
+            sell_sym_id=market["sell_sym_id"],
+            timestamp=timestamp,
+            connect_time=connect_time,
+            is_bid=is_bid,
+            prices=prices,
+            sizes=sizes,
+            last_update_ids=last_update_ids,
+        )
+
+    def quartile_levels(self):
+        """returns the bids from the upper quartile of the bid prices and the
+        asks up to the lower quartile of the ask prices
+        """
+        bids_count = len(self.bids) - math.ceil(0.75 * len(self.bids)) + 1
+        return self.bids.top(bids_count), self.asks.top(math.ceil(0.25 * len(self.asks)))
+
+    def snapshot_levels(self, mid_price_range=0):
+        """returns the bid and ask levels included in a snapshot, within
+        ``mid_price_range`` of the mid price or within the quartiles if it is
+        0, or None when a side is empty
+        """
+        if mid_price_range:
+            bids, asks = self.mid_price_levels(mid_price_range)
+        else:
+            bids, asks = self.quartile_levels()
+        if not bids or not asks:
+            return None
+        return bids, asks
+
+    def mid_price_levels(self, mid_price_range):
+        """returns the levels within ``mid_price_range`` of the mid price
+        """
+        if not self.bids or not self.asks:
+            return [], []
+        mid_price = (self.bids.best()[0] + self.asks.best()[0]) / 2
+        return (self.bids.within((1 - mid_price_range) * mid_price),
+                self.asks.within((1 + mid_price_range) * mid_price))
+
+
+class SQLOrderBookWindows:
+    """levels of the snapshots of a market computed by the database, one
+    window of consecutive snapshot times per query
+
+    The state of the price levels at the end of a window is kept to start
+    the next one, so that the orders before a window are only read again
+    when the windows are not consecutive.
+    """
+
+    def __init__(self, generator, market, connect_time):
+        self.generator = generator
+        self.market = market
+        self.connect_time = connect_time
+        self._window = None
+        self._levels = {}
+        self._state = None
+
+    def levels(self, snapshot_time):
+        """returns the bid and ask levels of the snapshot taken at
+        ``snapshot_time``, or None when a side is empty
+        """
+        if self._window is None or not self._window[0] <= snapshot_time < self._window[1]:
+            self._load(snapshot_time)
+        return self._levels.get(snapshot_time)
+
+    def _load(self, first_time):
+        end_time = min(first_time + timedelta(seconds=SQL_WINDOW_SECONDS), self.generator.stop_time)
+        state = None
+        if self._window is not None and self._window[1] == first_time:
+            state = self._state
+        rows = self.generator._query_order_book_window(
+            self.market, self.connect_time, first_time, end_time, state
+        )
+        books = defaultdict(lambda: ([], []))
+        self._state = []
+        for snapshot_time, order_type, price, size, last_update_id in rows:
+            if snapshot_time is None:
+                self._state.append((order_type, price, size, last_update_id))
+            else:
+                books[snapshot_time][0 if order_type == "bid" else 1].append((price, size))
+        self._levels = {snapshot_time: (bids, asks) for snapshot_time, (bids, asks) in books.items()
+                        if bids and asks}
+        self._window = (first_time, end_time)
+
+
+def compute_stats_batch(bid_prices, bid_sizes, bid_counts, ask_prices, ask_sizes, ask_counts):
+    """computes the statistics of many order books at once
+
+    The levels of all the books are concatenated, ``bid_counts`` and
+    ``ask_counts`` giving the number of bids and asks of each book in turn;
+    every book needs at least one bid and one ask. Returns a dict of arrays
+    with one value per book.
+
+    >>> stats = compute_stats_batch([1.0, 2.0, 1.5], [1.0, 1.0, 2.0], [2, 1],
+    ...                             [3.0, 2.5], [1.0, 4.0], [1, 1])
+    >>> stats["spread"].tolist(), stats["bids_volume"].tolist(), stats["bid_price_median"].tolist()
+    ([1.0, 1.0], [3.0, 3.0], [1.5, 1.5])
+    """
+    bids = _compute_side_stats(bid_prices, bid_sizes, bid_counts, is_bid=True)
+    asks = _compute_side_stats(ask_prices, ask_sizes, ask_counts, is_bid=False)
+    return dict(
+        spread=asks["best_price"] - bids["best_price"],
+        min_ask_price=asks["best_price"],
+        min_ask_size=asks["best_size"],
+        max_bid_price=bids["best_price"],
+        max_bid_size=bids["best_size"],
+        bids_volume=bids["volume"],
+        asks_volume=asks["volume"],
+        bids_count=bids["count"],
+        asks_count=asks["count"],
+        bids_price_stddev=bids["stddev"],
+        asks_price_stddev=asks["stddev"],
+        bids_price_mean=bids["mean"],
+        asks_price_mean=asks["mean"],
+        bid_price_median=bids["median"],
+        ask_price_median=asks["median"],
+    )
+
+
+def create_snapshot(full_ob_stats, metadata, mid_price_range):
+    # quartile_ob_stats = self._compute_stats(quartile_ob)
+    snapshot_type = "mid_price_range" if mid_price_range else "quartile"
+    return models.OrderBookSnapshot(
+        mid_price_range=mid_price_range,
+        snapshot_type=snapshot_type,
+        exchange_id=metadata["exchange_id"],
+        sell_sym_id=metadata["sell_sym_id"],
+        buy_sym_id=metadata["buy_sym_id"],
+        timestamp=metadata["timestamp"],
+        spread=full_ob_stats["spread"],
+        bids_volume=full_ob_stats["bids_volume"],
+        asks_volume=full_ob_stats["asks_volume"],
+        bids_count=full_ob_stats["bids_count"],
+        asks_count=full_ob_stats["asks_count"],
+        bids_price_stddev=full_ob_stats["bids_price_stddev"],
+        asks_price_stddev=full_ob_stats["asks_price_stddev"],
+        bids_price_mean=full_ob_stats["bids_price_mean"],
+        asks_price_mean=full_ob_stats["asks_price_mean"],
+        min_ask_price=full_ob_stats["min_ask_price"],
+        min_ask_size=full_ob_stats["min_ask_size"],
+        max_bid_price=full_ob_stats["max_bid_price"],
+        max_bid_size=full_ob_stats["max_bid_size"],
+        bid_price_median=full_ob_stats["bid_price_median"],
+        ask_price_median=full_ob_stats["ask_price_median"],
+        # bid_price_upper_quartile=quartile_ob_stats["bid_price_upper_quartile"],
+        # ask_price_lower_quartile=quartile_ob_stats["ask_price_lower_quartile"],
+        # bids_volume_upper_quartile=quartile_ob_stats["bids_volume"],
+        # asks_volume_lower_quartile=quartile_ob_stats["asks_volume"],
+        # bids_count_upper_quartile=quartile_ob_stats["bids_count"],
+        # asks_count_lower_quartile=quartile_ob_stats["asks_count"],
+        # bids_price_stddev_upper_quartile=quartile_ob_stats["bids_price_stddev"],
+        # asks_price_stddev_lower_quartile=quartile_ob_stats["asks_price_stddev"],
+        # bids_price_mean_upper_quartile=quartile_ob_stats["bids_price_mean"],
+        # asks_price_mean_lower_quartile=quartile_ob_stats["asks_price_mean"]
+    )
+
+
+def create_snapshots(books, mid_price_range):
+    """returns the snapshots of order books given as (metadata, (bids, asks))
+    tuples, computing their statistics in one batch
+    """
+    bids = [bids for _metadata, (bids, _asks) in books]
+    asks = [asks for _metadata, (_bids, asks) in books]
+    stats = compute_stats_batch(
+        [price for levels in bids for price, _size in levels],
+        [size for levels in bids for _price, size in levels],
+        [len(levels) for levels in bids],
+        [price for levels in asks for price, _size in levels],
+        [size for levels in asks for _price, size in levels],
+        [len(levels) for levels in asks],
+    )
+    stats = {key: values.tolist() for key, values in stats.items()}
+    return [
+        create_snapshot({key: values[i] for key, values in stats.items()}, metadata, mid_price_range)
+        for i, (metadata, _levels) in enumerate(books)
+    ]
+
+
+def _compute_side_stats(prices, sizes, counts, is_bid):
+    prices = np.asarray(prices, dtype=np.float64)
+    sizes = np.asarray(sizes, dtype=np.float64)
+    counts = np.asarray(counts, dtype=np.int64)
+    if counts.size and counts.min() <= 0:
+        raise ValueError("order books need at least one bid and one ask")
+    if counts.sum() != prices.size:
+        raise ValueError("number of levels does not match the level counts")
+    if counts.size == 0:
+        empty = np.zeros(0)
+        return dict(best_price=empty, best_size=empty, volume=empty, count=counts,
+                    mean=empty, stddev=empty, median=empty)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    mean = np.add.reduceat(prices, starts) / counts
+    deviations = prices - np.repeat(mean, counts)
+    stddev = np.sqrt(np.add.reduceat(deviations * deviations, starts) / counts)
+    volume = np.add.reduceat(prices * sizes, starts)
+
+    # sorts the levels of each book by price, the largest size last among
+    # equal prices for bids and first for asks
+    books = np.repeat(np.arange(counts.size), counts)
+    order = np.lexsort((sizes if is_bid else -sizes, prices, books))
+    sorted_prices, sorted_sizes = prices[order], sizes[order]
+    best = starts + counts - 1 if is_bid else starts
+    median = (sorted_prices[starts + (counts - 1) // 2] + sorted_prices[starts + counts // 2]) / 2
+    return dict(best_price=sorted_prices[best], best_size=sorted_sizes[best], volume=volume,
+                count=counts, mean=mean, stddev=stddev, median=median)
 
 
 class OBSnapshotGenerator:
@@ -22,20 +298,27 @@ class OBSnapshotGenerator:
         snapshot_interval=SNAPSHOT_INTERVAL_SECONDS,
         session=db.session,
         commit_interval=DEFAULT_COMMIT_INTERVAL,
+        checkpoint_interval=CHECKPOINT_INTERVAL_SECONDS,
+        backend="replay",
     ):
+        if backend not in BACKENDS:
+            raise ValueError("unknown snapshot backend '{}'".format(backend))
+        self.backend = backend
         self.exchanges = exchanges
         self.stop_time = timestamp
         self.commit_interval = commit_interval
         self.snapshot_interval = snapshot_interval
-        self.actions_buffer = []
+        self.checkpoint_interval = checkpoint_interval
+        self.pending_books = []
+        self.pending_checkpoints = []
         self.commit_counter = 0
+        self.snapshot_counter = 0
+        self.event_log = defaultdict(list)
         self.session = session
         self.mid_price_range = mid_price_range
-        if self.mid_price_range:
-            self._query_order_book = self._query_order_book_mid_price
-        else:
+        if not self.mid_price_range:
             self.mid_price_range = 0
-            self._query_order_book = self._query_order_book_quartile
+        self.stream_batch_size = STREAM_BATCH_SIZE
 
     def _get_connection_window(self, last_update, key):
         connect_time = None
@@ -61,43 +344,91 @@ class OBSnapshotGenerator:
         return connect_time, disconnect_time
 
     def run(self):
+        for work_item in self.get_work_items():
+            self.generate_market_snapshots(work_item)
+        logging.info(
+            "completed order book snapshots - total commits: {}".format(
+                self.commit_counter
+            )
+        )
+
+    def run_parallel(self, jobs, context=None):
+        """generates the snapshots of the markets in ``jobs`` worker processes,
+        each one with its own database connection
+        """
+        if context is None:
+            context = multiprocessing.get_context("spawn")
+        work_items = self.get_work_items()
+        options = dict(
+            exchanges=self.exchanges,
+            timestamp=self.stop_time,
+            mid_price_range=self.mid_price_range,
+            snapshot_interval=self.snapshot_interval,
+            commit_interval=self.commit_interval,
+            checkpoint_interval=self.checkpoint_interval,
+            backend=self.backend,
+        )
+        with context.Pool(jobs, initializer=_init_worker, initargs=(options,)) as pool:
+            results = pool.imap_unordered(_generate_market_snapshots, work_items)
+            for done, (market, snapshots, commits) in enumerate(results, 1):
+                self.snapshot_counter += snapshots
+                self.commit_counter += commits
+                logging.info(
+                    "order book snapshot - {} - '{}-{}' done ({}/{} markets) - snapshots: {} - commits: {}".format(
+                        market["exchange"].upper(), market["buy_sym_id"], market["sell_sym_id"],
+                        done, len(work_items), self.snapshot_counter, self.commit_counter
+                    )
+                )
+        logging.info(
+            "completed order book snapshots - total commits: {}".format(
+                self.commit_counter
+            )
+        )
+
+    def get_work_items(self):
+        """returns the markets to generate snapshots for, with the time of
+        their latest snapshot and their connection events
+        """
         exchange_markets = self._query_exchange_markets()
-        parsed_exchange_markets = self._parse_exchange_markets(exchange_markets)
+        parsed_exchange_markets = self._parse_exchange_markets(exchange_markets) or {}
         connection_events = self._query_connection_events()
         self._parse_connection_events(connection_events)
+        work_items = []
         for exchange in parsed_exchange_markets:
             snapshot_times = self._query_latest_snapshot(exchange)
             parsed_snapshot_times = self._parse_snapshot_times(snapshot_times)
             for market in parsed_exchange_markets[exchange]:
                 market_key = exchange + market["buy_sym_id"] + market["sell_sym_id"]
-                last_update_time = self._get_last_update_time(
-                    market_key, parsed_snapshot_times
-                )
-                logging.debug("last snapshot update: {}".format(last_update_time))
-                connect_time, disconnect_time = self._get_connection_window(
-                    last_update_time, market_key
-                )
-                logging.info(
-                    "order book snapshot - {} - '{}-{}'".format(
-                        exchange.upper(), market["buy_sym_id"], market["sell_sym_id"]
-                    )
-                )
-                logging.debug(
-                    "snapshot window - start time: {} - end time: {}".format(
-                        connect_time, disconnect_time
-                    )
-                )
-                self._generate_all_snapshots(
-                    connect_time, disconnect_time, last_update_time, market, exchange
-                )
-        if len(self.actions_buffer) > 0:
-            self.session.commit()
-            self.commit_counter += 1
+                work_items.append(dict(
+                    market=market,
+                    last_update_time=self._get_last_update_time(market_key, parsed_snapshot_times),
+                    events=self.event_log[market_key],
+                ))
+        return work_items
+
+    def generate_market_snapshots(self, work_item):
+        market = work_item["market"]
+        exchange = market["exchange"]
+        market_key = exchange + market["buy_sym_id"] + market["sell_sym_id"]
+        self.event_log[market_key] = work_item["events"]
+        last_update_time = work_item["last_update_time"]
+        logging.debug("last snapshot update: {}".format(last_update_time))
+        connect_time, disconnect_time = self._get_connection_window(
+            last_update_time, market_key
+        )
         logging.info(
-            "completed order book snapshots - total commits: {}".format(
-                self.commit_counter
+            "order book snapshot - {} - '{}-{}'".format(
+                exchange.upper(), market["buy_sym_id"], market["sell_sym_id"]
+            )
+        )
+        logging.debug(
+            "snapshot window - start time: {} - end time: {}".format(
+                connect_time, disconnect_time
             )
         )
+        self._generate_all_snapshots(
+            connect_time, disconnect_time, last_update_time, market, exchange
+        )
 
     def _generate_all_snapshots(
         self, connect_time, disconnect_time, snapshot_time, market, exchange
@@ -118,19 +449,23 @@ class OBSnapshotGenerator:
                 snapshot_time, connect_time, disconnect_time
             )
         )
+        replay = None
+        windows = None
         while snapshot_time < self.stop_time:
-            start_time = datetime.strftime(connect_time, "%Y-%m-%d %H:%M:%S.%f")
-            stop_time = datetime.strftime(snapshot_time, "%Y-%m-%d %H:%M:%S.%f")
             logging.debug("start: {}, end: {}".format(connect_time, snapshot_time))
-            order_book = self._query_order_book(
-                exchange,
-                market["buy_sym_id"],
-                market["sell_sym_id"],
-                start_time,
-                stop_time,
-            )
-            full_ob = self._parse_order_book(order_book)
-            if full_ob is None:
+            if self.backend == "sql":
+                if windows is None:
+                    windows = SQLOrderBookWindows(self, market, connect_time)
+                levels = windows.levels(snapshot_time)
+            else:
+                if replay is None:
+                    replay, checkpoint_time = self._create_replay(market, connect_time, snapshot_time)
+                replay.advance(snapshot_time)
+                if snapshot_time >= checkpoint_time + timedelta(seconds=self.checkpoint_interval):
+                    self.pending_checkpoints.append(replay.checkpoint(market, snapshot_time, connect_time))
+                    checkpoint_time = snapshot_time
+                levels = self._get_order_book_levels(replay)
+            if levels is None:
                 snapshot_time += timedelta(seconds=self.snapshot_interval)
                 continue
             metadata = dict(
@@ -139,19 +474,9 @@ class OBSnapshotGenerator:
                 buy_sym_id=market["buy_sym_id"],
                 sell_sym_id=market["sell_sym_id"],
             )
-            snapshot = self._generate_snapshot(full_ob, metadata)
-            action = actions.InsertAction([snapshot])
-            action.execute(self.session)
-            if len(self.actions_buffer) >= self.commit_interval:
-                self.session.commit()
-                self.commit_counter += 1
-                logging.debug(
-                    " {}-{} - order book snapshot commit[{}]".format(
-                        market["buy_sym_id"], market["sell_sym_id"], self.commit_counter
-                    )
-                )
-            else:
-                self.actions_buffer.append(action)
+            self.pending_books.append((metadata, levels))
+            if len(self.pending_books) >= self.commit_interval:
+                self._write_snapshots()
             logging.debug("order book snapshot created - {}".format(snapshot_time))
             snapshot_time += timedelta(seconds=self.snapshot_interval)
             if snapshot_time >= disconnect_time:
@@ -159,6 +484,8 @@ class OBSnapshotGenerator:
                     snapshot_time, market_key
                 )
                 connect_time = snapshot_time
+                replay = None
+                windows = None
                 if disconnect_time == self.stop_time:
                     snapshot_time = self.stop_time
                 logging.debug(
@@ -166,6 +493,220 @@ class OBSnapshotGenerator:
                         connect_time, disconnect_time
                     )
                 )
+        if self.pending_books or self.pending_checkpoints:
+            self._write_snapshots()
+
+    def _create_replay(self, market, connect_time, snapshot_time):
+        """returns the replay of a market for the connection window starting at
+        ``connect_time``, restored from the latest checkpoint of the window
+        before ``snapshot_time`` if any, and the time of this checkpoint
+        """
+        checkpoint = self.session.query(models.OrderBookCheckpoint) \
+            .filter_by(exchange_id=market["exchange_id"],
+                       buy_sym_id=market["buy_sym_id"].upper(),
+                       sell_sym_id=market["sell_sym_id"].upper(),
+                       connect_time=connect_time) \
+            .filter(models.OrderBookCheckpoint.timestamp <= snapshot_time) \
+            .order_by(models.OrderBookCheckpoint.timestamp.desc()) \
+            .first()
+        if checkpoint is None:
+            return OrderBookReplay(self._stream_agg_orders(market, connect_time)), connect_time
+        logging.debug("resuming from order book checkpoint - {}".format(checkpoint.timestamp))
+        orders = self._stream_agg_orders(market, checkpoint.timestamp, start_id=MAX_ORDER_ID)
+        return OrderBookReplay(orders, checkpoint), checkpoint.timestamp
+
+    def _write_snapshots(self):
+        """computes the statistics of the pending order books in one batch,
+        then inserts and commits their snapshots with the pending checkpoints
+        """
+        snapshots = create_snapshots(self.pending_books, self.mid_price_range)
+        actions.InsertAction(snapshots).execute(self.session)
+        actions.InsertAction(self.pending_checkpoints).execute(self.session)
+        self.session.commit()
+        self.pending_books = []
+        self.pending_checkpoints = []
+        self.snapshot_counter += len(snapshots)
+        self.commit_counter += 1
+        logging.debug("order book snapshot commit[{}]".format(self.commit_counter))
+
+    def _get_order_book_levels(self, replay):
+        """returns the bid and ask levels of the replayed book included in a
+        snapshot, or None when a side is empty
+        """
+        levels = replay.snapshot_levels(self.mid_price_range)
+        if levels is None:
+            logging.debug("no bids or asks in order book")
+        return levels
+
+    def _stream_agg_orders(self, market, start_time, start_id=-1):
+        """yields the agg orders of a market received from ``start_time``, in
+        timestamp order, as (timestamp, order_type, price, size, last_update_id);
+        orders at ``start_time`` with an id up to ``start_id`` are skipped
+        """
+        query = f"""
+            select timestamp, id, order_type, price, size, last_update_id
+            from {models.AggOrder.__tablename__}
+            where exchange_id = :exchange_id
+            and first_coin_id = :first_coin_id
+            and second_coin_id = :second_coin_id
+            and buy_sym_id = :buy_sym_id
+            and sell_sym_id = :sell_sym_id
+            and last_update_id is not null
+            and (timestamp, id) > (:timestamp, :id)
+            and timestamp <= :stop_time
+            order by timestamp, id
+            limit :limit
+            """
+        params = dict(
+            self._market_params(market),
+            timestamp=start_time,
+            id=start_id,
+            stop_time=self.stop_time,
+            limit=self.stream_batch_size,
+        )
+        while True:
+            rows = self.session.execute(query, params).fetchall()
+            for timestamp, _id, order_type, price, size, last_update_id in rows:
+                yield timestamp, order_type, price, size, last_update_id
+            if len(rows) < self.stream_batch_size:
+                return
+            params["timestamp"], params["id"] = rows[-1][0], rows[-1][1]
+
+    def _query_order_book_window(self, market, start_time, first_time, end_time, state=None):
+        """computes in one query the levels of the snapshots of a market taken
+        every snapshot interval from ``first_time`` until ``end_time`` excluded,
+        for the orders received since ``start_time``. The window starts from
+        ``state``, the (order_type, price, size, last_update_id) of each price
+        level before ``first_time``, or from the orders before ``first_time``
+        if it is None, and only the orders received during the window are
+        replayed on top of it. Each order is the state of its price level
+        from its timestamp until an order of the level with a higher update
+        id is received, and is only expanded to the snapshot times within
+        that range. The state of the levels at ``end_time`` is returned too,
+        in rows without a snapshot time.
+        """
+        logging.debug("QUERY - order book window - {} - {}".format(first_time, end_time))
+        if self.mid_price_range:
+            bounds = """
+                select snapshot_time,
+                    (1 - :range) * ((max(price) filter (where order_type = 'bid')
+                        + min(price) filter (where order_type = 'ask')) / 2) min_bid_price,
+                    (1 + :range) * ((max(price) filter (where order_type = 'bid')
+                        + min(price) filter (where order_type = 'ask')) / 2) max_ask_price
+                from order_book
+                group by snapshot_time
+                """
+        else:
+            bounds = """
+                select snapshot_time,
+                    percentile_disc(0.75) within group (order by price)
+                        filter (where order_type = 'bid') min_bid_price,
+                    percentile_disc(0.25) within group (order by price)
+                        filter (where order_type = 'ask') max_ask_price
+                from order_book
+                group by snapshot_time
+                """
+        market_filter = """
+            exchange_id = :exchange_id
+            and first_coin_id = :first_coin_id
+            and second_coin_id = :second_coin_id
+            and buy_sym_id = :buy_sym_id
+            and sell_sym_id = :sell_sym_id
+            and last_update_id is not null
+            """
+        if state is None:
+            initial_state = f"""
+                select distinct on (order_type, price) order_type, price, size, last_update_id
+                from {models.AggOrder.__tablename__}
+                where {market_filter}
+                and timestamp >= :start_time
+                and timestamp < :first_time
+                order by order_type, price, last_update_id desc, timestamp desc, id desc
+                """
+            state = []
+        else:
+            initial_state = """
+                select *
+                from unnest(cast(:state_order_types as varchar[]), cast(:state_prices as float8[]),
+                            cast(:state_sizes as float8[]), cast(:state_update_ids as bigint[]))
+                    as state(order_type, price, size, last_update_id)
+                """
+        # the initial state of a level comes before the orders of the window
+        # with the same update id, which sort first by their id
+        query = f"""
+            with initial_state as ({initial_state}),
+            window_orders as (
+                select id, timestamp, order_type, price, size, last_update_id
+                from {models.AggOrder.__tablename__}
+                where {market_filter}
+                and timestamp >= :first_time
+                and timestamp < :end_time
+                union all
+                select null, cast(:first_time as timestamp), order_type, price, size, last_update_id
+                from initial_state
+            ),
+            orders as (
+                select timestamp, order_type, price, size,
+                    min(timestamp) over (
+                        partition by order_type, price
+                        order by last_update_id desc, timestamp desc, id desc nulls last
+                        rows between unbounded preceding and 1 preceding
+                    ) replaced_at
+                from window_orders
+            ),
+            final_state as (
+                select distinct on (order_type, price) order_type, price, size, last_update_id
+                from window_orders
+                order by order_type, price, last_update_id desc, timestamp desc, id desc nulls last
+            ),
+            order_book as (
+                select cast(:first_time as timestamp) + k * :interval * interval '1 second' snapshot_time,
+                    o.order_type, o.price, o.size
+                from orders o
+                cross join lateral generate_series(
+                    cast(ceil(extract(epoch from o.timestamp - cast(:first_time as timestamp))
+                              / :interval) as integer),
+                    cast(ceil(extract(epoch from coalesce(o.replaced_at, cast(:end_time as timestamp))
+                                                 - cast(:first_time as timestamp))
+                              / :interval) as integer) - 1
+                ) k
+                where o.size > 0
+            ),
+            bounds as ({bounds})
+            select ob.snapshot_time, ob.order_type, ob.price, ob.size, null last_update_id
+            from order_book ob
+            inner join bounds b on ob.snapshot_time = b.snapshot_time
+            where (ob.order_type = 'bid' and ob.price >= b.min_bid_price)
+            or (ob.order_type = 'ask' and ob.price <= b.max_ask_price)
+            union all
+            select null, order_type, price, size, last_update_id
+            from final_state
+            """
+        return self.session.execute(
+            query,
+            dict(
+                self._market_params(market),
+                range=self.mid_price_range,
+                interval=self.snapshot_interval,
+                start_time=start_time,
+                first_time=first_time,
+                end_time=end_time,
+                state_order_types=[level[0] for level in state],
+                state_prices=[level[1] for level in state],
+                state_sizes=[level[2] for level in state],
+                state_update_ids=[level[3] for level in state],
+            ),
+        )
+
+    def _market_params(self, market):
+        buy_sym_id, sell_sym_id = market["buy_sym_id"].upper(), market["sell_sym_id"].upper()
+        return dict(
+            exchange_id=market["exchange_id"],
+            buy_sym_id=buy_sym_id,
+            sell_sym_id=sell_sym_id,
+            first_coin_id=min(buy_sym_id, sell_sym_id),
+            second_coin_id=max(buy_sym_id, sell_sym_id),
+        )
 
     def _query_exchange_markets(self):
         query = f"""
@@ -200,7 +741,7 @@ class OBSnapshotGenerator:
 
     def _get_last_update_time(self, key, updates):
         snapshot_type = "mid_price_range" if self.mid_price_range else "quartile"
-        key = key + str(self.mid_price_range) + snapshot_type
+        key = key + str(float(self.mid_price_range)) + snapshot_type
         if key in updates.keys():
             return updates[key]
         else:
@@ -241,215 +782,40 @@ class OBSnapshotGenerator:
             )
         return all_markets
 
-    def _query_order_book_quartile(
-        self, exchange, buy_sym_id, sell_sym_id, start_time, stop_time
-    ):
-        logging.debug("QUERY - quartile - order book")
-        query = f"""
-            with order_book as (
-            with latest_orders as (
-            select order_type, price, max(last_update_id) max_update_id, exchange_id
-            from {models.AggOrder.__tablename__} ag
-            where timestamp <= :stop_time
-            and timestamp >= :start_time
-            group by ag.price, ag.order_type, ag.exchange_id)
-            select order_type,
-                price,
-                size,
-                last_update_id,
-                timestamp,
-                name,
-                buy_sym_id,
-                sell_sym_id
-            from {models.AggOrder.__tablename__} ag
-                    inner join {models.Exchange.__tablename__} e on ag.exchange_id = e.id
-            where (order_type, price, last_update_id, exchange_id) in (select * from latest_orders)
-            and size > 0
-            and buy_sym_id = :buy_sym_id
-            and sell_sym_id = :sell_sym_id
-            and name = :exchange
-            and timestamp <= :stop_time
-            and timestamp >= :start_time
-            )
-            select *
-            from order_book where (order_book.order_type = 'bid' and order_book.price >= (
-                select percentile_disc(0.75) within group (order by order_book.price)
-                from order_book
-                    where order_book.order_type = 'bid'
-            )) or (order_book.order_type = 'ask' and order_book.price <= (
-                select percentile_disc(0.25) within group (order by order_book.price)
-                from order_book
-                    where order_book.order_type = 'ask'
-            ))
-            """
-        return self.session.execute(
-            query,
-            {
-                "stop_time": stop_time,
-                "start_time": start_time,
-                "buy_sym_id": buy_sym_id.upper(),
-                "sell_sym_id": sell_sym_id.upper(),
-                "exchange": exchange.lower(),
-            },
+    def _compute_stats(self, order_book):
+        bids = [order for order in order_book if order["order_type"] == "bid"]
+        asks = [order for order in order_book if order["order_type"] == "ask"]
+        stats = compute_stats_batch(
+            [order["price"] for order in bids],
+            [order["size"] for order in bids],
+            [len(bids)],
+            [order["price"] for order in asks],
+            [order["size"] for order in asks],
+            [len(asks)],
         )
+        return {key: values[0].item() for key, values in stats.items()}
 
-    def _query_order_book_mid_price(
-        self, exchange, buy_sym_id, sell_sym_id, start_time, stop_time
-    ):
-        logging.debug("QUERY - mid price - order book")
-        query = """
-        with order_book as (
-            with latest_orders as (
-                select order_type, price, max(last_update_id) max_update_id, exchange_id
-                from aggregate_orders
-                where timestamp >= :start_time
-                and timestamp <= :stop_time
-                group by aggregate_orders.price, aggregate_orders.order_type, aggregate_orders.exchange_id)
-            select order_type,
-                price,
-                size,
-                last_update_id,
-                timestamp,
-                name,
-                buy_sym_id,
-                sell_sym_id
-            from aggregate_orders
-                    inner join exchanges on aggregate_orders.exchange_id = exchanges.id
-            where (order_type, price, last_update_id, exchange_id) in (select * from latest_orders)
-            and size > 0
-            and buy_sym_id = :buy_sym_id
-            and sell_sym_id = :sell_sym_id
-            and name = :exchange
-            and timestamp >= :start_time
-            and timestamp <= :stop_time
-            order by price asc
-        ),
-            mid_price as (
-                with max_min_prices as (
-                    with max_bid_price as (
-                        select max(price) max_bid
-                        from order_book
-                        where (order_book.order_type = 'bid')
-                    ),
-                        min_ask_price as (
-                            select min(price) min_ask
-                            from order_book
-                            where (order_book.order_type = 'ask')
-                        )
-                    select *
-                    from max_bid_price,
-                        min_ask_price)
-                select ((max_min_prices.min_ask + max_min_prices.max_bid) / 2) mid, max_bid, min_ask
-                from max_min_prices
-            )
-        select *
-        from order_book, mid_price
-        where (order_book.order_type = 'bid' and order_book.price >= (1- :range)* mid_price.mid)
-        or (order_book.order_type = 'ask' and order_book.price <= (1+ :range)* mid_price.mid)
-        order by timestamp desc
-        """
-        return self.session.execute(
-            query,
-            {
-                "range": self.mid_price_range,
-                "stop_time": stop_time,
-                "start_time": start_time,
-                "buy_sym_id": buy_sym_id.upper(),
-                "sell_sym_id": sell_sym_id.upper(),
-                "exchange": exchange.lower(),
-            },
-        )
 
-    def _parse_order_book(self, order_book):
-        full_order_book = []
-        order_book = list(order_book)
-        logging.debug("ORDER BOOK: {}".format(order_book))
-        if len(order_book) == 0:
-            logging.debug("empty order book to be parsed")
-            return None
-        for order in order_book:
-            full_order_book.append(
-                dict(order_type=order[0], price=order[1], size=order[2])
-            )
-        logging.debug(
-            "ob_snapshot_generator - parsed order books: 'full order book' ({} orders)".format(
-                len(full_order_book)
-            )
-        )
-        return full_order_book
+_worker_generator = None
 
-    def _generate_snapshot(self, full_ob, metadata):
-        full_ob_stats = self._compute_stats(full_ob)
-        # quartile_ob_stats = self._compute_stats(quartile_ob)
-        snapshot_type = "mid_price_range" if self.mid_price_range else "quartile"
-        return models.OrderBookSnapshot(
-            mid_price_range=self.mid_price_range,
-            snapshot_type=snapshot_type,
-            exchange_id=metadata["exchange_id"],
-            sell_sym_id=metadata["sell_sym_id"],
-            buy_sym_id=metadata["buy_sym_id"],
-            timestamp=metadata["timestamp"],
-            spread=full_ob_stats["spread"],
-            bids_volume=full_ob_stats["bids_volume"],
-            asks_volume=full_ob_stats["asks_volume"],
-            bids_count=full_ob_stats["bids_count"],
-            asks_count=full_ob_stats["asks_count"],
-            bids_price_stddev=full_ob_stats["bids_price_stddev"],
-            asks_price_stddev=full_ob_stats["asks_price_stddev"],
-            bids_price_mean=full_ob_stats["bids_price_mean"],
-            asks_price_mean=full_ob_stats["asks_price_mean"],
-            min_ask_price=full_ob_stats["min_ask_price"],
-            min_ask_size=full_ob_stats["min_ask_size"],
-            max_bid_price=full_ob_stats["max_bid_price"],
-            max_bid_size=full_ob_stats["max_bid_size"],
-            bid_price_median=full_ob_stats["bid_price_median"],
-            ask_price_median=full_ob_stats["ask_price_median"],
-            # bid_price_upper_quartile=quartile_ob_stats["bid_price_upper_quartile"],
-            # ask_price_lower_quartile=quartile_ob_stats["ask_price_lower_quartile"],
-            # bids_volume_upper_quartile=quartile_ob_stats["bids_volume"],
-            # asks_volume_lower_quartile=quartile_ob_stats["asks_volume"],
-            # bids_count_upper_quartile=quartile_ob_stats["bids_count"],
-            # asks_count_lower_quartile=quartile_ob_stats["asks_count"],
-            # bids_price_stddev_upper_quartile=quartile_ob_stats["bids_price_stddev"],
-            # asks_price_stddev_lower_quartile=quartile_ob_stats["asks_price_stddev"],
-            # bids_price_mean_upper_quartile=quartile_ob_stats["bids_price_mean"],
-            # asks_price_mean_lower_quartile=quartile_ob_stats["asks_price_mean"]
-        )
 
-    def _compute_stats(self, order_book):
-        bids = list(filter(lambda x: x["order_type"] == "bid", order_book))
-        asks = list(filter(lambda x: x["order_type"] == "ask", order_book))
-        bid_prices = list(map(lambda x: x["price"], bids))
-        ask_prices = list(map(lambda x: x["price"], asks))
-        avg_bid_price = 0
-        if len(bids):
-            avg_bid_price = float(sum(d["price"] for d in bids)) / len(bids)
-        avg_ask_price = 0
-        if len(asks):
-            avg_ask_price = float(sum(d["price"] for d in asks)) / len(asks)
-        bids_volume = float(sum(d["price"] * d["size"] for d in bids))
-        asks_volume = float(sum(d["price"] * d["size"] for d in asks))
-        min_ask_size = max(
-            list(d["size"] if d["price"] == min(ask_prices) else 0 for d in asks)
-        )
-        max_bid_size = max(
-            list(d["size"] if d["price"] == max(bid_prices) else 0 for d in bids)
-        )
-        spread = float(float(min(ask_prices)) - float(max(bid_prices)))
-        return dict(
-            spread=spread,
-            min_ask_price=min(ask_prices),
-            min_ask_size=min_ask_size,
-            max_bid_price=max(bid_prices),
-            max_bid_size=max_bid_size,
-            bids_volume=bids_volume,
-            asks_volume=asks_volume,
-            bids_count=len(bids),
-            asks_count=len(asks),
-            bids_price_stddev=np.std(bid_prices),
-            asks_price_stddev=np.std(ask_prices),
-            bids_price_mean=avg_bid_price,
-            asks_price_mean=avg_ask_price,
-            bid_price_median=np.median(bid_prices),
-            ask_price_median=np.median(ask_prices),
-        )
+def _init_worker(options):
+    """creates the generator of a worker process, on its own connections
+    """
+    global _worker_generator
+    db.use_profile("snapshot")
+    _worker_generator = OBSnapshotGenerator(session=db.session, **options)
+
+
+def _generate_market_snapshots(work_item):
+    """generates the snapshots of a market in a worker process and returns the
+    numbers of snapshots and commits made
+    """
+    snapshots = _worker_generator.snapshot_counter
+    commits = _worker_generator.commit_counter
+    _worker_generator.generate_market_snapshots(work_item)
+    return (
+        work_item["market"],
+        _worker_generator.snapshot_counter - snapshots,
+        _worker_generator.commit_counter - commits,
+    )
@@ -1,13 +1,30 @@
 import asyncio
+from datetime import datetime
 from typing import List, Dict
 import logging
+import time
 
 from .exchange_listener import ExchangeListener
 from . import db
 from . import models
-from .actions import Action, InsertAction, UpdateAction
+from .actions import Action, InsertAction
+from .capture import CaptureWriter, read_capture
+from .live_snapshots import LiveSnapshots
+from .spool import Spool
+from .websocket_listener import WebsocketListener
+from .db_writer import (
+    ActionExecutor,
+    DBWriter,
+    FlushPolicy,
+    DEFAULT_COMMIT_INTERVAL,
+    DEFAULT_COMMIT_BYTES,
+    DEFAULT_COMMIT_MAX_AGE,
+    DEFAULT_QUEUE_SIZE,
+)
 
-DEFAULT_COMMIT_INTERVAL = 100
+METRICS_LOG_INTERVAL = 60
+# number of frames replayed between two yields to the event loop
+REPLAY_YIELD_FRAMES = 100
 
 import aiohttp
 
@@ -16,20 +33,53 @@ class Orchestrator:
                  exchange_names,
                  session=None,
                  commit_interval=DEFAULT_COMMIT_INTERVAL,
+                 commit_bytes=DEFAULT_COMMIT_BYTES,
+                 commit_max_age=DEFAULT_COMMIT_MAX_AGE,
                  event_type=None,
-                 markets: Dict[str, List[str]] = None):
+                 markets: Dict[str, List[str]] = None,
+                 bulk_insert=False,
+                 writer_threads=0,
+                 writer_queue_size=DEFAULT_QUEUE_SIZE,
+                 spool_file=None,
+                 capture_file=None,
+                 snapshot_interval=None,
+                 snapshot_depth=None):
         if session is None:
             session = db.session
         if markets is None:
             markets = {}
+        if spool_file and writer_threads <= 0:
+            raise ValueError("a spool file requires at least one writer thread")
         self.session = session
-        self.commit_interval = commit_interval
-        self._rows_modified = 0
-        self._stats = dict(commits=0, inserts=0, updates=0)
+        self.flush_policy = FlushPolicy(max_rows=commit_interval,
+                                        max_bytes=commit_bytes,
+                                        max_age=commit_max_age)
+        self.executor = ActionExecutor(session, self.flush_policy, bulk_insert)
+        self.writer = None
+        if writer_threads > 0:
+            self.writer = DBWriter(writer_threads,
+                                   flush_policy=self.flush_policy,
+                                   max_queue_size=writer_queue_size,
+                                   bulk_insert=bulk_insert,
+                                   spool=Spool(spool_file) if spool_file else None)
+            self.writer.start()
         self.exchange_listeners = [
             self._create_exchange_listener(name, event_type, markets=markets.get(name))
             for name in exchange_names
         ]
+        for exchange_listener in self.exchange_listeners:
+            exchange_listener.on_db_error = self._on_db_error
+        self.live_snapshots = None
+        if snapshot_interval:
+            self.live_snapshots = LiveSnapshots(snapshot_interval, snapshot_depth)
+            for exchange_listener in self.exchange_listeners:
+                exchange_listener.on_connection_event = self.live_snapshots.on_connection_event
+        self.capture = None
+        if capture_file:
+            self.capture = CaptureWriter(capture_file)
+            for exchange_listener in self.exchange_listeners:
+                if isinstance(exchange_listener, WebsocketListener):
+                    exchange_listener.capture = self.capture
 
     def _create_exchange_listener(self, name, event_type, markets: List[str] = None):
         exchange = self.session.query(models.Exchange).filter_by(name=name).one()
@@ -41,7 +91,47 @@ class Orchestrator:
         return ExchangeListener.create(name, exchange, self._on_event, **kwargs)
 
     async def start(self):
-        await asyncio.gather(*[e.listen() for e in self.exchange_listeners])
+        if self.writer:
+            background_task = asyncio.ensure_future(self._log_metrics())
+        else:
+            background_task = asyncio.ensure_future(self._flush_periodically())
+        background_tasks = [background_task]
+        if self.live_snapshots:
+            background_tasks.append(asyncio.ensure_future(self._emit_snapshots_periodically()))
+        try:
+            await asyncio.gather(*[e.listen() for e in self.exchange_listeners])
+        finally:
+            for task in background_tasks:
+                task.cancel()
+
+    async def replay(self, capture_file, speed=None):
+        """feeds the frames of a capture file through the listeners of their
+        exchange, ``speed`` times faster than they were received or as fast as
+        possible if ``speed`` is None, and returns the number of frames
+        replayed and the time it took
+        """
+        listeners = {listener.exchange.name: listener for listener in self.exchange_listeners}
+        frames = 0
+        started_at = time.monotonic()
+        first_received_at = None
+        for frame in read_capture(capture_file):
+            listener = listeners.get(frame.exchange)
+            if listener is None:
+                continue
+            if speed:
+                if first_received_at is None:
+                    first_received_at = frame.received_at
+                delay = (frame.received_at - first_received_at) / speed \
+                    - (time.monotonic() - started_at)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            pending = self._on_event(listener._handle_frame(frame.data))
+            if asyncio.isfuture(pending):
+                await pending
+            frames += 1
+            if frames % REPLAY_YIELD_FRAMES == 0:
+                await asyncio.sleep(0)
+        return dict(frames=frames, elapsed=time.monotonic() - started_at)
 
     async def get_markets(self):
         await asyncio.gather(*[e.get_markets() for e in self.exchange_listeners])
@@ -50,25 +140,71 @@ class Orchestrator:
         for exchange_listener in self.exchange_listeners:
             exchange_listener.stop()
             logging.info("stop exchange listener: %s", exchange_listener.exchange)
-        self.session.commit()
+        if self.writer:
+            self.writer.stop()
+            logging.info("db writer stopped: %s", self.writer.metrics())
+        self.executor.commit()
+        if self.capture:
+            self.capture.close()
+
+    def metrics(self):
+        if self.writer:
+            return self.writer.metrics()
+        return {}
+
+    async def _flush_periodically(self):
+        if self.flush_policy.max_age is None:
+            return
+        while True:
+            delay = self.executor.time_until_due()
+            await asyncio.sleep(self.flush_policy.max_age if delay is None else delay)
+            try:
+                self.executor.flush_if_due()
+            except Exception:
+                logging.exception("error on periodic commit")
+                self.executor.rollback()
+
+    async def _emit_snapshots_periodically(self):
+        while True:
+            snapshot_time = self.live_snapshots.next_snapshot_time(time.time())
+            await asyncio.sleep(max(snapshot_time - time.time(), 0))
+            pending = self.emit_snapshots(datetime.fromtimestamp(snapshot_time))
+            if asyncio.isfuture(pending):
+                await pending
+
+    def emit_snapshots(self, timestamp):
+        """writes the snapshots of the live order books taken at ``timestamp``
+        along with the ingested events; returns a future to await when the
+        writer queue is full
+        """
+        snapshots = self.live_snapshots.take_snapshots(timestamp)
+        logging.debug("live snapshots - %d snapshots taken", len(snapshots))
+        if snapshots:
+            return self._submit([InsertAction(snapshots)])
+        return None
+
+    async def _log_metrics(self):
+        while True:
+            await asyncio.sleep(METRICS_LOG_INTERVAL)
+            logging.info("db writer metrics: %s", self.metrics())
+
+    def _on_db_error(self, error):
+        # the pending statements and buffered rows of the executor are
+        # discarded along with the transaction, otherwise the next commit
+        # would send the same rows again
+        uncommitted = self.executor.rollback()
+        logging.error("db error, %d uncommitted batches discarded: %s", len(uncommitted), error)
 
     def _on_event(self, actions: List[Action]):
-        for action in actions:
-            self._track_actions(action)
-            self._rows_modified += action.execute(self.session)
-
-        if self._rows_modified >= self.commit_interval:
-            logging.info(("commit number [%s]: committing changes "
-                "Insert Actions: %s, Update Actions: %s"), 
-                self._stats["commits"], self._stats["inserts"], self._stats["updates"])
-            self.session.commit()
-            self._rows_modified = 0
-            self._stats["commits"] += 1
-            self._stats["inserts"] = 0
-            self._stats["updates"] = 0
-            
-    def _track_actions(self, action):
-        if isinstance(action, InsertAction):
-            self._stats["inserts"] += 1
-        elif isinstance(action, UpdateAction):
-            self._stats["updates"] += 1
\ No newline at end of file
+        if self.live_snapshots:
+            self.live_snapshots.observe(actions)
+        return self._submit(actions)
+
+    def _submit(self, actions: List[Action]):
+        """executes or queues the actions; returns a future to await when the
+        writer queue is full
+        """
+        if self.writer:
+            return self.writer.submit(actions)
+        self.executor.execute(actions)
+        return None
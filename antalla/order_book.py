@@ -0,0 +1,180 @@
+import bisect
+from collections import deque
+from typing import Dict, List, Tuple
+
+from .records import AggOrderBatch
+
+# maximum number of diffs kept while waiting for a snapshot, the oldest
+# ones are dropped first
+MAX_BUFFERED_DIFFS = 10000
+
+
+class SequenceGap(Exception):
+    """raised when an update does not follow the last update applied to a book
+    """
+
+    def __init__(self, market, expected_id, first_update_id):
+        super().__init__(f"{market}: expected update {expected_id}, got {first_update_id}")
+        self.market = market
+        self.expected_id = expected_id
+        self.first_update_id = first_update_id
+
+
+class OrderBookSide:
+    """price levels of one side of a book, kept sorted by price; the best
+    level is at the end of the list for bids and at its start for asks
+
+    >>> bids = OrderBookSide(is_bid=True)
+    >>> bids.update(1.0, 2.0); bids.update(3.0, 1.0); bids.update(2.0, 5.0)
+    >>> bids.best(), bids.top(2)
+    ((3.0, 1.0), [(3.0, 1.0), (2.0, 5.0)])
+    >>> bids.update(3.0, 0.0)
+    >>> bids.best(), len(bids)
+    ((2.0, 5.0), 2)
+    """
+
+    def __init__(self, is_bid):
+        self.is_bid = is_bid
+        self._prices: List[float] = []
+        self._sizes: Dict[float, float] = {}
+
+    def __len__(self):
+        return len(self._prices)
+
+    def update(self, price, size):
+        """sets the size of a price level; a size of 0 removes the level
+        """
+        if size == 0:
+            if self._sizes.pop(price, None) is not None:
+                del self._prices[bisect.bisect_left(self._prices, price)]
+        else:
+            if price not in self._sizes:
+                bisect.insort(self._prices, price)
+            self._sizes[price] = size
+
+    def clear(self):
+        self._prices = []
+        self._sizes = {}
+
+    def size(self, price):
+        """returns the size of a price level, 0 if there is no such level
+        """
+        return self._sizes.get(price, 0.0)
+
+    def best(self):
+        if not self._prices:
+            return None
+        price = self._prices[-1] if self.is_bid else self._prices[0]
+        return price, self._sizes[price]
+
+    def top(self, k) -> List[Tuple[float, float]]:
+        """returns the k best levels, from the best one
+        """
+        prices = self._prices[:-k - 1:-1] if self.is_bid else self._prices[:k]
+        return [(price, self._sizes[price]) for price in prices]
+
+    def within(self, price) -> List[Tuple[float, float]]:
+        """returns the levels from the best one up to ``price`` included
+
+        >>> asks = OrderBookSide(is_bid=False)
+        >>> asks.update(2.0, 1.0); asks.update(3.0, 2.0); asks.update(4.0, 3.0)
+        >>> asks.within(3.0)
+        [(2.0, 1.0), (3.0, 2.0)]
+        """
+        if self.is_bid:
+            prices = reversed(self._prices[bisect.bisect_left(self._prices, price):])
+        else:
+            prices = self._prices[:bisect.bisect_right(self._prices, price)]
+        return [(price, self._sizes[price]) for price in prices]
+
+
+class OrderBook:
+    """in-memory order book of a market built from a snapshot and the diffs
+    which follow it
+
+    Diffs carry the range of update ids they cover. A diff whose last id
+    is not after the last id applied is stale and skipped, a diff starting
+    after the next expected id means updates were missed and raises a
+    ``SequenceGap``. Until a snapshot is loaded, and after ``invalidate``,
+    diffs are buffered and the ones following the snapshot are applied
+    when it is loaded.
+
+    >>> market = dict(buy_sym_id="BNB", sell_sym_id="BTC")
+    >>> book = OrderBook("BNBBTC")
+    >>> book.load_snapshot(AggOrderBatch.from_levels([["1.0", "2"]], [["1.5", "1"]],
+    ...                                              last_update_id=10, **market))
+    []
+    >>> book.apply(AggOrderBatch.from_levels([["1.2", "1"]], [], last_update_id=12, **market), 11)
+    True
+    >>> book.best_bid(), book.best_ask(), book.last_update_id
+    ((1.2, 1.0), (1.5, 1.0), 12)
+    >>> book.apply(AggOrderBatch.from_levels([["1.2", "0"]], [], last_update_id=20, **market), 15)
+    Traceback (most recent call last):
+    ...
+    antalla.order_book.SequenceGap: BNBBTC: expected update 13, got 15
+    """
+
+    def __init__(self, market=None):
+        self.market = market
+        self.bids = OrderBookSide(is_bid=True)
+        self.asks = OrderBookSide(is_bid=False)
+        self.last_update_id = None
+        self._buffered = deque(maxlen=MAX_BUFFERED_DIFFS)
+
+    @property
+    def synced(self) -> bool:
+        return self.last_update_id is not None
+
+    def invalidate(self):
+        """discards the levels of the book, which buffers the diffs received
+        until the next snapshot
+        """
+        self.bids.clear()
+        self.asks.clear()
+        self.last_update_id = None
+
+    def load_snapshot(self, batch: AggOrderBatch) -> List[AggOrderBatch]:
+        """replaces the levels of the book with the ones of a snapshot and
+        applies the buffered diffs which follow it; returns those diffs
+        """
+        self.invalidate()
+        self._update_levels(batch)
+        self.last_update_id = batch.last_update_id
+        buffered, self._buffered = self._buffered, deque(maxlen=MAX_BUFFERED_DIFFS)
+        applied = []
+        for diff, first_update_id in buffered:
+            if self.apply(diff, first_update_id):
+                applied.append(diff)
+        return applied
+
+    def apply(self, batch: AggOrderBatch, first_update_id) -> bool:
+        """applies a diff covering the updates from ``first_update_id`` to the
+        last update id of the batch; returns False when the diff is buffered
+        or stale
+        """
+        if not self.synced:
+            self._buffered.append((batch, first_update_id))
+            return False
+        if batch.last_update_id <= self.last_update_id:
+            return False
+        if first_update_id > self.last_update_id + 1:
+            raise SequenceGap(self.market, self.last_update_id + 1, first_update_id)
+        self._update_levels(batch)
+        self.last_update_id = batch.last_update_id
+        return True
+
+    def best_bid(self):
+        return self.bids.best()
+
+    def best_ask(self):
+        return self.asks.best()
+
+    def depth(self, k):
+        """returns the k best bid and ask levels
+        """
+        return self.bids.top(k), self.asks.top(k)
+
+    def _update_levels(self, batch):
+        for price, size, is_bid in zip(batch.prices.tolist(), batch.sizes.tolist(),
+                                       batch.is_bid.tolist()):
+            (self.bids if is_bid else self.asks).update(price, size)
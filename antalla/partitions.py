@@ -0,0 +1,171 @@
+import logging
+import re
+from datetime import date, timedelta
+from typing import Dict, List
+
+from sqlalchemy import text
+
+from . import models
+
+PARTITIONED_TABLES = [
+    models.AggOrder.__tablename__,
+    models.Trade.__tablename__,
+    models.OrderBookSnapshot.__tablename__,
+]
+
+PARTITION_NAME_PATTERN = re.compile(r"_p(\d{8})$")
+
+# creating or detaching a partition locks the partitioned table, which would
+# otherwise hold back the writers while waiting for long running queries
+LOCK_TIMEOUT = "5s"
+
+
+def partition_name(table: str, day: date) -> str:
+    """returns the name of the partition holding the rows of the given day
+
+    >>> partition_name("trades", date(2019, 5, 1))
+    'trades_p20190501'
+    """
+    return f"{table}_p{day:%Y%m%d}"
+
+
+def default_partition_name(table: str) -> str:
+    return f"{table}_default"
+
+
+class PartitionManager:
+    """creates and expires the daily partitions of the tables partitioned by timestamp
+    """
+
+    def __init__(self, session, tables=None):
+        if tables is None:
+            tables = PARTITIONED_TABLES
+        self.session = session
+        self.tables = tables
+
+    def partitions(self, table: str) -> Dict[date, str]:
+        """returns the daily partitions currently attached to the table, by day
+        """
+        rows = self.session.execute(
+            text(
+                """
+            select child.relname from pg_inherits
+            join pg_class parent on parent.oid = pg_inherits.inhparent
+            join pg_class child on child.oid = pg_inherits.inhrelid
+            where parent.relname = :table
+            """
+            ),
+            dict(table=table),
+        )
+        partitions = {}
+        for (name,) in rows:
+            match = PARTITION_NAME_PATTERN.search(name)
+            if match and name == partition_name(table, _parse_day(match.group(1))):
+                partitions[_parse_day(match.group(1))] = name
+        return partitions
+
+    def create_partitions(self, start: date, days: int) -> List[str]:
+        """creates the missing partitions for ``days`` days from ``start`` and
+        returns their names. The rows of a day already stored in the default
+        partition, e.g. when a run was missed, are moved to its partition
+        """
+        created = []
+        self._set_lock_timeout()
+        for table in self.tables:
+            existing = self.partitions(table)
+            for offset in range(days):
+                day = start + timedelta(days=offset)
+                if day in existing:
+                    continue
+                if self._has_default_rows(table, day):
+                    name = self._move_default_rows(table, day)
+                else:
+                    name = self._create_partition(table, day)
+                logging.info("partitions - created %s", name)
+                created.append(name)
+        self.session.commit()
+        return created
+
+    def expire_partitions(self, before: date, drop=True) -> List[str]:
+        """detaches the partitions of the days before the given date and returns
+        their names; detached partitions are dropped unless ``drop`` is False.
+        When dropping, the rows of these days left in the default partition
+        are deleted too
+        """
+        expired = []
+        self._set_lock_timeout()
+        for table in self.tables:
+            for day, name in sorted(self.partitions(table).items()):
+                if day >= before:
+                    continue
+                self.session.execute(f"alter table {table} detach partition {name}")
+                if drop:
+                    self.session.execute(f"drop table {name}")
+                logging.info("partitions - %s %s", "dropped" if drop else "detached", name)
+                expired.append(name)
+            if drop:
+                deleted = self.session.execute(
+                    text(f"""delete from {default_partition_name(table)} where "timestamp" < :before"""),
+                    dict(before=before),
+                ).rowcount
+                if deleted:
+                    logging.info("partitions - deleted %d rows before %s from %s",
+                                 deleted, before, default_partition_name(table))
+        self.session.commit()
+        return expired
+
+    def _create_partition(self, table, day):
+        name = partition_name(table, day)
+        self.session.execute(
+            f"""
+            create table {name} partition of {table}
+            for values from ('{day}') to ('{day + timedelta(days=1)}')
+            """
+        )
+        return name
+
+    def _move_default_rows(self, table, day):
+        """creates the partition of a day whose rows are in the default
+        partition and moves them to it; the default partition is detached
+        meanwhile, as a partition cannot be created while it holds rows of
+        the new partition
+        """
+        default = default_partition_name(table)
+        bounds = dict(start=day, end=day + timedelta(days=1))
+        self.session.execute(f"alter table {table} detach partition {default}")
+        name = self._create_partition(table, day)
+        moved = self.session.execute(
+            text(
+                f"""
+            insert into {name} select * from {default}
+            where "timestamp" >= :start and "timestamp" < :end
+            """
+            ),
+            bounds,
+        ).rowcount
+        self.session.execute(
+            text(f"""delete from {default} where "timestamp" >= :start and "timestamp" < :end"""),
+            bounds,
+        )
+        self.session.execute(f"alter table {table} attach partition {default} default")
+        logging.info("partitions - moved %d rows of %s from %s to %s", moved, day, default, name)
+        return name
+
+    def _set_lock_timeout(self):
+        self.session.execute(f"set local lock_timeout = '{LOCK_TIMEOUT}'")
+
+    def _has_default_rows(self, table, day):
+        rows = self.session.execute(
+            text(
+                f"""
+            select 1 from {default_partition_name(table)}
+            where "timestamp" >= :start and "timestamp" < :end limit 1
+            """
+            ),
+            dict(start=day, end=day + timedelta(days=1)),
+        )
+        return rows.first() is not None
+
+
+def _parse_day(value: str) -> date:
+    return date(int(value[:4]), int(value[4:6]), int(value[6:]))
@@ -0,0 +1,156 @@
+import numpy as np
+
+from . import models
+
+
+class Record:
+    """plain row of a table, cheaper to create than an instance of the
+    mapped model; records are written by insert actions like model instances
+    """
+
+    __slots__ = ()
+    __model__ = None
+
+    def __init__(self, **values):
+        for name in self.__slots__:
+            setattr(self, name, values.pop(name, None))
+        if values:
+            raise TypeError(f"unknown columns for {type(self).__name__}: {sorted(values)}")
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        values = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({values})"
+
+
+class AggOrderRecord(Record):
+    """row of the aggregate orders
+
+    >>> order = AggOrderRecord(buy_sym_id="ETH", sell_sym_id="BTC", price=1.0)
+    >>> order.first_coin_id, order.second_coin_id
+    ('BTC', 'ETH')
+    """
+
+    __model__ = models.AggOrder
+    __slots__ = tuple(models.AggOrder.insert_columns())
+
+    def __init__(self, **values):
+        super().__init__(**values)
+        self.first_coin_id, self.second_coin_id = self.buy_sym_id, self.sell_sym_id
+        if self.first_coin_id > self.second_coin_id:
+            self.first_coin_id, self.second_coin_id = self.second_coin_id, self.first_coin_id
+
+
+class TradeRecord(Record):
+    __model__ = models.Trade
+    __slots__ = tuple(models.Trade.insert_columns())
+
+
+class AggOrderBatch:
+    """aggregate orders of a single market and update stored as columns: the
+    prices, sizes and sides are arrays, the other columns are shared by all
+    the orders of the batch
+
+    >>> batch = AggOrderBatch.from_levels([["0.5", "10"]], [["2.0", "20"], ["3", "5"]],
+    ...                                   buy_sym_id="ETH", sell_sym_id="BTC")
+    >>> len(batch), batch.prices.tolist(), batch.order_types.tolist()
+    (3, [0.5, 2.0, 3.0], ['bid', 'ask', 'ask'])
+    >>> batch[2].size
+    5.0
+    """
+
+    __model__ = models.AggOrder
+    __slots__ = ("timestamp", "last_update_id", "buy_sym_id", "sell_sym_id",
+                 "first_coin_id", "second_coin_id", "exchange_id", "prices", "sizes", "is_bid")
+
+    def __init__(self, prices, sizes, is_bid, timestamp=None, last_update_id=None,
+                 buy_sym_id=None, sell_sym_id=None, exchange_id=None):
+        self.prices = prices
+        self.sizes = sizes
+        self.is_bid = is_bid
+        self.timestamp = timestamp
+        self.last_update_id = last_update_id
+        self.buy_sym_id = buy_sym_id
+        self.sell_sym_id = sell_sym_id
+        self.exchange_id = exchange_id
+        self.first_coin_id, self.second_coin_id = buy_sym_id, sell_sym_id
+        if self.first_coin_id > self.second_coin_id:
+            self.first_coin_id, self.second_coin_id = sell_sym_id, buy_sym_id
+
+    @classmethod
+    def from_levels(cls, bids, asks, **values):
+        """creates a batch from lists of ``[price, size]`` levels, given as
+        strings or numbers
+        """
+        bids = np.array(bids, dtype=float).reshape(-1, 2)
+        asks = np.array(asks, dtype=float).reshape(-1, 2)
+        is_bid = np.zeros(len(bids) + len(asks), dtype=bool)
+        is_bid[:len(bids)] = True
+        return cls(np.concatenate((bids[:, 0], asks[:, 0])),
+                   np.concatenate((bids[:, 1], asks[:, 1])),
+                   is_bid, **values)
+
+    @property
+    def order_types(self):
+        return np.where(self.is_bid, "bid", "ask")
+
+    def column(self, name):
+        """returns the values of a column, as an array or as a single value
+        shared by all the orders
+        """
+        if name == "price":
+            return self.prices
+        if name == "size":
+            return self.sizes
+        if name == "order_type":
+            return self.order_types
+        return getattr(self, name)
+
+    def to_dicts(self):
+        values = {name: getattr(self, name) for name in self.__slots__[:7]}
+        return [
+            dict(values, order_type="bid" if is_bid else "ask", price=price, size=size)
+            for price, size, is_bid in zip(self.prices.tolist(), self.sizes.tolist(),
+                                           self.is_bid.tolist())
+        ]
+
+    def __len__(self):
+        return len(self.prices)
+
+    def __getitem__(self, i):
+        return AggOrderRecord(
+            order_type="bid" if self.is_bid[i] else "ask",
+            price=float(self.prices[i]),
+            size=float(self.sizes[i]),
+            **{name: getattr(self, name) for name in self.__slots__[:7]})
+
+
+def row_count(items):
+    """returns the number of rows of a list of records, model instances and batches
+    """
+    return sum(len(item) if isinstance(item, AggOrderBatch) else 1 for item in items)
+
+
+RECORD_TYPES = {record_type.__model__: record_type for record_type in (AggOrderRecord, TradeRecord)}
+
+
+def model_of(item_type):
+    """returns the mapped model of a model or record type
+
+    >>> model_of(TradeRecord) is models.Trade
+    True
+    >>> model_of(models.Trade) is models.Trade
+    True
+    """
+    return getattr(item_type, "__model__", None) or item_type
+
+
+def item_values(item):
+    """returns the column values set on a record or a model instance
+    """
+    if isinstance(item, Record):
+        return item.to_dict()
+    columns = item.__table__.columns
+    return {name: value for name, value in vars(item).items() if name in columns}
@@ -0,0 +1,134 @@
+import glob
+import logging
+import os
+import pickle
+import struct
+import threading
+import time
+from typing import Iterator, List
+
+from . import models
+from .actions import Action, InsertAction, UpdateAction
+from .records import RECORD_TYPES, AggOrderBatch, item_values
+
+# each record is a batch of actions, prefixed by the length of its payload
+RECORD_HEADER = struct.Struct(">I")
+SEGMENT_SUFFIX = ".replay"
+
+
+def encode_actions(actions: List[Action]) -> bytes:
+    """serializes a batch of actions to plain rows, independently of the
+    state of the mapped instances; columnar batches are kept as they are
+
+    >>> actions = [InsertAction([models.Coin(symbol="ETH")]),
+    ...            UpdateAction(models.Coin, dict(symbol="ETH"), dict(name="Ether"))]
+    >>> decode_actions(encode_actions(actions))[1].update
+    {'name': 'Ether'}
+    """
+    records = []
+    for action in actions:
+        if isinstance(action, InsertAction):
+            if not action.items:
+                continue
+            batches = [item for item in action.items if isinstance(item, AggOrderBatch)]
+            rows = [item_values(item) for item in action.items
+                    if not isinstance(item, AggOrderBatch)]
+            if rows:
+                records.append(("insert", action.item_type.__name__, rows))
+            if batches:
+                records.append(("batch", action.item_type.__name__, batches))
+        elif isinstance(action, UpdateAction):
+            records.append(("update", action.model.__name__, action.query, action.update))
+        else:
+            raise ValueError(f"cannot spool action {action!r}")
+    return pickle.dumps(records, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def decode_actions(payload: bytes) -> List[Action]:
+    actions = []
+    for record in pickle.loads(payload):
+        kind, model = record[0], getattr(models, record[1])
+        if kind == "insert":
+            item_type = RECORD_TYPES.get(model, model)
+            actions.append(InsertAction([item_type(**row) for row in record[2]]))
+        elif kind == "batch":
+            actions.append(InsertAction(record[2]))
+        else:
+            actions.append(UpdateAction(model, record[2], record[3]))
+    return actions
+
+
+class Spool:
+    """append-only local file of length-prefixed batches of actions, used to
+    keep the data received while the database is unavailable or lagging
+
+    The active file is moved aside to a segment by ``rotate``, after which
+    the segment can be replayed and removed while new batches are appended.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = None
+
+    def append(self, actions: List[Action]):
+        payload = encode_actions(actions)
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, "ab")
+            self._file.write(RECORD_HEADER.pack(len(payload)) + payload)
+            self._file.flush()
+
+    def rotate(self) -> List[str]:
+        """moves the active file aside and returns all the segments waiting
+        to be replayed, oldest first
+        """
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+                suffix = int(time.time() * 1e6)
+                while os.path.exists(self._segment_path(suffix)):
+                    suffix += 1
+                os.rename(self.path, self._segment_path(suffix))
+        return self.segments()
+
+    def segments(self) -> List[str]:
+        segments = glob.glob(glob.escape(self.path) + ".*" + SEGMENT_SUFFIX)
+        return sorted(segments, key=lambda segment: int(segment.split(".")[-2]))
+
+    @property
+    def pending(self) -> bool:
+        with self._lock:
+            if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+                return True
+        return bool(self.segments())
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    @staticmethod
+    def read(segment) -> Iterator[List[Action]]:
+        """yields the batches of actions of a segment; an incomplete record at
+        the end of the segment, e.g. after a crash, is skipped
+        """
+        with open(segment, "rb") as f:
+            while True:
+                header = f.read(RECORD_HEADER.size)
+                if not header:
+                    return
+                payload = b""
+                if len(header) == RECORD_HEADER.size:
+                    (size,) = RECORD_HEADER.unpack(header)
+                    payload = f.read(size)
+                if len(header) < RECORD_HEADER.size or len(payload) < size:
+                    logging.warning("spool - skipping incomplete record at the end of %s", segment)
+                    return
+                yield decode_actions(payload)
+
+    def _segment_path(self, suffix):
+        return f"{self.path}.{suffix}{SEGMENT_SUFFIX}"
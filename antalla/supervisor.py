@@ -0,0 +1,183 @@
+import asyncio
+import logging
+import multiprocessing
+import signal
+import time
+from typing import Dict, List
+
+HEALTH_CHECK_INTERVAL = 1.0
+HEARTBEAT_INTERVAL = 1.0
+HEARTBEAT_TIMEOUT = 60.0
+RESTART_DELAY = 1.0
+MAX_RESTART_DELAY = 60.0
+STOP_TIMEOUT = 30
+
+
+def shard_markets(markets: Dict[str, List[str]], shards: int) -> List[Dict[str, List[str]]]:
+    """splits the markets of each exchange into at most ``shards`` contiguous
+    groups of similar size, so that each exchange is listened to from as
+    few processes as possible
+
+    >>> shard_markets({"binance": ["ETH_BTC", "BTC_USD", "ETH_USD"], "hitbtc": ["ETH_BTC"]}, 2)
+    [{'binance': ['ETH_BTC', 'BTC_USD']}, {'binance': ['ETH_USD'], 'hitbtc': ['ETH_BTC']}]
+    >>> shard_markets({"binance": ["ETH_BTC"]}, 3)
+    [{'binance': ['ETH_BTC']}]
+    """
+    pairs = [(exchange, market) for exchange, exchange_markets in markets.items()
+             for market in exchange_markets]
+    size, remainder = divmod(len(pairs), shards)
+    result = []
+    start = 0
+    for i in range(shards):
+        end = start + size + (1 if i < remainder else 0)
+        shard = {}
+        for exchange, market in pairs[start:end]:
+            shard.setdefault(exchange, []).append(market)
+        if shard:
+            result.append(shard)
+        start = end
+    return result
+
+
+def run_worker(index, markets, options, heartbeat):
+    """runs an orchestrator for a shard of the markets in a worker process
+    """
+    from . import db
+    from .orchestrator import Orchestrator
+
+    db.use_profile("ingest")
+    options = dict(options)
+    for name in ("spool_file", "capture_file"):
+        if options.get(name):
+            options[name] = f"{options[name]}.{index}"
+    orchestrator = Orchestrator(list(markets), markets=markets, **options)
+    stopped = False
+
+    def handler(_signum, _frame):
+        nonlocal stopped
+        if not stopped:
+            stopped = True
+            orchestrator.stop()
+    signal.signal(signal.SIGINT, handler)
+    signal.signal(signal.SIGTERM, handler)
+
+    async def beat():
+        while True:
+            heartbeat.value = time.time()
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+    async def run():
+        beat_task = asyncio.ensure_future(beat())
+        try:
+            await orchestrator.start()
+        finally:
+            beat_task.cancel()
+
+    logging.info("worker %d listening to %s", index, markets)
+    asyncio.get_event_loop().run_until_complete(run())
+
+
+class _Worker:
+    def __init__(self, index, markets):
+        self.index = index
+        self.markets = markets
+        self.process = None
+        self.heartbeat = None
+        self.started_at = None
+        self.restart_at = None
+        self.failures = 0
+
+
+class Supervisor:
+    """runs one orchestrator per shard of markets in separate processes,
+    restarting the workers which exit or stop sending heartbeats
+    """
+
+    def __init__(self,
+                 shards: List[Dict[str, List[str]]],
+                 options=None,
+                 target=run_worker,
+                 heartbeat_timeout=HEARTBEAT_TIMEOUT,
+                 restart_delay=RESTART_DELAY):
+        if options is None:
+            options = {}
+        self.options = options
+        self.target = target
+        self.heartbeat_timeout = heartbeat_timeout
+        self.restart_delay = restart_delay
+        self.workers = [_Worker(i, markets) for i, markets in enumerate(shards)]
+        self.restarts = 0
+        self._context = multiprocessing.get_context("spawn")
+        self._stopping = False
+
+    def run(self):
+        def handler(_signum, _frame):
+            self._stopping = True
+        signal.signal(signal.SIGINT, handler)
+        signal.signal(signal.SIGTERM, handler)
+        self.start()
+        try:
+            while not self._stopping:
+                time.sleep(HEALTH_CHECK_INTERVAL)
+                self.check_workers()
+        finally:
+            self.stop()
+
+    def start(self):
+        for worker in self.workers:
+            self._start_worker(worker)
+
+    def check_workers(self):
+        now = time.time()
+        for worker in self.workers:
+            if worker.process is None:
+                if now >= worker.restart_at:
+                    self.restarts += 1
+                    self._start_worker(worker)
+            elif not worker.process.is_alive():
+                logging.error("worker %d exited with code %s", worker.index, worker.process.exitcode)
+                self._schedule_restart(worker, now)
+            elif now - max(worker.heartbeat.value, worker.started_at) > self.heartbeat_timeout:
+                logging.error("worker %d sent no heartbeat for %.0f seconds, terminating it",
+                              worker.index, now - worker.heartbeat.value)
+                worker.process.terminate()
+                worker.process.join(STOP_TIMEOUT)
+                if worker.process.is_alive():
+                    worker.process.kill()
+                self._schedule_restart(worker, now)
+
+    def stop(self, timeout=STOP_TIMEOUT):
+        self._stopping = True
+        processes = [worker.process for worker in self.workers if worker.process]
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        deadline = time.time() + timeout
+        for process in processes:
+            process.join(max(deadline - time.time(), 0))
+            if process.is_alive():
+                logging.warning("worker %s did not stop in time, killing it", process.name)
+                process.kill()
+                process.join()
+
+    def _start_worker(self, worker):
+        worker.heartbeat = self._context.Value("d", 0.0, lock=False)
+        worker.process = self._context.Process(
+            target=self.target,
+            args=(worker.index, worker.markets, self.options, worker.heartbeat),
+            name=f"antalla-worker-{worker.index}",
+        )
+        worker.started_at = time.time()
+        worker.process.start()
+        logging.info("started worker %d (pid %s)", worker.index, worker.process.pid)
+
+    def _schedule_restart(self, worker, now):
+        # workers failing shortly after being started are restarted with an
+        # increasing delay
+        if now - worker.started_at > MAX_RESTART_DELAY:
+            worker.failures = 0
+        delay = min(self.restart_delay * 2 ** worker.failures, MAX_RESTART_DELAY)
+        worker.failures += 1
+        worker.process = None
+        worker.restart_at = now + delay
+        logging.info("restarting worker %d in %.1f seconds", worker.index, delay)
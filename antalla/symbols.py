@@ -0,0 +1,103 @@
+import re
+import threading
+from typing import Dict, Optional, Tuple
+
+from . import models
+
+
+def split_market(market: str, all_symbols) -> Tuple[str, str]:
+    """
+    returns the individual coin symbols from a pair string of any possible length
+
+    >>> symbols = ["BTC", "ETH", "WAVE", "USD"]
+    >>> split_market("BTC_ETH", symbols)
+    ('BTC', 'ETH')
+    >>> split_market("BTCETH", symbols)
+    ('BTC', 'ETH')
+    >>> split_market("WAVEETH", symbols)
+    ('WAVE', 'ETH')
+    >>> split_market("USDWAVE", symbols)
+    ('USD', 'WAVE')
+    """
+    split_at = lambda string, n: (string[:n], string[n:])
+    symbols = re.split("[_-]", market)
+    if len(symbols) == 2:
+        return tuple(symbols)
+    if len(market) % 2 == 0:
+        return split_at(market, len(market) // 2)
+    for split_index in range(2, 10):
+        symbols = split_at(market, split_index)
+        if all(sym in all_symbols for sym in symbols):
+            return symbols
+    raise Exception("unknown pair {} to parse".format(market))
+
+
+class SymbolRegistry:
+    """maps the raw market names of an exchange, e.g. ``BNBBTC``, to their
+    ``(buy, sell)`` symbols. There is one registry per exchange, shared by all
+    its listeners and filled from the symbols endpoints of the exchange and
+    from the ``exchange_markets`` table
+
+    >>> registry = SymbolRegistry()
+    >>> registry.add("BNBBTC", ("BNB", "BTC"))
+    >>> registry.get("bnbbtc")
+    ('BNB', 'BTC')
+    """
+
+    _registries = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def for_exchange(cls, name: str) -> "SymbolRegistry":
+        with cls._lock:
+            if name not in cls._registries:
+                cls._registries[name] = cls()
+            return cls._registries[name]
+
+    def __init__(self):
+        self._pairs: Dict[str, Tuple[str, str]] = {}
+        self.loaded = False
+
+    def __len__(self):
+        return len(self._pairs)
+
+    def get(self, market: str) -> Optional[Tuple[str, str]]:
+        pair = self._pairs.get(market)
+        if pair is None:
+            pair = self._pairs.get(market.upper())
+        return pair
+
+    def add(self, market: str, pair: Tuple[str, str]):
+        pair = tuple(pair)
+        self._pairs[market] = pair
+        self._pairs[market.upper()] = pair
+
+    def update(self, pairs: Dict[str, Tuple[str, str]]):
+        for market, pair in pairs.items():
+            self.add(market, pair)
+
+    def add_exchange_markets(self, exchange_markets):
+        """registers the original names of exchange markets; the order of the
+        symbols is taken from the name, or else the quoted volume coin is the
+        buy symbol of the market
+        """
+        for market in exchange_markets:
+            first, second = market.first_coin_id, market.second_coin_id
+            name = re.sub("[_-]", "", market.original_name).upper()
+            if name == first + second:
+                pair = (first, second)
+            elif name == second + first or market.quoted_volume_id == second:
+                pair = (second, first)
+            else:
+                pair = (first, second)
+            self.add(market.original_name, pair)
+
+    def load(self, session, exchange_id):
+        """registers the markets of the exchange stored in the database
+        """
+        exchange_market = models.ExchangeMarket
+        self.add_exchange_markets(
+            session.query(exchange_market.original_name, exchange_market.quoted_volume_id,
+                          exchange_market.first_coin_id, exchange_market.second_coin_id)
+            .filter(exchange_market.exchange_id == exchange_id))
+        self.loaded = True
@@ -0,0 +1,78 @@
+import re
+from datetime import datetime, timedelta, timezone
+
+from dateutil.parser import parse as parse_date
+
+ISO_8601_PATTERN = re.compile(
+    r"(\d{4})-(\d\d)-(\d\d)[T ](\d\d):(\d\d):(\d\d)(?:\.(\d{1,6})\d*)?(Z|[+-]\d\d:?\d\d)?$"
+)
+
+
+def parse_iso(value: str) -> datetime:
+    """parses the ISO-8601 timestamps sent by the exchanges, falling back on
+    dateutil for the formats not handled by the fast path; the result is the
+    same as the one of ``dateutil.parser.parse``
+
+    >>> parse_iso("2019-04-11T18:27:46.028Z")
+    datetime.datetime(2019, 4, 11, 18, 27, 46, 28000, tzinfo=datetime.timezone.utc)
+    >>> parse_iso("2019-04-11 18:27:46")
+    datetime.datetime(2019, 4, 11, 18, 27, 46)
+    """
+    match = ISO_8601_PATTERN.match(value)
+    if match is None:
+        return parse_date(value)
+    year, month, day, hour, minute, second, fraction, offset = match.groups()
+    microsecond = int(fraction.ljust(6, "0")) if fraction else 0
+    tzinfo = None
+    if offset == "Z":
+        tzinfo = timezone.utc
+    elif offset:
+        sign = -1 if offset[0] == "-" else 1
+        offset = offset[1:].replace(":", "")
+        delta = timedelta(hours=int(offset[:2]), minutes=int(offset[2:]))
+        tzinfo = timezone.utc if not delta else timezone(sign * delta)
+    return datetime(int(year), int(month), int(day), int(hour), int(minute), int(second),
+                    microsecond, tzinfo)
+
+
+def from_epoch(seconds) -> datetime:
+    return datetime.fromtimestamp(seconds)
+
+
+def from_epoch_ms(milliseconds) -> datetime:
+    """converts an epoch in milliseconds to a naive local datetime, like
+    ``datetime.fromtimestamp``
+    """
+    return datetime.fromtimestamp(milliseconds / 1000)
+
+
+def to_datetime(value):
+    """converts epochs in milliseconds and ISO-8601 strings to datetimes,
+    other values are returned as they are
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return from_epoch_ms(value)
+    if isinstance(value, str):
+        return parse_iso(value)
+    return value
+
+
+class TimestampCache:
+    """caches the timestamps parsed while handling a message, in which the
+    same timestamp is usually repeated for many orders or trades
+    """
+
+    def __init__(self):
+        self._parsed = {}
+
+    def parse_iso(self, value: str) -> datetime:
+        parsed = self._parsed.get(value)
+        if parsed is None:
+            parsed = self._parsed[value] = parse_iso(value)
+        return parsed
+
+    def from_epoch(self, seconds) -> datetime:
+        parsed = self._parsed.get(seconds)
+        if parsed is None:
+            parsed = self._parsed[seconds] = from_epoch(seconds)
+        return parsed
@@ -1,5 +1,4 @@
 import asyncio
-import json
 import logging
 import traceback
 
@@ -7,10 +6,18 @@ import sqlalchemy
 import websockets
 
 from . import db
+from .decoding import TypeFilter, get_decoder
 from .exchange_listener import ExchangeListener
 
+# maximum number of frames already received on the socket handled at once
+MAX_PENDING_FRAMES = 100
+
 
 class WebsocketListener(ExchangeListener):
+    # key holding the type of the messages, used to skip the frames of the
+    # types without a ``_parse_<type>`` method before decoding them
+    message_type_key = None
+
     def __init__(
         self, exchange, on_event, markets, ws_url, session=db.session, event_type=None
     ):
@@ -19,39 +26,88 @@ class WebsocketListener(ExchangeListener):
         )
         self._running = False
         self._ws_url = ws_url
+        self._decode = get_decoder()
+        self._type_filter = None
+        if self.message_type_key is not None:
+            self._type_filter = TypeFilter(self.message_type_key, self.handled_message_types())
+        self.skipped_frames = 0
+        # CaptureWriter receiving the raw frames, set by the orchestrator
+        self.capture = None
+
+    @classmethod
+    def handled_message_types(cls):
+        return {name[len("_parse_"):] for name in dir(cls) if name.startswith("_parse_")}
+
+    def _get_ws_urls(self):
+        """returns the URLs of the connections of the listener; each one has
+        its own receive loop and is reconnected independently of the others
+        """
+        return [self._ws_url]
 
     async def listen(self):
         self.running = True
+        await asyncio.gather(*(self._listen_forever(ws_url) for ws_url in self._get_ws_urls()))
+
+    async def _listen_forever(self, ws_url):
         while self.running:
             try:
-                await self._listen()
+                await self._listen(ws_url)
             except sqlalchemy.exc.DBAPIError as e:
-                self.session.rollback()
                 logging.error("db error in db: %s", e)
-                self._log_disconnection()
+                if self.on_db_error:
+                    self.on_db_error(e)
+                else:
+                    self.session.rollback()
+                self._on_disconnected(ws_url)
             except Exception as e:
                 logging.error(
                     "error in %s: %s\n\t%s", self.exchange, e, traceback.format_exc()
                 )
-                self._log_disconnection()
+                self._on_disconnected(ws_url)
 
-    async def _listen(self):
-        logging.debug("websocket connecting to: %s", self._ws_url)
-        async with websockets.connect(self._ws_url) as websocket:
+    async def _listen(self, ws_url):
+        logging.debug("websocket connecting to: %s", ws_url)
+        async with websockets.connect(ws_url) as websocket:
             await self._setup_connection(websocket)
-            self._connected = True
+            self._on_connected(ws_url)
             while self.running:
                 try:
                     data = await asyncio.wait_for(websocket.recv(), timeout=1.0)
                 except asyncio.TimeoutError:
                     continue
-                logging.debug("received %s from %s", data, self.exchange)
-                actions = self._parse_message(json.loads(data))
-                self.on_event(actions)
+                actions = self._handle_frame(data)
+                for data in await self._receive_pending(websocket):
+                    actions.extend(self._handle_frame(data))
+                await self._dispatch(actions)
+
+    def _handle_frame(self, data):
+        logging.debug("received %s from %s", data, self.exchange)
+        if self.capture is not None:
+            self.capture.write(self.exchange.name, data)
+        if self._type_filter is not None and not self._type_filter.accepts(data):
+            self.skipped_frames += 1
+            return []
+        return list(self._parse_message(self._decode(data)))
+
+    async def _receive_pending(self, websocket):
+        """returns the frames which have already been received on the socket,
+        without waiting for new ones
+        """
+        frames = []
+        messages = getattr(websocket, "messages", None)
+        while messages and len(frames) < MAX_PENDING_FRAMES:
+            frames.append(await websocket.recv())
+        return frames
 
     async def _setup_connection(self, websocket):
         raise NotImplementedError()
 
+    def _on_connected(self, ws_url):
+        self._connected = True
+
+    def _on_disconnected(self, ws_url):
+        self._log_disconnection()
+
     def _parse_message(self, message):
         raise NotImplementedError()
 
@@ -0,0 +1,76 @@
+"""micro-benchmark of the decoding of the exchange message fixtures, with each
+installed JSON decoder and with the type pre-filter of the listeners
+
+usage: python scripts/benchmark_decoding.py [-n NUMBER]
+"""
+
+import argparse
+import glob
+import json
+import timeit
+from os import path
+
+from antalla import decoding
+from antalla.decoding import TypeFilter
+from antalla.exchange_listeners.binance_listener import BinanceListener
+from antalla.exchange_listeners.coinbase_listener import CoinbaseListener
+from antalla.exchange_listeners.hitbtc_listener import HitBTCListener
+from antalla.exchange_listeners.idex_listener import IdexListener
+
+FIXTURES_PATH = path.join(path.dirname(__file__), "..", "tests", "fixtures")
+
+LISTENERS = {
+    "binance": BinanceListener,
+    "coinbase": CoinbaseListener,
+    "hitbtc": HitBTCListener,
+    "idex": IdexListener,
+}
+
+IDEX_EVENTS = {"idex-order": "market_orders", "idex-trade": "market_trades",
+               "idex-cancel": "market_cancels"}
+
+
+def load_frame(exchange, fixture):
+    """returns a fixture as the frame received on the websocket: binance
+    messages are wrapped in a combined stream and idex payloads are strings
+    """
+    with open(fixture) as f:
+        content = f.read()
+    name = path.splitext(path.basename(fixture))[0]
+    if exchange == "binance":
+        return json.dumps(dict(stream="bnbbtc@depth", data=json.loads(content)))
+    if exchange == "idex":
+        return json.dumps(dict(event=IDEX_EVENTS.get(name, name), payload=content))
+    return content
+
+
+def benchmark(number):
+    decoders = sorted(decoding.DECODERS.items())
+    header = "{:<34} {:>8} {:>6}".format("fixture", "bytes", "kept")
+    header += "".join(" {:>10}".format(name + " µs") for name, _ in decoders)
+    print(header + " {:>10}".format("filter µs"))
+    for exchange, listener_class in sorted(LISTENERS.items()):
+        type_filter = TypeFilter(listener_class.message_type_key,
+                                 listener_class.handled_message_types())
+        for fixture in sorted(glob.glob(path.join(FIXTURES_PATH, exchange, "*.json"))):
+            if fixture.endswith("-markets.json"):
+                continue
+            frame = load_frame(exchange, fixture)
+            line = "{:<34} {:>8} {:>6}".format(
+                path.basename(fixture), len(frame), "yes" if type_filter.accepts(frame) else "no")
+            for _name, decoder in decoders:
+                elapsed = timeit.timeit(lambda: decoder(frame), number=number)
+                line += " {:>10.2f}".format(elapsed / number * 1e6)
+            elapsed = timeit.timeit(lambda: type_filter.accepts(frame), number=number)
+            print(line + " {:>10.2f}".format(elapsed / number * 1e6))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--number", type=int, default=10000,
+                        help="number of decodings of each fixture")
+    benchmark(parser.parse_args().number)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,365 @@
+"""end-to-end benchmark of the ingestion of high-volume streams synthesized
+from the exchange message fixtures. For each exchange listener, four stages
+are measured separately: decoding of the frames, parsing to actions,
+execution of the actions and commit, against the database of the current
+environment. The results can be written to a JSON file and compared to the
+results of a previous run to catch performance regressions.
+
+usage: ENV=test python scripts/benchmark_ingestion.py [-n MESSAGES] [--output FILE]
+                                                     [--compare FILE]
+"""
+
+import argparse
+import copy
+import json
+import platform
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from os import path
+
+from antalla import db, decoding, models
+from antalla.db_writer import DEFAULT_COMMIT_INTERVAL, ActionExecutor, FlushPolicy
+from antalla.decoding import get_decoder
+from antalla.exchange_listener import ExchangeListener
+from antalla.order_book import OrderBook
+# registers the listeners to the factory
+from antalla import exchange_listeners  # noqa: F401
+
+FIXTURES_PATH = path.join(path.dirname(__file__), "..", "tests", "fixtures")
+
+STAGES = ["decode", "parse", "execute", "commit"]
+
+# exchanges are created for each run and removed with their rows afterwards
+EXCHANGE_PREFIX = "benchmark-"
+
+# the market used for all the streams: (first coin, second coin) and the
+# original name of the market on each exchange
+MARKET = ("BTC", "ETH")
+MARKET_NAMES = {
+    "binance": "ETHBTC",
+    "coinbase": "ETH-BTC",
+    "hitbtc": "ETHBTC",
+    "idex": "ETH_BTC",
+}
+
+# one message out of TRADES_EVERY is a trade, the others are order book updates
+TRADES_EVERY = 4
+
+DEFAULT_MESSAGES = 20000
+DEFAULT_LEVELS = 10
+DEFAULT_TOLERANCE = 0.1
+
+
+def load_fixture(exchange, name):
+    with open(path.join(FIXTURES_PATH, exchange, name + ".json")) as f:
+        return json.load(f)
+
+
+def random_levels(rng, count):
+    return [["{:.6f}".format(rng.uniform(0.05, 0.06)), "{:.3f}".format(rng.uniform(0.001, 10))]
+            for _ in range(count)]
+
+
+def binance_frames(count, levels, rng):
+    depth_update = load_fixture("binance", "binance-depth-update")
+    trade = load_fixture("binance", "binance-trade")
+    market = MARKET_NAMES["binance"]
+    now = int(time.time() * 1000)
+    update_id = 0
+    for i in range(count):
+        if i % TRADES_EVERY == 0:
+            stream = market.lower() + "@trade"
+            data = dict(trade, E=now + i, T=now + i, t=i, s=market,
+                        p="{:.6f}".format(rng.uniform(0.05, 0.06)),
+                        q="{:.3f}".format(rng.uniform(0.001, 10)))
+        else:
+            stream = market.lower() + "@depth"
+            data = dict(depth_update, E=now + i, s=market, U=update_id, u=update_id + levels - 1,
+                        b=random_levels(rng, levels // 2), a=random_levels(rng, levels - levels // 2))
+            update_id += levels
+        yield json.dumps(dict(stream=stream, data=data))
+
+
+def coinbase_frames(count, levels, rng):
+    l2update = load_fixture("coinbase", "coinbase-l2update")
+    match = load_fixture("coinbase", "coinbase-match")
+    market = MARKET_NAMES["coinbase"]
+    now = datetime.now(timezone.utc)
+    for i in range(count):
+        if i % TRADES_EVERY == 0:
+            timestamp = (now + timedelta(milliseconds=i)).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+            message = dict(match, trade_id=i, sequence=i, time=timestamp, product_id=market,
+                           price="{:.6f}".format(rng.uniform(0.05, 0.06)),
+                           size="{:.3f}".format(rng.uniform(0.001, 10)))
+        else:
+            changes = [[rng.choice(("buy", "sell"))] + level for level in random_levels(rng, levels)]
+            message = dict(l2update, product_id=market, changes=changes)
+        yield json.dumps(message)
+
+
+def hitbtc_frames(count, levels, rng):
+    update_orderbook = load_fixture("hitbtc", "hitbtc-update-orderbook")
+    update_trades = load_fixture("hitbtc", "hitbtc-update-trades")
+    market = MARKET_NAMES["hitbtc"]
+    now = datetime.now(timezone.utc)
+    for i in range(count):
+        timestamp = (now + timedelta(milliseconds=i)).strftime("%Y-%m-%dT%H:%M:%S.%fZ")[:-4] + "Z"
+        if i % TRADES_EVERY == 0:
+            message = copy.deepcopy(update_trades)
+            trade = message["params"]["data"][0]
+            trade.update(id=i, timestamp=timestamp,
+                         price="{:.6f}".format(rng.uniform(0.05, 0.06)),
+                         quantity="{:.3f}".format(rng.uniform(0.001, 10)))
+            message["params"]["symbol"] = market
+        else:
+            message = copy.deepcopy(update_orderbook)
+            params = message["params"]
+            params.update(symbol=market, sequence=i, timestamp=timestamp,
+                          bid=[dict(price=p, size=s) for p, s in random_levels(rng, levels // 2)],
+                          ask=[dict(price=p, size=s)
+                               for p, s in random_levels(rng, levels - levels // 2)])
+        yield json.dumps(message)
+
+
+def idex_frames(count, levels, rng):
+    [order] = load_fixture("idex", "idex-order")["orders"]
+    [trade] = load_fixture("idex", "idex-trade")["trades"]
+    market = MARKET_NAMES["idex"]
+    now = time.time()
+    for i in range(count):
+        if i % TRADES_EVERY == 0:
+            event = "market_trades"
+            trades = [dict(trade, tid=i, timestamp=now + i / 1000, market=market,
+                           orderHash="0x{:064x}".format(i - 1),
+                           price="{:.6f}".format(rng.uniform(0.05, 0.06)),
+                           amount="{:.3f}".format(rng.uniform(0.001, 10)))]
+            payload = dict(market=market, trades=trades)
+        else:
+            event = "market_orders"
+            created_at = datetime.fromtimestamp(now + i / 1000, timezone.utc)
+            created_at = created_at.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+            orders = [dict(order, id=i * levels + j, hash="0x{:064x}".format(i * levels + j),
+                           amountBuy=str(rng.randint(10 ** 17, 10 ** 19)),
+                           amountSell=str(rng.randint(10 ** 9, 10 ** 11)),
+                           createdAt=created_at)
+                      for j in range(levels)]
+            payload = dict(market=market, orders=orders)
+        yield json.dumps(dict(event=event, payload=json.dumps(payload)))
+
+
+SYNTHESIZERS = {
+    "binance": binance_frames,
+    "coinbase": coinbase_frames,
+    "hitbtc": hitbtc_frames,
+    "idex": idex_frames,
+}
+
+
+def remove_benchmark_exchanges(session):
+    """removes the exchanges created by the benchmark and all their rows
+    """
+    exchange_ids = [exchange_id for exchange_id, in session.query(models.Exchange.id)
+                    .filter(models.Exchange.name.like(EXCHANGE_PREFIX + "%"))]
+    if exchange_ids:
+        for model in [models.AggOrder, models.Trade, models.OrderSize, models.Order,
+                      models.Event, models.ExchangeMarket]:
+            session.query(model).filter(model.exchange_id.in_(exchange_ids)) \
+                .delete(synchronize_session=False)
+        session.query(models.Exchange).filter(models.Exchange.id.in_(exchange_ids)) \
+            .delete(synchronize_session=False)
+    session.commit()
+
+
+def create_market(session):
+    """creates the coins and the market of the streams, and returns those
+    which did not exist yet
+    """
+    first_coin, second_coin = MARKET
+    created = [coin for coin in [models.Coin(symbol=first_coin), models.Coin(symbol=second_coin)]
+               if session.query(models.Coin).get(coin.symbol) is None]
+    if session.query(models.Market).get(MARKET) is None:
+        created.append(models.Market(first_coin_id=first_coin, second_coin_id=second_coin))
+    session.add_all(created)
+    session.commit()
+    return created
+
+
+def remove_market(session, created):
+    for item in reversed(created):
+        session.delete(item)
+    session.commit()
+
+
+def create_benchmark_exchange(session, exchange_name):
+    exchange = models.Exchange(name=EXCHANGE_PREFIX + exchange_name)
+    session.add(exchange)
+    session.flush()
+    first_coin, second_coin = MARKET
+    session.add(models.ExchangeMarket(
+        first_coin_id=first_coin, second_coin_id=second_coin, exchange_id=exchange.id,
+        original_name=MARKET_NAMES[exchange_name], quoted_volume=0,
+        quoted_volume_id=first_coin))
+    session.commit()
+    return exchange
+
+
+def count_rows(actions):
+    return sum(getattr(action, "row_count", 1) for action in actions)
+
+
+def benchmark_exchange(session, exchange_name, frames, decoder=None,
+                       bulk_insert=False, commit_rows=DEFAULT_COMMIT_INTERVAL):
+    exchange = create_benchmark_exchange(session, exchange_name)
+    market = "_".join(MARKET)
+    listener = ExchangeListener.create(exchange_name, exchange, lambda actions: None,
+                                       markets=[market], session=session)
+    if decoder is not None:
+        listener._decode = get_decoder(decoder)
+    if exchange_name == "binance":
+        # depth updates are applied to the in-memory book of the market
+        market_key = MARKET_NAMES["binance"]
+        listener.order_books[market_key] = OrderBook(market_key)
+        listener._parse_snapshot(dict(lastUpdateId=-1, bids=[], asks=[]), market_key)
+    executor = ActionExecutor(session, FlushPolicy(max_rows=None, max_bytes=None, max_age=None),
+                              bulk_insert=bulk_insert)
+    timings = dict.fromkeys(STAGES, 0.0)
+
+    started_at = time.perf_counter()
+    messages = [listener._decode(frame) for frame in frames
+                if listener._type_filter is None or listener._type_filter.accepts(frame)]
+    timings["decode"] = time.perf_counter() - started_at
+
+    started_at = time.perf_counter()
+    parsed_actions = [list(listener._parse_message(message)) for message in messages]
+    timings["parse"] = time.perf_counter() - started_at
+
+    rows = pending_rows = 0
+    for i, actions in enumerate(parsed_actions):
+        started_at = time.perf_counter()
+        executor.execute(actions)
+        pending_rows += count_rows(actions)
+        last = i == len(parsed_actions) - 1
+        if pending_rows >= commit_rows or last:
+            executor.flush()
+            flushed_at = time.perf_counter()
+            executor.commit()
+            timings["commit"] += time.perf_counter() - flushed_at
+            timings["execute"] += flushed_at - started_at
+            rows += pending_rows
+            pending_rows = 0
+        else:
+            timings["execute"] += time.perf_counter() - started_at
+
+    stages = {}
+    for stage, seconds in timings.items():
+        stages[stage] = dict(
+            seconds=seconds,
+            messages_per_second=len(messages) / seconds if seconds else None,
+            rows_per_second=rows / seconds if seconds else None,
+        )
+    return dict(frames=len(frames), messages=len(messages), rows=rows, stages=stages)
+
+
+def run(exchanges, count, levels, seed, decoder, bulk_insert, commit_rows, keep_rows):
+    session = db.Session()
+    remove_benchmark_exchanges(session)
+    created = create_market(session)
+    results = dict(
+        created_at=datetime.now().isoformat(),
+        python=platform.python_version(),
+        decoder=decoder or "auto",
+        bulk_insert=bulk_insert,
+        commit_rows=commit_rows,
+        levels=levels,
+        exchanges={},
+    )
+    try:
+        for exchange_name in exchanges:
+            frames = list(SYNTHESIZERS[exchange_name](count, levels, random.Random(seed)))
+            results["exchanges"][exchange_name] = benchmark_exchange(
+                session, exchange_name, frames, decoder=decoder,
+                bulk_insert=bulk_insert, commit_rows=commit_rows)
+    finally:
+        session.rollback()
+        if not keep_rows:
+            remove_benchmark_exchanges(session)
+            remove_market(session, created)
+        session.close()
+    return results
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """returns the (exchange, stage, ratio) of the stages whose throughput in
+    messages per second dropped by more than ``tolerance`` since the baseline
+    """
+    regressions = []
+    for exchange_name, result in results["exchanges"].items():
+        baseline_stages = baseline["exchanges"].get(exchange_name, {}).get("stages", {})
+        for stage, stats in result["stages"].items():
+            previous = baseline_stages.get(stage, {}).get("messages_per_second")
+            current = stats["messages_per_second"]
+            if not previous or current is None:
+                continue
+            ratio = current / previous
+            stats["baseline_ratio"] = ratio
+            if ratio < 1 - tolerance:
+                regressions.append((exchange_name, stage, ratio))
+    return regressions
+
+
+def print_results(results):
+    print("{:<10} {:<8} {:>10} {:>12} {:>12} {:>9}".format(
+        "exchange", "stage", "seconds", "messages/s", "rows/s", "baseline"))
+    for exchange_name, result in results["exchanges"].items():
+        for stage in STAGES:
+            stats = result["stages"][stage]
+            ratio = stats.get("baseline_ratio")
+            print("{:<10} {:<8} {:>10.3f} {:>12.0f} {:>12.0f} {:>9}".format(
+                exchange_name, stage, stats["seconds"], stats["messages_per_second"] or 0,
+                stats["rows_per_second"] or 0, "{:+.1%}".format(ratio - 1) if ratio else "-"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-e", "--exchanges", nargs="+", choices=sorted(SYNTHESIZERS),
+                        default=sorted(SYNTHESIZERS), help="exchange listeners to benchmark")
+    parser.add_argument("-n", "--messages", type=int, default=DEFAULT_MESSAGES,
+                        help="number of messages synthesized for each exchange")
+    parser.add_argument("--levels", type=int, default=DEFAULT_LEVELS,
+                        help="number of price levels or orders in each order book message")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthesized streams")
+    parser.add_argument("--decoder", choices=sorted(decoding.DECODERS),
+                        help="JSON decoder used by the listeners")
+    parser.add_argument("--bulk-insert", action="store_true",
+                        help="write agg orders and trades with COPY")
+    parser.add_argument("--commit-rows", type=int, default=DEFAULT_COMMIT_INTERVAL,
+                        help="number of rows written between commits")
+    parser.add_argument("--keep-rows", action="store_true",
+                        help="keep the rows written by the benchmark")
+    parser.add_argument("-o", "--output", help="JSON file to write the results to")
+    parser.add_argument("--compare", help="JSON results of a previous run to compare with")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="relative drop of throughput reported as a regression")
+    args = parser.parse_args()
+
+    results = run(args.exchanges, args.messages, args.levels, args.seed, args.decoder,
+                  args.bulk_insert, args.commit_rows, args.keep_rows)
+    regressions = []
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+    print_results(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    for exchange_name, stage, ratio in regressions:
+        print("regression: {} {} at {:.1%} of the baseline".format(exchange_name, stage, ratio))
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,7 +4,7 @@ setup(
     name="antalla",
     packages=find_packages(),
     install_requires=[
-        "SQLAlchemy==1.3.2",
+        "SQLAlchemy==1.3.24",
         "websockets==9.1",
         "python-dateutil==2.8.0",
         "psycopg2==2.8.1",
@@ -16,6 +16,7 @@ setup(
     ],
     extras_require={
         "plots": ["pandas==1.3.2"],
+        "speedups": ["orjson==3.6.4"],
         "dev": [
             "Sphinx==2.2.1",
             "sphinx-rtd-theme==0.4.3",
@@ -1,8 +1,11 @@
 import unittest
+from datetime import datetime
 from unittest.mock import MagicMock, call
 
 from antalla.actions import InsertAction, UpdateAction
 from antalla import models
+from tests.fixtures import dummy_db
+from tests.support import TransactionalTestCase
 
 
 class ActionsTest(unittest.TestCase):
@@ -15,6 +18,14 @@ class ActionsTest(unittest.TestCase):
         self.assertEqual(action.execute(self.mock_session), 3)
         self.mock_session.execute.assert_called_once()
 
+    def test_merge_insert_actions(self):
+        first = InsertAction([models.Coin(symbol="a"), models.Coin(symbol="b")])
+        second = InsertAction([models.Coin(symbol="b"), models.Coin(symbol="c")])
+        merged = InsertAction.merge([first, InsertAction([]), second])
+        self.assertEqual(merged.item_type, models.Coin)
+        self.assertEqual([item.symbol for item in merged.items], ["a", "b", "c"])
+        self.assertIs(merged.items[1], first.items[1])
+
     def test_update_action(self):
         model = MagicMock()
         results = [MagicMock(), MagicMock()]
@@ -26,3 +37,42 @@ class ActionsTest(unittest.TestCase):
         for result in results:
             self.assertEqual(result.name, "new_name")
 
+
+
+class UpdateActionTest(TransactionalTestCase):
+    def setUp(self):
+        super().setUp()
+        dummy_db.insert_coins(self.session)
+        dummy_db.insert_exchanges(self.session)
+        self.session.flush()
+        orders = [
+            models.Order(exchange_id=1, exchange_order_id=order_id, buy_sym_id="ETH",
+                         sell_sym_id="BTC", price=1.0)
+            for order_id in ["a", "b", "c"]
+        ]
+        InsertAction(orders).execute(self.session)
+
+    def test_execute_many(self):
+        cancelled_at = datetime(2019, 5, 1, 1, 0, 0)
+        filled_at = datetime(2019, 5, 1, 2, 0, 0)
+        update_actions = [
+            UpdateAction(models.Order, {"exchange_order_id": "a", "exchange_id": 1},
+                         {"cancelled_at": datetime(2019, 4, 1)}),
+            UpdateAction(models.Order, {"exchange_order_id": "a", "exchange_id": 1},
+                         {"cancelled_at": cancelled_at}),
+            UpdateAction(models.Order, {"exchange_order_id": "b", "exchange_id": 1},
+                         {"cancelled_at": cancelled_at}),
+            UpdateAction(models.Order, {"exchange_order_id": "c", "exchange_id": 1},
+                         {"filled_at": filled_at}),
+            UpdateAction(models.Order, {"exchange_order_id": "d", "exchange_id": 1},
+                         {"filled_at": filled_at}),
+        ]
+        self.assertEqual(UpdateAction.execute_many(self.session, update_actions), 3)
+        rows = self.session.execute(
+            f"""select exchange_order_id, cancelled_at, filled_at
+                from {models.Order.__tablename__} order by exchange_order_id""")
+        self.assertEqual([tuple(row) for row in rows], [
+            ("a", cancelled_at, None),
+            ("b", cancelled_at, None),
+            ("c", None, filled_at),
+        ])
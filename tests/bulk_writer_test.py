@@ -0,0 +1,83 @@
+import datetime
+
+from antalla import models
+from antalla.actions import InsertAction
+from antalla.bulk_writer import BulkWriter
+from antalla.records import AggOrderBatch
+from tests.fixtures import dummy_db
+from tests.support import TransactionalTestCase
+
+
+def create_agg_order(last_update_id, order_type, price, size):
+    return models.AggOrder(
+        last_update_id=last_update_id,
+        timestamp=datetime.datetime(2019, 5, 1, 1, 0, 0, 0),
+        buy_sym_id="ETH",
+        sell_sym_id="BTC",
+        exchange_id=1,
+        order_type=order_type,
+        price=price,
+        size=size,
+    )
+
+
+class BulkWriterTest(TransactionalTestCase):
+    def setUp(self):
+        super().setUp()
+        dummy_db.insert_coins(self.session)
+        dummy_db.insert_exchanges(self.session)
+        self.session.flush()
+        self.writer = BulkWriter()
+
+    def test_accepts(self):
+        self.assertTrue(self.writer.accepts(InsertAction([create_agg_order(1, "bid", 1.0, 2.0)])))
+        self.assertFalse(self.writer.accepts(InsertAction([models.Coin(symbol="BTC")])))
+
+    def test_flush(self):
+        orders = [create_agg_order(1, "bid", 1.0, 2.0), create_agg_order(1, "ask", 1.5, 3.0)]
+        self.assertEqual(self.writer.add(InsertAction(orders)), 2)
+        self.assertEqual(self.writer.pending_rows, 2)
+        self.assertEqual(self.writer.flush(self.session), 2)
+        self.assertEqual(self.writer.pending_rows, 0)
+        rows = list(self.session.execute(
+            f"select order_type, price, size from {models.AggOrder.__tablename__} order by price"
+        ))
+        self.assertEqual([tuple(row) for row in rows], [("bid", 1.0, 2.0), ("ask", 1.5, 3.0)])
+
+    def test_flush_ignores_conflicts(self):
+        self.writer.add(InsertAction([create_agg_order(1, "bid", 1.0, 2.0)]))
+        self.writer.flush(self.session)
+        self.writer.add(InsertAction([create_agg_order(1, "bid", 1.0, 2.0),
+                                      create_agg_order(2, "bid", 1.0, 0.0)]))
+        self.assertEqual(self.writer.flush(self.session), 1)
+        count = list(self.session.execute(f"select count(*) from {models.AggOrder.__tablename__}"))
+        self.assertEqual(count[0][0], 2)
+
+    def test_flush_batch(self):
+        batch = AggOrderBatch.from_levels(
+            [["1.0", "2.0"]], [["1.5", "3.0"], ["2", "0"]],
+            timestamp=datetime.datetime(2019, 5, 1, 1, 0, 0, 0),
+            last_update_id=1, buy_sym_id="ETH", sell_sym_id="BTC", exchange_id=1)
+        self.writer.add(InsertAction([create_agg_order(1, "bid", 1.0, 2.0)]))
+        self.assertEqual(self.writer.add(InsertAction([batch])), 3)
+        self.assertEqual(self.writer.pending_rows, 4)
+        self.assertEqual(self.writer.flush(self.session), 3)
+        rows = list(self.session.execute(
+            f"select order_type, price, size, first_coin_id, timestamp "
+            f"from {models.AggOrder.__tablename__} order by price"
+        ))
+        self.assertEqual([tuple(row)[:4] for row in rows], [
+            ("bid", 1.0, 2.0, "BTC"), ("ask", 1.5, 3.0, "BTC"), ("ask", 2.0, 0.0, "BTC")])
+        self.assertEqual(rows[0][4], datetime.datetime(2019, 5, 1, 1, 0, 0, 0))
+
+    def test_flush_epoch_timestamps(self):
+        order = create_agg_order(1, "bid", 1.0, 2.0)
+        order.timestamp = 1556672523000
+        batch = AggOrderBatch.from_levels(
+            [], [["1.5", "3.0"]], timestamp=1556672523000,
+            last_update_id=1, buy_sym_id="ETH", sell_sym_id="BTC", exchange_id=1)
+        self.writer.add(InsertAction([order, batch]))
+        self.assertEqual(self.writer.flush(self.session), 2)
+        rows = list(self.session.execute(
+            f"select distinct timestamp from {models.AggOrder.__tablename__}"))
+        self.assertEqual([row[0] for row in rows], [datetime.datetime.fromtimestamp(1556672523)])
@@ -0,0 +1,43 @@
+import gzip
+import os
+import tempfile
+import unittest
+
+from antalla.capture import CaptureWriter, read_capture
+
+
+class CaptureTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "frames.capture")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_write_and_read(self):
+        capture = CaptureWriter(self.path)
+        capture.write("binance", '{"e": "trade"}', received_at=1.5)
+        capture.write("coinbase", b'{"type": "match"}', received_at=2.0)
+        capture.close()
+        self.assertEqual(capture.frames, 2)
+        frames = list(read_capture(self.path))
+        self.assertEqual(frames[0], (1.5, "binance", '{"e": "trade"}'))
+        self.assertEqual(frames[1], (2.0, "coinbase", b'{"type": "match"}'))
+
+    def test_read_truncated(self):
+        capture = CaptureWriter(self.path)
+        for i in range(3):
+            capture.write("binance", '{"id": %d}' % i)
+        capture.close()
+        with gzip.open(self.path, "rb") as f:
+            content = f.read()
+        with gzip.open(self.path, "wb") as f:
+            f.write(content[:-3])
+        self.assertEqual([frame.data for frame in read_capture(self.path)],
+                         ['{"id": 0}', '{"id": 1}'])
+
+    def test_read_invalid(self):
+        with gzip.open(self.path, "wb") as f:
+            f.write(b"not a capture")
+        with self.assertRaises(ValueError):
+            list(read_capture(self.path))
@@ -0,0 +1,82 @@
+from datetime import datetime
+from os import path
+from unittest.mock import patch
+import runpy
+import time
+import unittest
+
+from antalla import db
+from antalla import models
+from tests.fixtures import dummy_db
+
+ENTRY_POINT = path.join(path.dirname(path.dirname(__file__)), "bin", "antalla")
+TABLES = ["order_book_checkpoints", "order_book_snapshots", "aggregate_orders", "events",
+          "exchange_markets", "markets", "coins", "exchanges"]
+
+
+def run_entry_point(*argv):
+    """runs the antalla script as the main module, the way the workers it
+    spawns find it
+    """
+    with patch("sys.argv", ["antalla", *argv]):
+        runpy.run_path(ENTRY_POINT, run_name="__main__")
+
+
+class EntryPointTest(unittest.TestCase):
+    """runs commands starting processes through the entry point, with data
+    committed to the db for the child processes to see it
+    """
+
+    def setUp(self):
+        self.session = db.Session()
+
+    def tearDown(self):
+        self.session.rollback()
+        for table in TABLES:
+            self.session.execute(f"delete from {table}")
+        self.session.commit()
+        self.session.close()
+
+    def test_run_workers(self):
+        dummy_db.insert_exchanges(self.session)
+        self.session.commit()
+        heartbeats = []
+
+        def run(supervisor):
+            supervisor.start()
+            try:
+                deadline = time.time() + 60
+                while time.time() < deadline and \
+                        not all(worker.heartbeat.value for worker in supervisor.workers):
+                    time.sleep(0.1)
+                heartbeats.extend(worker.heartbeat.value for worker in supervisor.workers)
+            finally:
+                supervisor.stop()
+
+        with patch("antalla.supervisor.Supervisor.run", run):
+            run_entry_point("run", "--workers", "2", "--exchange", "hitbtc", "--writer-threads", "0")
+        self.assertEqual(len(heartbeats), 2)
+        self.assertTrue(all(heartbeats))
+
+    def test_snapshot_jobs(self):
+        dummy_db.insert_exchanges(self.session)
+        dummy_db.insert_coins(self.session)
+        dummy_db.insert_markets(self.session)
+        dummy_db.insert_exchange_markets(self.session)
+        dummy_db.insert_events_snapshot(self.session)
+        self.session.add(models.Event(
+            session_id="test-001",
+            timestamp=datetime(2019, 5, 1, 1, 11),
+            connection_event="disconnect",
+            data_collected="agg_order_book",
+            buy_sym_id="ETH",
+            sell_sym_id="BTC",
+            exchange_id=1,
+        ))
+        dummy_db.insert_agg_orders_snapshot(self.session)
+        self.session.commit()
+        run_entry_point("snapshot", "--jobs", "2", "--exchange", "hitbtc")
+        timestamps = [row[0] for row in self.session.execute(
+            "select timestamp from order_book_snapshots order by timestamp")]
+        self.assertEqual(timestamps[0], datetime(2019, 5, 1, 1, 1))
+        self.assertEqual(len(timestamps), 10 * 60)
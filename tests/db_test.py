@@ -0,0 +1,31 @@
+import unittest
+
+import sqlalchemy
+
+from antalla import db, settings
+
+
+class DBTest(unittest.TestCase):
+    def test_engine_options(self):
+        url, options = db.engine_options("ingest")
+        self.assertEqual(url, settings.DB_URL)
+        self.assertEqual(options["executemany_mode"], "values")
+        self.assertEqual(options["connect_args"], {"options": "-c statement_timeout=60000"})
+        self.assertNotIn("statement_timeout", options)
+
+    def test_engine_options_without_server_options(self):
+        _url, options = db.engine_options("default")
+        self.assertNotIn("connect_args", options)
+
+    def test_get_engine(self):
+        self.assertIs(db.get_engine("default"), db.engine)
+        self.assertIs(db.get_engine("ingest"), db.get_engine("ingest"))
+
+    def test_analytics_session_is_read_only(self):
+        session = db.AnalyticsSession()
+        try:
+            self.assertEqual(session.execute("select 1").scalar(), 1)
+            with self.assertRaises(sqlalchemy.exc.InternalError):
+                session.execute("insert into coins (symbol) values ('XYZ')")
+        finally:
+            session.close()
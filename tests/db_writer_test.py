@@ -0,0 +1,252 @@
+import asyncio
+import os
+import tempfile
+import time
+import unittest
+from unittest.mock import MagicMock
+
+import sqlalchemy
+from sqlalchemy.dialects import postgresql
+
+from antalla import models
+from antalla.actions import InsertAction, UpdateAction
+
+from antalla.db_writer import ActionExecutor, DBWriter, FlushPolicy, REPLAY_MAX_ATTEMPTS
+from antalla.spool import Spool
+
+
+def create_mock_action():
+    mock_action = MagicMock()
+    mock_action.execute.return_value = 2
+    return mock_action
+
+
+class DBWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.mock_session = MagicMock()
+        self.writer = DBWriter(1, session_factory=lambda: self.mock_session,
+                               flush_policy=FlushPolicy(max_rows=3), max_queue_size=5)
+
+    def test_metrics(self):
+        self.writer.submit([create_mock_action()])
+        self.writer.submit([create_mock_action()])
+        self.writer.submit([])
+        metrics = self.writer.metrics()
+        self.assertEqual(metrics["queue_depth"], 2)
+        self.assertEqual(metrics["max_queue_depth"], 2)
+        self.assertEqual(metrics["submitted"], 2)
+        self.assertEqual(metrics["blocked_submits"], 0)
+
+    def test_submit_does_not_block_event_loop(self):
+        async def submit():
+            self.writer.submit([create_mock_action()])
+            for _ in range(4):
+                self.assertIsNone(self.writer.submit([create_mock_action()]))
+            pending = self.writer.submit([create_mock_action()])
+            self.assertTrue(asyncio.isfuture(pending))
+            await asyncio.sleep(0.01)
+            self.assertFalse(pending.done())
+            self.writer._queue.get_nowait()
+            await pending
+
+        asyncio.get_event_loop().run_until_complete(submit())
+        metrics = self.writer.metrics()
+        self.assertEqual(metrics["submitted"], 6)
+        self.assertEqual(metrics["blocked_submits"], 1)
+        self.assertEqual(metrics["queue_depth"], 5)
+
+    def test_stop_flushes_queue(self):
+        actions = [create_mock_action() for _ in range(3)]
+        for action in actions:
+            self.writer.submit([action])
+        self.writer.start()
+        self.writer.stop()
+        for action in actions:
+            action.execute.assert_called_once_with(self.mock_session)
+        self.assertEqual(self.mock_session.commit.call_count, 2)
+        self.mock_session.close.assert_called_once()
+        metrics = self.writer.metrics()
+        self.assertEqual(metrics["executed"], 3)
+        self.assertEqual(metrics["queue_depth"], 0)
+
+    def test_keep_writing_after_error(self):
+        failing_action = create_mock_action()
+        failing_action.execute.side_effect = TypeError("malformed record")
+        actions = [create_mock_action() for _ in range(3)]
+        self.writer.submit([failing_action])
+        for action in actions:
+            self.writer.submit([action])
+        self.writer.start()
+        self.writer.stop()
+        for action in actions:
+            action.execute.assert_called_once_with(self.mock_session)
+        self.mock_session.rollback.assert_called_once()
+        self.assertEqual(self.mock_session.commit.call_count, 2)
+        metrics = self.writer.metrics()
+        self.assertEqual(metrics["failed"], 1)
+        self.assertEqual(metrics["executed"], 3)
+        self.assertFalse(any(thread.is_alive() for thread in self.writer._threads))
+
+
+class DBWriterSpoolTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.spool = Spool(os.path.join(self.directory.name, "antalla.spool"))
+        self.mock_session = MagicMock()
+        self.writer = DBWriter(1, session_factory=lambda: self.mock_session,
+                               flush_policy=FlushPolicy(max_rows=1), max_queue_size=1,
+                               spool=self.spool, replay_interval=0.01)
+
+    def tearDown(self):
+        self.spool.close()
+        self.directory.cleanup()
+
+    def test_spill_on_full_queue(self):
+        self.writer.submit([InsertAction([models.Coin(symbol="a")])])
+        self.writer.submit([InsertAction([models.Coin(symbol="b")])])
+        self.assertEqual(self.writer.metrics()["spilled"], 1)
+        self.assertEqual(self.writer.metrics()["blocked_submits"], 0)
+        self.assertTrue(self.spool.pending)
+
+    def test_spill_on_db_error(self):
+        self.mock_session.commit.side_effect = sqlalchemy.exc.OperationalError("commit", {}, None)
+        self.writer._execute(ActionExecutor(self.mock_session, FlushPolicy(max_rows=1)),
+                             [InsertAction([models.Coin(symbol="a")])])
+        self.writer._execute(None, [InsertAction([models.Coin(symbol="b")])])
+        metrics = self.writer.metrics()
+        self.assertEqual(metrics["failed"], 1)
+        self.assertEqual(metrics["spilled"], 2)
+        segment = self.spool.rotate()[0]
+        symbols = [batch[0].items[0].symbol for batch in Spool.read(segment)]
+        self.assertEqual(symbols, ["a", "b"])
+
+    def test_rollback_on_data_error(self):
+        self.mock_session.commit.side_effect = sqlalchemy.exc.IntegrityError("insert", {}, None)
+        self.writer._execute(ActionExecutor(self.mock_session, FlushPolicy(max_rows=1)),
+                             [InsertAction([models.Coin(symbol="a")])])
+        metrics = self.writer.metrics()
+        self.assertEqual(metrics["failed"], 1)
+        self.assertEqual(metrics["spilled"], 0)
+        self.assertFalse(self.writer._spilling.is_set())
+        self.assertFalse(self.spool.pending)
+
+    def test_replay_quarantines_failing_batch(self):
+        def execute(statement, *args):
+            if "bad" in statement.compile(dialect=postgresql.dialect()).params.values():
+                raise sqlalchemy.exc.IntegrityError("insert", {}, None)
+        self.mock_session.execute.side_effect = execute
+        for symbol in ["a", "bad", "b"]:
+            self.spool.append([InsertAction([models.Coin(symbol=symbol)])])
+        self.writer._spilling.set()
+        executor = ActionExecutor(self.mock_session)
+        for _ in range(REPLAY_MAX_ATTEMPTS - 1):
+            self.writer._replay_spool(executor)
+            self.assertTrue(self.spool.pending)
+        segment = self.spool.segments()[0]
+        self.writer._replay_spool(executor)
+        self.assertFalse(self.spool.pending)
+        self.assertFalse(self.writer._spilling.is_set())
+        metrics = self.writer.metrics()
+        self.assertEqual(metrics["replayed"], 2)
+        self.assertEqual(metrics["quarantined"], 1)
+        quarantined = list(Spool.read(segment + ".failed"))
+        self.assertEqual([batch[0].items[0].symbol for batch in quarantined], ["bad"])
+
+    def test_replay(self):
+        self.spool.append([InsertAction([models.Coin(symbol="a")])])
+        self.writer._spilling.set()
+        self.writer.start()
+        self.writer.stop()
+        self.assertEqual(self.writer.metrics()["replayed"], 1)
+        self.assertFalse(self.spool.pending)
+        self.assertFalse(self.writer._spilling.is_set())
+        self.mock_session.commit.assert_called()
+
+    def test_replay_keeps_spool_on_db_error(self):
+        self.mock_session.commit.side_effect = sqlalchemy.exc.OperationalError("commit", {}, None)
+        self.spool.append([InsertAction([models.Coin(symbol="a")])])
+        self.writer._spilling.set()
+        self.writer._replay_spool(ActionExecutor(self.mock_session))
+        self.assertTrue(self.spool.pending)
+        self.assertTrue(self.writer._spilling.is_set())
+
+
+class ActionExecutorTest(unittest.TestCase):
+    def setUp(self):
+        self.mock_session = MagicMock()
+
+    def test_flush_on_bytes(self):
+        executor = ActionExecutor(self.mock_session, FlushPolicy(max_rows=None, max_bytes=100))
+        action = InsertAction([models.Coin(symbol="a")])
+        executor.execute([action])
+        self.mock_session.commit.assert_not_called()
+        executor.execute([action])
+        self.mock_session.commit.assert_called_once()
+
+    def test_flush_on_age(self):
+        executor = ActionExecutor(self.mock_session, FlushPolicy(max_rows=100, max_age=0.01))
+        self.assertFalse(executor.flush_if_due())
+        self.assertIsNone(executor.time_until_due())
+        executor.execute([create_mock_action()])
+        self.mock_session.commit.assert_not_called()
+        self.assertLessEqual(executor.time_until_due(), 0.01)
+        time.sleep(0.01)
+        self.assertTrue(executor.flush_if_due())
+        self.mock_session.commit.assert_called_once()
+        self.assertIsNone(executor.pending_age)
+
+    def test_coalesce_inserts(self):
+        executor = ActionExecutor(self.mock_session, FlushPolicy(max_rows=100))
+        executor.execute([InsertAction([models.Coin(symbol="a")])])
+        executor.execute([InsertAction([models.Coin(symbol="b")]),
+                          InsertAction([models.Exchange(id=1, name="foo")])])
+        self.mock_session.execute.assert_not_called()
+        executor.commit()
+        self.assertEqual(self.mock_session.execute.call_count, 2)
+        self.mock_session.commit.assert_called_once()
+
+    def test_flush_does_not_commit(self):
+        executor = ActionExecutor(self.mock_session, FlushPolicy(max_rows=100))
+        executor.execute([InsertAction([models.Coin(symbol="a")])])
+        executor.flush()
+        self.mock_session.execute.assert_called_once()
+        self.mock_session.commit.assert_not_called()
+        executor.commit()
+        self.mock_session.execute.assert_called_once()
+        self.mock_session.commit.assert_called_once()
+
+    def test_update_executes_pending_inserts(self):
+        executor = ActionExecutor(self.mock_session, FlushPolicy(max_rows=100))
+        executor.execute([InsertAction([models.Coin(symbol="a")]),
+                          InsertAction([models.Exchange(id=1, name="foo")])])
+        executor.execute([UpdateAction(models.Coin, {"symbol": "a"}, {"name": "A"}),
+                          UpdateAction(models.Coin, {"symbol": "b"}, {"name": "B"})])
+        self.mock_session.execute.assert_called_once()
+        executor.execute([InsertAction([models.Coin(symbol="c")])])
+        self.assertEqual(self.mock_session.execute.call_count, 2)
+        executor.commit()
+        self.assertEqual(self.mock_session.execute.call_count, 4)
+        self.mock_session.query.assert_not_called()
+
+    def test_inserts_keep_table_order(self):
+        executor = ActionExecutor(self.mock_session, FlushPolicy(max_rows=100))
+        executor.execute([InsertAction([models.Coin(symbol="a")]),
+                          InsertAction([models.Exchange(id=1, name="foo")])])
+        executor.execute([UpdateAction(models.Coin, {"symbol": "a"}, {"name": "A"})])
+        executor.execute([InsertAction([models.Coin(symbol="b")]),
+                          InsertAction([models.Exchange(id=2, name="bar")])])
+        executor.commit()
+        tables = [call[0][0].table for call in self.mock_session.execute.call_args_list
+                  if hasattr(call[0][0], "table")]
+        self.assertEqual(tables, [models.Coin.__table__, models.Coin.__table__,
+                                  models.Exchange.__table__])
+
+    def test_rollback_returns_uncommitted_actions(self):
+        executor = ActionExecutor(self.mock_session, FlushPolicy(max_rows=100))
+        first, second = [InsertAction([models.Coin(symbol="a")])], [create_mock_action()]
+        executor.execute(first)
+        executor.commit()
+        executor.execute(first)
+        executor.execute(second)
+        self.assertEqual(executor.rollback(), [first, second])
+        self.assertEqual(executor.rollback(), [])
@@ -0,0 +1,31 @@
+import glob
+import unittest
+from os import path
+
+from antalla import decoding
+from antalla.decoding import TypeFilter, get_decoder
+
+FIXTURES_PATH = path.join(path.dirname(__file__), "fixtures")
+
+
+class DecodingTest(unittest.TestCase):
+    def test_get_decoder(self):
+        self.assertIn(get_decoder("auto"), decoding.DECODERS.values())
+        with self.assertRaises(ValueError):
+            get_decoder("unknown")
+
+    def test_decoders_agree(self):
+        fixtures = glob.glob(path.join(FIXTURES_PATH, "*", "*.json"))
+        self.assertTrue(fixtures)
+        for fixture in fixtures:
+            with open(fixture, "rb") as f:
+                frame = f.read()
+            expected = get_decoder("json")(frame)
+            for name, decoder in decoding.DECODERS.items():
+                self.assertEqual(decoder(frame), expected, f"{name} on {fixture}")
+
+    def test_type_filter(self):
+        frame_filter = TypeFilter("e", {"depthUpdate"})
+        self.assertTrue(frame_filter.accepts('{"stream": "bnbbtc@depth", "data": {"e": "depthUpdate"}}'))
+        self.assertFalse(frame_filter.accepts('{"data": {"e": "kline", "E": 1}}'))
+        self.assertTrue(frame_filter.accepts('{"result": null, "id": 1}'))
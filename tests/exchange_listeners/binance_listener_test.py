@@ -2,14 +2,17 @@ from datetime import datetime
 from dateutil.parser import parse as parse_date
 from decimal import Decimal
 from os import path
+import asyncio
 import json
 import unittest
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 
 from antalla import db
 from antalla import models
 from antalla import actions
 from antalla.exchange_listeners.binance_listener import BinanceListener
+from antalla.order_book import OrderBook
+from antalla.records import AggOrderBatch
 
 FIXTURES_PATH = path.join(path.dirname(path.dirname(__file__)), "fixtures")
 
@@ -27,10 +30,13 @@ class BinanceListenerTest(unittest.TestCase):
         self.assertEqual(len(parsed_actions), 1)
         insert_action = parsed_actions[0]
         self.assertIsInstance(insert_action, actions.InsertAction)
-        self.assertEqual(len(insert_action.items), 3)
-        order_0 = insert_action.items[0]
-        order_1= insert_action.items[1]
-        order_2 = insert_action.items[2]
+        self.assertEqual(len(insert_action.items), 1)
+        batch = insert_action.items[0]
+        self.assertIsInstance(batch, AggOrderBatch)
+        self.assertEqual(len(batch), 3)
+        order_0 = batch[0]
+        order_1 = batch[1]
+        order_2 = batch[2]
         self.assertEqual(order_0.exchange_id, self.dummy_exchange.id)
         self.assertEqual(order_0.buy_sym_id, "BNB")
         self.assertEqual(order_0.sell_sym_id, "BTC")
@@ -61,9 +67,12 @@ class BinanceListenerTest(unittest.TestCase):
         self.assertEqual(len(parsed_actions), 1)
         insert_action = parsed_actions[0]
         self.assertIsInstance(insert_action, actions.InsertAction)
-        self.assertEqual(len(insert_action.items), 5)
-        order_0 = insert_action.items[0]
-        order_4= insert_action.items[4]
+        self.assertEqual(len(insert_action.items), 1)
+        batch = insert_action.items[0]
+        self.assertIsInstance(batch, AggOrderBatch)
+        self.assertEqual(len(batch), 5)
+        order_0 = batch[0]
+        order_4 = batch[4]
         self.assertEqual(order_0.exchange_id, self.dummy_exchange.id)
         self.assertEqual(order_0.buy_sym_id, "BNB")
         self.assertEqual(order_0.sell_sym_id, "BTC")
@@ -128,6 +137,129 @@ class BinanceListenerTest(unittest.TestCase):
         self.assertEqual(insert_exchange_markets.items[2].quoted_volume_id, "BNB")
         self.assertEqual(insert_exchange_markets.items[2].quoted_volume, 3054635.71000000)
 
+    def test_depth_updates_applied_to_book(self):
+        self.binance_listener.order_books["BNBBTC"] = OrderBook("BNBBTC")
+        self.binance_listener._request_resync = MagicMock()
+        update = json.loads(self.raw_fixture("binance/binance-depth-update.json"))
+        self.assertEqual(self.binance_listener._parse_depthUpdate(update), [])
+        self.binance_listener._request_resync.assert_called_once_with("BNBBTC")
+
+        snapshot = dict(lastUpdateId=156, bids=[["0.0024", "1"]], asks=[["0.0025", "3"]])
+        parsed_actions = self.binance_listener._parse_snapshot(snapshot, "BNBBTC")
+        snapshot_batch, update_batch = parsed_actions[0].items
+        self.assertEqual(snapshot_batch.last_update_id, 156)
+        self.assertEqual(update_batch.last_update_id, 161)
+        self.assertLess(snapshot_batch.timestamp, update_batch.timestamp)
+        book = self.binance_listener.order_books["BNBBTC"]
+        self.assertEqual(book.best_bid(), (0.0038, 8.0))
+        self.assertEqual(book.best_ask(), (0.0025, 3.0))
+
+        next_update = dict(update, U=162, u=163, b=[["0.0038", "0"]], a=[])
+        parsed_actions = self.binance_listener._parse_depthUpdate(next_update)
+        self.assertEqual(len(parsed_actions[0].items[0]), 1)
+        self.assertEqual(book.best_bid(), (0.0024, 10.0))
+
+    def test_depth_update_gap_resyncs_market(self):
+        self.binance_listener._request_resync = MagicMock()
+        for market in ["BNBBTC", "ETHBTC"]:
+            self.binance_listener.order_books[market] = OrderBook(market)
+            self.binance_listener._parse_snapshot(dict(lastUpdateId=150, bids=[], asks=[]), market)
+        update = json.loads(self.raw_fixture("binance/binance-depth-update.json"))
+        self.assertEqual(self.binance_listener._parse_depthUpdate(update), [])
+        self.binance_listener._request_resync.assert_called_once_with("BNBBTC")
+        self.assertFalse(self.binance_listener.order_books["BNBBTC"].synced)
+        self.assertTrue(self.binance_listener.order_books["ETHBTC"].synced)
+
+    def test_resync(self):
+        self.binance_listener.order_books["BNBBTC"] = OrderBook("BNBBTC")
+        snapshot = json.loads(self.raw_fixture("binance/binance-snapshot.json"))
+
+        async def fetch(session, uri):
+            self.assertIn("symbol=BNBBTC", uri)
+            return snapshot
+
+        async def resync():
+            self.binance_listener._request_resync("BNBBTC")
+            self.binance_listener._request_resync("BNBBTC")
+            await asyncio.sleep(0.01)
+
+        self.binance_listener._fetch = fetch
+        with patch("antalla.exchange_listeners.binance_listener.SNAPSHOT_REQUEST_INTERVAL", 0):
+            asyncio.get_event_loop().run_until_complete(resync())
+        self.on_event_mock.assert_called_once()
+        self.assertEqual(self.binance_listener.order_books["BNBBTC"].last_update_id, 1027024)
+        self.assertEqual(self.binance_listener._resyncing, set())
+
+    def test_resync_error_payload(self):
+        self.binance_listener.order_books["BNBBTC"] = OrderBook("BNBBTC")
+
+        async def fetch(session, uri):
+            return {"code": -1003, "msg": "Too many requests"}
+
+        self.binance_listener._fetch = fetch
+        self.binance_listener._resyncing.add("BNBBTC")
+        with patch("antalla.exchange_listeners.binance_listener.SNAPSHOT_REQUEST_INTERVAL", 0):
+            with self.assertLogs(level="ERROR"):
+                asyncio.get_event_loop().run_until_complete(self.binance_listener._resync("BNBBTC"))
+        self.on_event_mock.assert_not_called()
+        self.assertFalse(self.binance_listener.order_books["BNBBTC"].synced)
+        self.assertEqual(self.binance_listener._resyncing, set())
+
+        async def fetch_snapshot(session, uri):
+            return dict(lastUpdateId=156, bids=[["0.0024", "1"]], asks=[])
+
+        self.binance_listener._fetch = fetch_snapshot
+        self.on_event_mock.side_effect = RuntimeError("writer stopped")
+        with patch("antalla.exchange_listeners.binance_listener.SNAPSHOT_REQUEST_INTERVAL", 0):
+            with self.assertLogs(level="ERROR"):
+                asyncio.get_event_loop().run_until_complete(self.binance_listener._resync("BNBBTC"))
+        self.assertFalse(self.binance_listener.order_books["BNBBTC"].synced)
+
+    def test_shards(self):
+        self.binance_listener.markets = ["ETH_BTC", "LTC_BTC", "BNB_BTC"]
+        self.binance_listener.max_streams_per_connection = 4
+        shards = self.binance_listener._get_shards()
+        self.assertEqual(list(shards.values()), [
+            [("ETH_BTC", "depth"), ("ETH_BTC", "trade"), ("LTC_BTC", "depth"), ("LTC_BTC", "trade")],
+            [("BNB_BTC", "depth"), ("BNB_BTC", "trade")],
+        ])
+        self.assertTrue(list(shards)[0].endswith("ethbtc@depth/ethbtc@trade/ltcbtc@depth/ltcbtc@trade"))
+
+        self.binance_listener.max_streams_per_connection = 3
+        shards = self.binance_listener._get_shards()
+        self.assertEqual([[pair for pair, _stream in shard] for shard in shards.values()],
+                         [["ETH_BTC", "ETH_BTC"], ["LTC_BTC", "LTC_BTC"], ["BNB_BTC", "BNB_BTC"]])
+
+        self.binance_listener.connections = 10
+        shards = self.binance_listener._get_shards()
+        self.assertEqual(len(shards), 3)
+        self.binance_listener.markets = []
+        self.assertEqual(self.binance_listener._get_shards(), {})
+
+    def test_shards_split_market(self):
+        self.binance_listener.markets = ["ETH_BTC", "BNB_BTC"]
+        self.binance_listener.max_streams_per_connection = 1
+        shards = self.binance_listener._get_shards()
+        self.assertEqual(list(shards.values()), [
+            [("ETH_BTC", "depth")], [("ETH_BTC", "trade")],
+            [("BNB_BTC", "depth")], [("BNB_BTC", "trade")],
+        ])
+
+    def test_reconnect_resets_books_of_shard(self):
+        self.binance_listener.markets = ["ETH_BTC", "BNB_BTC"]
+        self.binance_listener.connections = 2
+        self.binance_listener._shards = self.binance_listener._get_shards()
+        self.binance_listener._all_symbols = {"ETH", "BNB", "BTC"}
+        for market in ["ETHBTC", "BNBBTC"]:
+            self.binance_listener.order_books[market] = OrderBook(market)
+            self.binance_listener._parse_snapshot(dict(lastUpdateId=150, bids=[], asks=[]), market)
+        ws_url = self.binance_listener._get_ws_urls()[1]
+        with patch("antalla.websocket_listener.WebsocketListener._listen") as listen:
+            asyncio.get_event_loop().run_until_complete(self.binance_listener._listen(ws_url))
+        listen.assert_called_once_with(ws_url)
+        self.assertFalse(self.binance_listener.order_books["BNBBTC"].synced)
+        self.assertTrue(self.binance_listener.order_books["ETHBTC"].synced)
+
     def assertAreAllActions(self, items):
         for item in items:
             self.assertIsInstance(item, actions.Action)
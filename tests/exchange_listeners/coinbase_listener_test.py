@@ -13,6 +13,7 @@ from antalla import models
 from antalla import actions
 from antalla import db
 from antalla.exchange_listeners.coinbase_listener import CoinbaseListener
+from antalla.records import AggOrderBatch
 
 FIXTURES_PATH = path.join(path.dirname(path.dirname(__file__)), "fixtures")
 
@@ -248,15 +249,18 @@ class CoinbaseListenerTest(TransactionalTestCase):
         self.assertEqual(len(parsed_actions), 1)
         insert_action = parsed_actions[0]
         self.assertIsInstance(insert_action, actions.InsertAction)
-        self.assertEqual(len(insert_action.items), 6)
-        agg_order = insert_action.items[0]
+        self.assertEqual(len(insert_action.items), 1)
+        batch = insert_action.items[0]
+        self.assertIsInstance(batch, AggOrderBatch)
+        self.assertEqual(len(batch), 6)
+        agg_order = batch[0]
         self.assertEqual(agg_order.exchange_id, self.dummy_exchange.id)
         self.assertEqual(agg_order.order_type, "bid")
         self.assertEqual(agg_order.buy_sym_id, "BTC")
         self.assertEqual(agg_order.sell_sym_id, "EUR")
         self.assertEqual(agg_order.price, 0.5)
         self.assertEqual(agg_order.size, 10.0)
-        agg_order = insert_action.items[3]
+        agg_order = batch[3]
         self.assertEqual(agg_order.exchange_id, self.dummy_exchange.id)
         self.assertEqual(agg_order.order_type, "ask")
         self.assertEqual(agg_order.buy_sym_id, "BTC")
@@ -271,8 +275,11 @@ class CoinbaseListenerTest(TransactionalTestCase):
         self.assertEqual(len(parsed_actions), 1)
         insert_action = parsed_actions[0]
         self.assertIsInstance(insert_action, actions.InsertAction)
-        self.assertEqual(len(insert_action.items), 4)
-        agg_order = insert_action.items[0]
+        self.assertEqual(len(insert_action.items), 1)
+        batch = insert_action.items[0]
+        self.assertIsInstance(batch, AggOrderBatch)
+        self.assertEqual(len(batch), 4)
+        agg_order = batch[0]
         self.assertEqual(agg_order.exchange_id, self.dummy_exchange.id)
         self.assertEqual(agg_order.order_type, "bid")
         self.assertEqual(agg_order.buy_sym_id, "BTC")
@@ -280,7 +287,7 @@ class CoinbaseListenerTest(TransactionalTestCase):
         self.assertEqual(agg_order.price, 0.75)
         self.assertEqual(agg_order.size, 6.0)
         self.assertEqual(agg_order.last_update_id, 0)
-        agg_order = insert_action.items[3]
+        agg_order = batch[3]
         self.assertEqual(agg_order.exchange_id, self.dummy_exchange.id)
         self.assertEqual(agg_order.order_type, "ask")
         self.assertEqual(agg_order.buy_sym_id, "BTC")
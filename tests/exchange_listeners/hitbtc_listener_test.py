@@ -9,6 +9,7 @@ from unittest.mock import MagicMock
 
 from antalla import models
 from antalla import actions
+from antalla.records import AggOrderRecord, TradeRecord
 from antalla.exchange_listeners.hitbtc_listener import HitBTCListener
 
 FIXTURES_PATH = path.join(path.dirname(path.dirname(__file__)), "fixtures")
@@ -97,7 +98,7 @@ class HitBTCListenerTest(unittest.TestCase):
         insert_action = parsed_actions[0]
         self.assertIsInstance(insert_action, actions.InsertAction)
         self.assertEqual(len(insert_action.items), 6)
-        self.assertIsInstance(insert_action.items[0], models.AggOrder)
+        self.assertIsInstance(insert_action.items[0], AggOrderRecord)
         self.assertEqual(insert_action.items[0].exchange_id, self.dummy_exchange.id)
         self.assertEqual(insert_action.items[0].buy_sym_id, "ETH")
         self.assertEqual(insert_action.items[0].sell_sym_id, "BTC")
@@ -124,7 +125,7 @@ class HitBTCListenerTest(unittest.TestCase):
         insert_action = parsed_actions[0]
         self.assertIsInstance(insert_action, actions.InsertAction)
         self.assertEqual(len(insert_action.items), 1)
-        self.assertIsInstance(insert_action.items[0], models.Trade)
+        self.assertIsInstance(insert_action.items[0], TradeRecord)
         self.assertEqual(insert_action.items[0].exchange_id, self.dummy_exchange.id)
         self.assertEqual(insert_action.items[0].buy_sym_id, "ETH")
         self.assertEqual(insert_action.items[0].sell_sym_id, "BTC")
@@ -144,7 +145,7 @@ class HitBTCListenerTest(unittest.TestCase):
         insert_action = parsed_actions[0]
         self.assertIsInstance(insert_action, actions.InsertAction)
         self.assertEqual(len(insert_action.items), 3)
-        self.assertIsInstance(insert_action.items[0], models.AggOrder)
+        self.assertIsInstance(insert_action.items[0], AggOrderRecord)
         self.assertEqual(insert_action.items[0].exchange_id, self.dummy_exchange.id)
         self.assertEqual(insert_action.items[0].buy_sym_id, "ETH")
         self.assertEqual(insert_action.items[0].sell_sym_id, "BTC")
@@ -12,6 +12,7 @@ from tests.support import TransactionalTestCase
 
 from antalla import models
 from antalla import actions
+from antalla.records import TradeRecord
 from antalla.exchange_listeners.idex_listener import IdexListener
 
 
@@ -104,7 +105,7 @@ class IdexListenerTest(TransactionalTestCase):
         insert_action: actions.InsertAction = parsed_actions[0]
         self.assertIsInstance(insert_action, actions.InsertAction)
         self.assertEqual(len(insert_action.items), 1)
-        self.assertIsInstance(insert_action.items[0], models.Trade)
+        self.assertIsInstance(insert_action.items[0], TradeRecord)
         self.assertEqual(insert_action.items[0].exchange_order_id, payload["trades"][0]["orderHash"])
 
         update_action: actions.UpdateAction = parsed_actions[1]
@@ -0,0 +1,77 @@
+from datetime import datetime
+import unittest
+
+from antalla import models
+from antalla.actions import InsertAction
+from antalla.live_snapshots import LiveSnapshots
+from antalla.records import AggOrderBatch, AggOrderRecord
+
+
+def create_batch(bids, asks, last_update_id, exchange_id=1):
+    return AggOrderBatch.from_levels(bids, asks, last_update_id=last_update_id, exchange_id=exchange_id,
+                                     buy_sym_id="ETH", sell_sym_id="BTC")
+
+
+class LiveSnapshotsTest(unittest.TestCase):
+    def setUp(self):
+        self.live_snapshots = LiveSnapshots(interval=1)
+        self.live_snapshots.observe([InsertAction([create_batch(
+            [["1.0", "1"], ["2.0", "2"], ["3.0", "3"], ["4.0", "4"]],
+            [["5.0", "1"], ["6.0", "2"], ["7.0", "3"], ["8.0", "4"]],
+            10)])])
+
+    def test_take_snapshots(self):
+        timestamp = datetime(2020, 1, 1, 12)
+        snapshots = self.live_snapshots.take_snapshots(timestamp)
+        self.assertEqual(len(snapshots), 1)
+        snapshot = snapshots[0]
+        self.assertIsInstance(snapshot, models.OrderBookSnapshot)
+        self.assertEqual((snapshot.exchange_id, snapshot.buy_sym_id, snapshot.sell_sym_id),
+                         (1, "ETH", "BTC"))
+        self.assertEqual(snapshot.timestamp, timestamp)
+        self.assertEqual(snapshot.snapshot_type, "quartile")
+        self.assertEqual((snapshot.bids_count, snapshot.asks_count), (2, 1))
+        self.assertEqual((snapshot.max_bid_price, snapshot.max_bid_size), (4.0, 4.0))
+        self.assertEqual((snapshot.min_ask_price, snapshot.min_ask_size), (5.0, 1.0))
+        self.assertEqual(snapshot.spread, 1.0)
+        self.assertEqual(snapshot.bids_volume, 3.0 * 3.0 + 4.0 * 4.0)
+
+    def test_observe(self):
+        order = AggOrderRecord(exchange_id=1, buy_sym_id="ETH", sell_sym_id="BTC",
+                               order_type="ask", price=5.0, size=0.0, last_update_id=11)
+        stale = create_batch([["4.0", "0"]], [], 9)
+        no_update_id = create_batch([["3.0", "0"]], [], None)
+        trade = models.Trade(exchange_trade_id="1")
+        self.live_snapshots.observe([InsertAction([order]), InsertAction([stale, no_update_id]),
+                                     InsertAction([trade])])
+        snapshot = self.live_snapshots.take_snapshots(datetime(2020, 1, 1))[0]
+        self.assertEqual(snapshot.max_bid_price, 4.0)
+        self.assertEqual(snapshot.min_ask_price, 6.0)
+
+    def test_one_sided_book(self):
+        self.live_snapshots.observe([InsertAction([create_batch([["1.0", "1"]], [], 1, exchange_id=2)])])
+        snapshots = self.live_snapshots.take_snapshots(datetime(2020, 1, 1))
+        self.assertEqual([snapshot.exchange_id for snapshot in snapshots], [1])
+
+    def test_mid_price_range(self):
+        live_snapshots = LiveSnapshots(interval=1, mid_price_range=50)
+        live_snapshots.observe([InsertAction([create_batch(
+            [["1.0", "1"], ["4.0", "4"]], [["5.0", "1"], ["8.0", "4"]], 10)])])
+        snapshot = live_snapshots.take_snapshots(datetime(2020, 1, 1))[0]
+        self.assertEqual(snapshot.snapshot_type, "mid_price_range")
+        self.assertEqual(snapshot.mid_price_range, 50)
+
+    def test_disconnect_resets_book(self):
+        connect = models.Event(exchange_id=1, buy_sym_id="BTC", sell_sym_id="ETH",
+                               connection_event="connect")
+        self.live_snapshots.on_connection_event(connect)
+        self.assertEqual(len(self.live_snapshots.take_snapshots(datetime(2020, 1, 1))), 1)
+        disconnect = models.Event(exchange_id=1, buy_sym_id="BTC", sell_sym_id="ETH",
+                                  connection_event="disconnect")
+        self.live_snapshots.on_connection_event(disconnect)
+        self.assertEqual(self.live_snapshots.take_snapshots(datetime(2020, 1, 1)), [])
+
+    def test_next_snapshot_time(self):
+        live_snapshots = LiveSnapshots(interval=5)
+        self.assertEqual(live_snapshots.next_snapshot_time(12.5), 15)
+        self.assertEqual(live_snapshots.next_snapshot_time(15), 20)
@@ -31,4 +31,20 @@ class ModelsTest(unittest.TestCase):
         trade = models.Trade(exchange_trade_id=1)
         self.assertEqual(str(trade), "Trade(id=1)")
 
-    #def test_agg_order_repr(self):
\ No newline at end of file
+    def test_agg_order_repr(self):
+        agg_order = models.AggOrder(id=1, buy_sym_id="ETH", sell_sym_id="BTC")
+        self.assertEqual(str(agg_order), "AggOrder(id=1)")
+
+    def test_order_book_checkpoint_repr(self):
+        checkpoint = models.OrderBookCheckpoint(exchange_id=1, buy_sym_id="ETH", sell_sym_id="BTC",
+                                                timestamp=datetime(2019, 5, 1, 1, 2))
+        expected = "OrderBookCheckpoint(exchange_id=1, buy_sym_id='ETH', sell_sym_id='BTC', " \
+            "timestamp='2019-05-01 01:02:00')"
+        self.assertEqual(str(checkpoint), expected)
+
+    def test_agg_order_insert_columns(self):
+        columns = models.AggOrder.insert_columns()
+        self.assertNotIn("id", columns)
+        self.assertIn("price", columns)
+        self.assertEqual(models.Trade.insert_columns(),
+                         [column.name for column in models.Trade.__table__.columns])
@@ -1,5 +1,8 @@
 import unittest
-from datetime import datetime
+from datetime import datetime, timedelta
+import random
+from multiprocessing import dummy
+from unittest.mock import MagicMock, patch
 
 from antalla import db
 from antalla import models
@@ -184,22 +187,19 @@ class ModelsTest(unittest.TestCase):
         )[0]
         self.assertEqual(created_snapshots[0], 109)
 
-    def test_query_order_book(self):
+    def test_order_book_levels(self):
         self._insert_data()
         generator = ob_snapshot_generator.OBSnapshotGenerator(
             "hitbtc", datetime.now(), 1, session=self.session
         )
-        ob_result_proxy = generator._query_order_book(
-            "hitbtc", "ETH", "BTC", "2019-05-15 19:30:0.0", "2019-05-15 19:35:45.0"
-        )
-        full_order_book = generator._parse_order_book(ob_result_proxy)
-        self.assertEqual(len(full_order_book), 6)
-        bids = 0
-        asks = 0
-        bids = list(filter(lambda x: x["order_type"] == "bid", full_order_book))
-        asks = list(filter(lambda x: x["order_type"] == "ask", full_order_book))
-        bid_prices = list(map(lambda x: x["price"], bids))
-        ask_prices = list(map(lambda x: x["price"], asks))
+        market = dict(exchange_id=1, buy_sym_id="ETH", sell_sym_id="BTC")
+        replay = ob_snapshot_generator.OrderBookReplay(
+            generator._stream_agg_orders(market, datetime(2019, 5, 15, 19, 30, 0, 0))
+        )
+        replay.advance(datetime(2019, 5, 15, 19, 35, 45, 0))
+        bids, asks = generator._get_order_book_levels(replay)
+        bid_prices = [price for price, _size in bids]
+        ask_prices = [price for price, _size in asks]
         self.assertEqual(len(bids), 3)
         self.assertEqual(len(asks), 3)
         self.assertAlmostEqual(min(bid_prices), 0.3)
@@ -279,6 +279,32 @@ class ModelsTest(unittest.TestCase):
         self.assertEqual(output["bid_price_median"], 0.775)
         self.assertEqual(output["ask_price_median"], 1.05)
 
+    def test_compute_stats_batch(self):
+        books = [
+            ([(0.5, 10), (0.75, 30), (0.8, 5), (0.95, 7)], [(1.1, 5), (1.08, 4), (1.02, 7), (0.97, 3)]),
+            ([(2.0, 1), (2.0, 3), (1.5, 2)], [(2.5, 1), (2.5, 4)]),
+            ([(3.0, 1)], [(3.1, 2), (3.3, 1), (3.2, 5)]),
+        ]
+        generator = ob_snapshot_generator.OBSnapshotGenerator("hitbtc", 0)
+        stats = ob_snapshot_generator.compute_stats_batch(
+            [price for bids, _ in books for price, _ in bids],
+            [size for bids, _ in books for _, size in bids],
+            [len(bids) for bids, _ in books],
+            [price for _, asks in books for price, _ in asks],
+            [size for _, asks in books for _, size in asks],
+            [len(asks) for _, asks in books],
+        )
+        for i, (bids, asks) in enumerate(books):
+            order_book = [dict(order_type="bid", price=price, size=size) for price, size in bids] + \
+                [dict(order_type="ask", price=price, size=size) for price, size in asks]
+            expected = generator._compute_stats(order_book)
+            for key, value in expected.items():
+                self.assertAlmostEqual(stats[key][i], value)
+        self.assertEqual(stats["max_bid_size"][1], 3)
+        self.assertEqual(stats["min_ask_size"][1], 4)
+        with self.assertRaises(ValueError):
+            ob_snapshot_generator.compute_stats_batch([1.0], [1.0], [1, 0], [2.0], [1.0], [1, 0])
+
     def test_run_mid_price(self):
         """testing the computation of order book snapshots using a mid price range approach"""
         dummy_db.insert_agg_orders_snapshot(self.session)
@@ -442,7 +468,7 @@ class ModelsTest(unittest.TestCase):
                        asks_price_stddev, bids_price_mean, asks_price_mean
                 from {models.OrderBookSnapshot.__tablename__} snap
                 inner join {models.Exchange.__tablename__} ex on snap.exchange_id = ex.id where ex.name = 'hitbtc'
-                order by timestamp asc"""
+                order by timestamp asc, mid_price_range asc"""
         )
         results = list(all_snapshots)
         # ten snapshots have been generated - mid price range is changed to +-20%
@@ -524,6 +550,209 @@ class ModelsTest(unittest.TestCase):
         self.assertAlmostEqual(results[9][8], 4.35)
         self.assertAlmostEqual(results[9][9], 4.65)
 
+    def test_run_parallel(self):
+        dummy_db.insert_agg_orders_snapshot(self.session)
+        dummy_db.insert_coins(self.session)
+        dummy_db.insert_events_snapshot(self.session)
+        dummy_db.insert_exchange_markets(self.session)
+        dummy_db.insert_exchanges(self.session)
+        dummy_db.insert_markets(self.session)
+        self.session.flush()
+        generator = ob_snapshot_generator.OBSnapshotGenerator(
+            "hitbtc", datetime(2019, 5, 1, 1, 11, 0, 0), 0, 60, session=self.session, commit_interval=4
+        )
+
+        def init_worker(options):
+            ob_snapshot_generator._worker_generator = ob_snapshot_generator.OBSnapshotGenerator(
+                session=self.session, **options
+            )
+
+        with patch("antalla.ob_snapshot_generator._init_worker", init_worker):
+            generator.run_parallel(1, context=dummy)
+        count = list(self.session.execute(
+            f"select count(*) from {models.OrderBookSnapshot.__tablename__}"
+        ))[0][0]
+        self.assertEqual(count, 10)
+        self.assertEqual(generator.snapshot_counter, 10)
+        self.assertEqual(generator.commit_counter, 3)
+
+    def test_resume_from_checkpoint(self):
+        dummy_db.insert_agg_orders_snapshot(self.session)
+        dummy_db.insert_coins(self.session)
+        dummy_db.insert_events_snapshot(self.session)
+        dummy_db.insert_exchange_markets(self.session)
+        dummy_db.insert_exchanges(self.session)
+        dummy_db.insert_markets(self.session)
+        self.session.flush()
+        generator = ob_snapshot_generator.OBSnapshotGenerator(
+            "hitbtc", datetime(2019, 5, 1, 1, 6, 0, 0), 0, 60, session=self.session, checkpoint_interval=120
+        )
+        generator.run()
+        checkpoints = self.session.query(models.OrderBookCheckpoint) \
+            .order_by(models.OrderBookCheckpoint.timestamp).all()
+        self.assertEqual([checkpoint.timestamp for checkpoint in checkpoints],
+                         [datetime(2019, 5, 1, 1, 2), datetime(2019, 5, 1, 1, 4)])
+        self.assertEqual(len(checkpoints[-1].prices), len(checkpoints[-1].last_update_ids))
+
+        generator = ob_snapshot_generator.OBSnapshotGenerator(
+            "hitbtc", datetime(2019, 5, 1, 1, 11, 0, 0), 0, 60, session=self.session, checkpoint_interval=120
+        )
+        generator._stream_agg_orders = MagicMock(side_effect=generator._stream_agg_orders)
+        generator.run()
+        generator._stream_agg_orders.assert_called_once_with(
+            dict(exchange_id=1, buy_sym_id="ETH", sell_sym_id="BTC", exchange="hitbtc"),
+            datetime(2019, 5, 1, 1, 4), start_id=ob_snapshot_generator.MAX_ORDER_ID,
+        )
+        results = list(self.session.execute(
+            f"""select timestamp, spread, bids_count, asks_count, bids_volume, asks_volume
+            from {models.OrderBookSnapshot.__tablename__} order by timestamp asc"""
+        ))
+        self.assertEqual(len(results), 10)
+        self.assertAlmostEqual(results[9][1], 0.2)
+        self.assertEqual(results[9][2], 2)
+        self.assertEqual(results[9][3], 2)
+        self.assertAlmostEqual(results[9][4], 87.2)
+        self.assertAlmostEqual(results[9][5], 195.4)
+
+    def test_sql_backend_matches_replay(self):
+        dummy_db.insert_agg_orders_snapshot(self.session)
+        dummy_db.insert_coins(self.session)
+        dummy_db.insert_events_snapshot(self.session)
+        dummy_db.insert_exchange_markets(self.session)
+        dummy_db.insert_exchanges(self.session)
+        dummy_db.insert_markets(self.session)
+        self.session.flush()
+        for mid_price_range in [0, 0.1, 0.2]:
+            snapshots = {}
+            for backend in ob_snapshot_generator.BACKENDS:
+                generator = ob_snapshot_generator.OBSnapshotGenerator(
+                    "hitbtc", datetime(2019, 5, 1, 1, 11, 0, 0), mid_price_range, 60,
+                    session=self.session, backend=backend
+                )
+                with patch("antalla.ob_snapshot_generator.SQL_WINDOW_SECONDS", 240):
+                    generator.run()
+                snapshots[backend] = self.select_snapshots()
+            self.assertEqual(len(snapshots["replay"]), 10)
+            self.assertSnapshotsAlmostEqual(snapshots["sql"], snapshots["replay"])
+
+    def test_sql_backend_with_orders_before_window(self):
+        dummy_db.insert_coins(self.session)
+        dummy_db.insert_events_snapshot(self.session)
+        dummy_db.insert_exchange_markets(self.session)
+        dummy_db.insert_exchanges(self.session)
+        dummy_db.insert_markets(self.session)
+        rng = random.Random(42)
+        start_time = datetime(2019, 5, 1, 1, 0, 0, 0)
+        for i in range(2000):
+            order_type = rng.choice(["bid", "ask"])
+            price = rng.randrange(1, 20) / 10 + (0 if order_type == "bid" else 2)
+            self.session.add(models.AggOrder(
+                # some updates are received out of order and are stale
+                last_update_id=i - rng.choice([0, 0, 0, 5]),
+                timestamp=start_time + timedelta(seconds=i * 3.6),
+                buy_sym_id="ETH",
+                sell_sym_id="BTC",
+                exchange_id=1,
+                order_type=order_type,
+                price=price,
+                size=rng.choice([0, 1, 2, 5]),
+            ))
+        self.session.flush()
+        for mid_price_range in [0, 0.2]:
+            snapshots = {}
+            for backend in ob_snapshot_generator.BACKENDS:
+                generator = ob_snapshot_generator.OBSnapshotGenerator(
+                    "hitbtc", datetime(2019, 5, 1, 3, 0, 0, 0), mid_price_range, 10,
+                    session=self.session, backend=backend
+                )
+                with patch("antalla.ob_snapshot_generator.SQL_WINDOW_SECONDS", 600):
+                    generator.run()
+                snapshots[backend] = self.select_snapshots()
+            self.assertGreater(len(snapshots["replay"]), 700)
+            self.assertSnapshotsAlmostEqual(snapshots["sql"], snapshots["replay"])
+
+    def test_sql_backend_carries_state_between_windows(self):
+        dummy_db.insert_agg_orders_snapshot(self.session)
+        dummy_db.insert_coins(self.session)
+        dummy_db.insert_events_snapshot(self.session)
+        dummy_db.insert_exchange_markets(self.session)
+        dummy_db.insert_exchanges(self.session)
+        dummy_db.insert_markets(self.session)
+        self.session.flush()
+        generator = ob_snapshot_generator.OBSnapshotGenerator(
+            "hitbtc", datetime(2019, 5, 1, 1, 10, 0, 0), 0, 10,
+            session=self.session, backend="replay"
+        )
+        generator.run()
+        expected = self.select_snapshots()
+        self.session.execute("delete from order_book_snapshots")
+        self.session.execute("delete from order_book_checkpoints")
+        generator = ob_snapshot_generator.OBSnapshotGenerator(
+            "hitbtc", datetime(2019, 5, 1, 1, 10, 0, 0), 0, 10,
+            session=self.session, backend="sql"
+        )
+        query_window = generator._query_order_book_window
+        states = []
+
+        def query_carried_window(market, start_time, first_time, end_time, state=None):
+            # the orders before a window are not read again once its state is known
+            states.append(state)
+            if state is not None:
+                self.session.execute(
+                    "delete from aggregate_orders where timestamp < :first_time",
+                    dict(first_time=first_time)
+                )
+            return query_window(market, start_time, first_time, end_time, state)
+
+        generator._query_order_book_window = query_carried_window
+        with patch("antalla.ob_snapshot_generator.SQL_WINDOW_SECONDS", 60):
+            generator.run()
+        self.assertIsNone(states[0])
+        self.assertGreater(len(states), 5)
+        self.assertTrue(all(state is not None for state in states[1:]))
+        self.assertSnapshotsAlmostEqual(self.select_snapshots(), expected)
+
+    def test_sql_backend_connection_windows(self):
+        dummy_db.insert_agg_order(self.session)
+        dummy_db.insert_coins(self.session)
+        dummy_db.insert_instable_connection_events(self.session)
+        dummy_db.insert_exchange_markets(self.session)
+        dummy_db.insert_exchanges(self.session)
+        dummy_db.insert_markets(self.session)
+        self.session.flush()
+        snapshots = {}
+        for backend in ob_snapshot_generator.BACKENDS:
+            generator = ob_snapshot_generator.OBSnapshotGenerator(
+                "hitbtc", datetime(2019, 5, 15, 19, 32, 41, 0), session=self.session, backend=backend
+            )
+            generator._parse_connection_events(generator._query_connection_events())
+            market = dict(exchange_id=1, buy_sym_id="ETH", sell_sym_id="BTC")
+            snapshot_time = datetime(2019, 5, 15, 19, 30, 45, 0)
+            connect_time, disconnect_time = generator._get_connection_window(snapshot_time, "hitbtcETHBTC")
+            generator._generate_all_snapshots(connect_time, disconnect_time, snapshot_time, market, "hitbtc")
+            snapshots[backend] = self.select_snapshots()
+        self.assertEqual(len(snapshots["replay"]), 109)
+        self.assertSnapshotsAlmostEqual(snapshots["sql"], snapshots["replay"])
+
+    def assertSnapshotsAlmostEqual(self, first, second):
+        self.assertEqual(len(first), len(second))
+        for first_snapshot, second_snapshot in zip(first, second):
+            for first_value, second_value in zip(first_snapshot, second_snapshot):
+                if isinstance(first_value, float):
+                    self.assertAlmostEqual(first_value, second_value)
+                else:
+                    self.assertEqual(first_value, second_value)
+
+    def select_snapshots(self):
+        """returns and deletes the generated snapshots"""
+        snapshots = list(self.session.execute(
+            f"""select * from {models.OrderBookSnapshot.__tablename__}
+            order by timestamp, mid_price_range"""
+        ))
+        self.session.execute(f"delete from {models.OrderBookSnapshot.__tablename__}")
+        self.session.execute(f"delete from {models.OrderBookCheckpoint.__tablename__}")
+        return snapshots
+
     def parse_snapshot(self, snapshot):
         all_snapshots = []
         for s in snapshot:
@@ -1,11 +1,20 @@
 import asyncio
+from datetime import datetime
+import os
+import tempfile
 import unittest
 from unittest.mock import MagicMock
 
+import sqlalchemy
+
 
 from antalla.orchestrator import Orchestrator
 from antalla.exchange_listener import ExchangeListener
+from antalla.actions import InsertAction
+from antalla.capture import read_capture
+from antalla.websocket_listener import WebsocketListener
 from antalla import models
+from antalla.records import AggOrderBatch
 
 
 def create_mock_action():
@@ -28,6 +37,17 @@ class DummyListener(ExchangeListener):
         self.mock_stop()
 
 
+@ExchangeListener.register("dummy-websocket")
+class DummyWebsocketListener(WebsocketListener):
+    def __init__(self, exchange, on_event, event_type=None):
+        super().__init__(exchange, on_event, ["ETH_BTC"], "wss://example.com", event_type=event_type)
+
+    def _get_existing_markets(self, markets):
+        return markets
+
+    def _parse_message(self, message):
+        return [message["action"]]
+
 
 class OrchestratorTest(unittest.TestCase):
     def setUp(self):
@@ -56,6 +76,98 @@ class OrchestratorTest(unittest.TestCase):
         self.orchestrator._on_event([create_mock_action()])
         self.mock_session.commit.assert_called_once()
 
+    def test_db_error_discards_pending_actions(self):
+        self.assertEqual(self.dummy_listener.on_db_error, self.orchestrator._on_db_error)
+        self.orchestrator._on_event([InsertAction([models.Trade(exchange_trade_id="1")])])
+        self.assertTrue(self.orchestrator.executor._pending_inserts)
+        self.dummy_listener.on_db_error(Exception("commit failed"))
+        self.mock_session.rollback.assert_called_once()
+        self.assertEqual(self.orchestrator.executor._pending_inserts, {})
+        self.assertEqual(self.orchestrator.executor._uncommitted, [])
+        self.orchestrator.executor.commit()
+        self.mock_session.execute.assert_not_called()
+
+    def test_flush_periodically_after_error(self):
+        orchestrator = Orchestrator(["dummy"], session=self.mock_session, commit_max_age=0.01)
+        self.mock_session.commit.side_effect = [sqlalchemy.exc.OperationalError("commit", {}, None), None]
+
+        async def flush():
+            task = asyncio.ensure_future(orchestrator._flush_periodically())
+            for _ in range(2):
+                orchestrator._on_event([create_mock_action()])
+                await asyncio.sleep(0.05)
+            self.assertFalse(task.done())
+            task.cancel()
+
+        asyncio.get_event_loop().run_until_complete(flush())
+        self.assertEqual(self.mock_session.commit.call_count, 2)
+        self.mock_session.rollback.assert_called_once()
+
+    def test_bulk_insert(self):
+        orchestrator = Orchestrator(["dummy"], session=self.mock_session,
+                                    commit_interval=3, bulk_insert=True)
+        bulk_writer = orchestrator.executor.bulk_writer = MagicMock()
+        bulk_writer.accepts.return_value = True
+        bulk_writer.add.return_value = 2
+        action = InsertAction([models.Trade(exchange_trade_id="1")])
+        orchestrator._on_event([action])
+        bulk_writer.add.assert_called_once_with(action)
+        bulk_writer.flush.assert_not_called()
+        orchestrator._on_event([action])
+        bulk_writer.flush.assert_called_once_with(self.mock_session)
+        self.mock_session.commit.assert_called_once()
+
+    def test_writer_threads(self):
+        orchestrator = Orchestrator(["dummy"], session=self.mock_session, writer_threads=1)
+        orchestrator.writer = MagicMock()
+        actions = [create_mock_action()]
+        orchestrator._on_event(actions)
+        orchestrator.writer.submit.assert_called_once_with(actions)
+        actions[0].execute.assert_not_called()
+        orchestrator.stop()
+        orchestrator.writer.stop.assert_called_once()
+
+    def test_capture_and_replay(self):
+        with tempfile.TemporaryDirectory() as directory:
+            capture_file = os.path.join(directory, "dummy.capture")
+            orchestrator = Orchestrator(["dummy-websocket"], session=self.mock_session,
+                                        capture_file=capture_file)
+            listener = orchestrator.exchange_listeners[0]
+            self.assertIs(listener.capture, orchestrator.capture)
+            action = create_mock_action()
+            listener._parse_message = lambda message: [action]
+            listener._handle_frame('{"action": 1}')
+            listener._handle_frame(b'{"action": 2}')
+            orchestrator.stop()
+            frames = list(read_capture(capture_file))
+            self.assertEqual([(frame.exchange, frame.data) for frame in frames],
+                             [("dummy", '{"action": 1}'), ("dummy", b'{"action": 2}')])
+
+            orchestrator = Orchestrator(["dummy-websocket"], session=self.mock_session)
+            orchestrator.exchange_listeners[0]._parse_message = lambda message: [action]
+            action.execute.reset_mock()
+            result = asyncio.get_event_loop().run_until_complete(orchestrator.replay(capture_file))
+            self.assertEqual(result["frames"], 2)
+            self.assertEqual(action.execute.call_count, 2)
+
+    def test_live_snapshots(self):
+        orchestrator = Orchestrator(["dummy"], session=self.mock_session, snapshot_interval=1)
+        listener = orchestrator.exchange_listeners[0]
+        self.assertEqual(listener.on_connection_event, orchestrator.live_snapshots.on_connection_event)
+        orchestrator._submit = MagicMock()
+        orchestrator.emit_snapshots(datetime(2020, 1, 1))
+        orchestrator._submit.assert_not_called()
+        batch = AggOrderBatch.from_levels([["1.0", "1"]], [["2.0", "1"]], last_update_id=1,
+                                          exchange_id=1337, buy_sym_id="ETH", sell_sym_id="BTC")
+        actions = [InsertAction([batch])]
+        orchestrator._on_event(actions)
+        orchestrator._submit.assert_called_once_with(actions)
+        orchestrator.emit_snapshots(datetime(2020, 1, 1))
+        action = orchestrator._submit.call_args[0][0][0]
+        self.assertIs(action.item_type, models.OrderBookSnapshot)
+        self.assertEqual([(snapshot.timestamp, snapshot.spread) for snapshot in action.items],
+                         [(datetime(2020, 1, 1), 1.0)])
+
     @property
     def dummy_listener(self):
         return self.orchestrator.exchange_listeners[0]
@@ -0,0 +1,75 @@
+import unittest
+
+from antalla.order_book import OrderBook, SequenceGap
+from antalla.records import AggOrderBatch
+
+
+def create_batch(bids, asks, last_update_id):
+    return AggOrderBatch.from_levels(bids, asks, last_update_id=last_update_id,
+                                     buy_sym_id="BNB", sell_sym_id="BTC")
+
+
+class OrderBookTest(unittest.TestCase):
+    def setUp(self):
+        self.book = OrderBook("BNBBTC")
+
+    def load(self):
+        return self.book.load_snapshot(create_batch(
+            [["1.0", "1"], ["2.0", "2"], ["3.0", "3"]],
+            [["4.0", "4"], ["5.0", "5"]],
+            10))
+
+    def test_load_snapshot(self):
+        self.assertFalse(self.book.synced)
+        self.assertEqual(self.load(), [])
+        self.assertTrue(self.book.synced)
+        self.assertEqual(self.book.best_bid(), (3.0, 3.0))
+        self.assertEqual(self.book.best_ask(), (4.0, 4.0))
+        self.assertEqual(self.book.depth(2), ([(3.0, 3.0), (2.0, 2.0)], [(4.0, 4.0), (5.0, 5.0)]))
+        self.assertEqual(self.book.depth(10)[0], [(3.0, 3.0), (2.0, 2.0), (1.0, 1.0)])
+
+    def test_apply(self):
+        self.load()
+        self.assertTrue(self.book.apply(create_batch([["3.0", "0"]], [["3.5", "1"]], 12), 11))
+        self.assertEqual(self.book.best_bid(), (2.0, 2.0))
+        self.assertEqual(self.book.best_ask(), (3.5, 1.0))
+        self.assertEqual(len(self.book.bids), 2)
+        self.assertEqual(self.book.last_update_id, 12)
+
+    def test_apply_stale(self):
+        self.load()
+        self.assertFalse(self.book.apply(create_batch([["3.0", "0"]], [], 10), 8))
+        self.assertEqual(self.book.best_bid(), (3.0, 3.0))
+
+    def test_apply_overlapping(self):
+        self.load()
+        self.assertTrue(self.book.apply(create_batch([["3.0", "0"]], [], 15), 8))
+        self.assertEqual(self.book.last_update_id, 15)
+
+    def test_apply_gap(self):
+        self.load()
+        with self.assertRaises(SequenceGap) as context:
+            self.book.apply(create_batch([["3.0", "0"]], [], 15), 12)
+        self.assertEqual(context.exception.expected_id, 11)
+        self.assertEqual(self.book.best_bid(), (3.0, 3.0))
+        self.assertEqual(self.book.last_update_id, 10)
+
+    def test_buffer_until_snapshot(self):
+        stale = create_batch([["1.0", "0"]], [], 9)
+        first = create_batch([["3.0", "0"]], [], 12)
+        second = create_batch([], [["4.0", "0"]], 13)
+        for batch, first_update_id in [(stale, 5), (first, 10), (second, 13)]:
+            self.assertFalse(self.book.apply(batch, first_update_id))
+        self.assertEqual(self.load(), [first, second])
+        self.assertEqual(self.book.best_bid(), (2.0, 2.0))
+        self.assertEqual(self.book.best_ask(), (5.0, 5.0))
+        self.assertEqual(self.book.last_update_id, 13)
+
+    def test_invalidate(self):
+        self.load()
+        self.book.invalidate()
+        self.assertFalse(self.book.synced)
+        self.assertIsNone(self.book.best_bid())
+        self.assertFalse(self.book.apply(create_batch([["3.0", "1"]], [], 20), 18))
+        with self.assertRaises(SequenceGap):
+            self.load()
@@ -0,0 +1,90 @@
+import datetime
+
+from antalla import db, models
+from antalla.partitions import PartitionManager, partition_name
+from tests.fixtures import dummy_db
+from tests.support import TransactionalTestCase
+
+
+TABLE = models.AggOrder.__tablename__
+
+
+def create_agg_order(timestamp):
+    return models.AggOrder(
+        last_update_id=1,
+        timestamp=timestamp,
+        buy_sym_id="ETH",
+        sell_sym_id="BTC",
+        exchange_id=1,
+        order_type="bid",
+        price=1.0,
+        size=1.0,
+    )
+
+
+class PartitionManagerTest(TransactionalTestCase):
+    def setUp(self):
+        # partitions cannot be created while other transactions use the table
+        db.session.remove()
+        super().setUp()
+        dummy_db.insert_coins(self.session)
+        dummy_db.insert_exchanges(self.session)
+        self.session.flush()
+        self.manager = PartitionManager(self.session, tables=[TABLE])
+
+    def test_create_partitions(self):
+        start = datetime.date(2031, 1, 1)
+        created = self.manager.create_partitions(start, 3)
+        self.assertEqual(created, [partition_name(TABLE, start + datetime.timedelta(days=i))
+                                   for i in range(3)])
+        self.assertEqual(self.manager.create_partitions(start, 3), [])
+        partitions = self.manager.partitions(TABLE)
+        self.assertEqual(partitions[start], TABLE + "_p20310101")
+
+    def test_rows_are_routed_to_partition(self):
+        self.manager.create_partitions(datetime.date(2031, 1, 1), 1)
+        self.session.add(create_agg_order(datetime.datetime(2031, 1, 1, 12, 0)))
+        self.session.add(create_agg_order(datetime.datetime(2031, 1, 2, 12, 0)))
+        self.session.flush()
+        rows = self.session.execute(
+            f"select tableoid::regclass::text from {TABLE} order by timestamp")
+        self.assertEqual([row[0] for row in rows], [TABLE + "_p20310101", TABLE + "_default"])
+
+    def test_create_partitions_moves_days_in_default(self):
+        self.session.add(create_agg_order(datetime.datetime(2031, 1, 2, 12, 0)))
+        self.session.add(create_agg_order(datetime.datetime(2031, 1, 3, 12, 0)))
+        self.session.flush()
+        created = self.manager.create_partitions(datetime.date(2031, 1, 1), 2)
+        self.assertEqual(created, [TABLE + "_p20310101", TABLE + "_p20310102"])
+        rows = self.session.execute(
+            f"select tableoid::regclass::text from {TABLE} order by timestamp")
+        self.assertEqual([row[0] for row in rows], [TABLE + "_p20310102", TABLE + "_default"])
+        self.session.add(create_agg_order(datetime.datetime(2031, 1, 4, 12, 0)))
+        self.session.flush()
+
+    def test_expire_partitions(self):
+        self.manager.create_partitions(datetime.date(2031, 1, 1), 3)
+        expired = self.manager.expire_partitions(datetime.date(2031, 1, 2))
+        self.assertIn(TABLE + "_p20310101", expired)
+        self.assertNotIn(TABLE + "_p20310102", expired)
+        partitions = self.manager.partitions(TABLE)
+        self.assertNotIn(datetime.date(2031, 1, 1), partitions)
+        self.assertIn(datetime.date(2031, 1, 3), partitions)
+
+    def test_expire_default_rows(self):
+        self.session.add(create_agg_order(datetime.datetime(2031, 1, 1, 12, 0)))
+        self.session.add(create_agg_order(datetime.datetime(2031, 1, 2, 12, 0)))
+        self.session.flush()
+        self.manager.expire_partitions(datetime.date(2031, 1, 2), drop=False)
+        self.assertEqual(self.session.execute(f"select count(*) from {TABLE}").scalar(), 2)
+        self.manager.expire_partitions(datetime.date(2031, 1, 2))
+        rows = self.session.execute(f"select timestamp from {TABLE}")
+        self.assertEqual([row[0] for row in rows], [datetime.datetime(2031, 1, 2, 12, 0)])
+
+    def test_expire_partitions_detach_only(self):
+        self.manager.create_partitions(datetime.date(2031, 1, 1), 1)
+        self.manager.expire_partitions(datetime.date(2031, 1, 2), drop=False)
+        rows = self.session.execute(
+            "select count(*) from pg_class where relname = :name",
+            dict(name=TABLE + "_p20310101"))
+        self.assertEqual(rows.scalar(), 1)
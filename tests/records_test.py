@@ -0,0 +1,99 @@
+import unittest
+from datetime import datetime
+
+from antalla import models
+from antalla.actions import InsertAction
+from antalla.records import AggOrderBatch, AggOrderRecord, TradeRecord, item_values
+from tests.fixtures import dummy_db
+from tests.support import TransactionalTestCase
+
+
+def create_agg_order_record(last_update_id, price):
+    return AggOrderRecord(
+        timestamp=datetime(2019, 5, 1, 1, 0, 0),
+        last_update_id=last_update_id,
+        buy_sym_id="ETH",
+        sell_sym_id="BTC",
+        exchange_id=1,
+        order_type="bid",
+        price=price,
+        size=1.0,
+    )
+
+
+def create_agg_order_batch(last_update_id):
+    return AggOrderBatch.from_levels(
+        [["1.0", "2.0"], ["0.5", "0"]], [["1.5", "3.0"]],
+        timestamp=datetime(2019, 5, 1, 1, 0, 0),
+        last_update_id=last_update_id,
+        buy_sym_id="ETH",
+        sell_sym_id="BTC",
+        exchange_id=1,
+    )
+
+
+class RecordsTest(unittest.TestCase):
+    def test_defaults_to_none(self):
+        trade = TradeRecord(exchange_trade_id="1", price=1.0)
+        self.assertIsNone(trade.maker)
+        self.assertEqual(trade.to_dict()["exchange_trade_id"], "1")
+
+    def test_unknown_column(self):
+        with self.assertRaises(TypeError):
+            TradeRecord(foo=1)
+
+    def test_item_values(self):
+        self.assertEqual(item_values(models.Coin(symbol="ETH")), {"symbol": "ETH"})
+        self.assertEqual(item_values(create_agg_order_record(1, 1.0))["second_coin_id"], "ETH")
+
+    def test_insert_action(self):
+        action = InsertAction([create_agg_order_record(1, 1.0), models.AggOrder(
+            buy_sym_id="ETH", sell_sym_id="BTC", price=2.0)])
+        self.assertIs(action.item_type, models.AggOrder)
+        with self.assertRaises(ValueError):
+            InsertAction([create_agg_order_record(1, 1.0), TradeRecord()])
+
+    def test_batch(self):
+        batch = create_agg_order_batch(1)
+        self.assertEqual(len(batch), 3)
+        self.assertEqual(batch.column("size").tolist(), [2.0, 0.0, 3.0])
+        self.assertEqual(batch.column("exchange_id"), 1)
+        self.assertEqual(batch[2].order_type, "ask")
+        self.assertEqual(batch[2].first_coin_id, "BTC")
+        self.assertEqual(batch.to_dicts()[1], batch[1].to_dict())
+
+    def test_batch_insert_action(self):
+        action = InsertAction([create_agg_order_batch(1), create_agg_order_record(1, 1.0)])
+        self.assertIs(action.item_type, models.AggOrder)
+        self.assertEqual(action.row_count, 4)
+        merged = InsertAction.merge([action, InsertAction([create_agg_order_batch(2)])])
+        self.assertEqual(merged.row_count, 7)
+
+
+class InsertRecordsTest(TransactionalTestCase):
+    def setUp(self):
+        super().setUp()
+        dummy_db.insert_coins(self.session)
+        dummy_db.insert_exchanges(self.session)
+        self.session.flush()
+
+    def test_execute(self):
+        records = [create_agg_order_record(1, 1.0), create_agg_order_record(1, 2.0)]
+        self.assertEqual(InsertAction(records).execute(self.session), 2)
+        orders = self.session.query(models.AggOrder).order_by(models.AggOrder.price).all()
+        self.assertEqual([order.price for order in orders], [1.0, 2.0])
+        self.assertEqual(orders[0].first_coin_id, "BTC")
+        self.assertIsNotNone(orders[0].id)
+
+    def test_execute_epoch_timestamp(self):
+        record = create_agg_order_record(1, 1.0)
+        record.timestamp = 1556672523000
+        InsertAction([record]).execute(self.session)
+        order = self.session.query(models.AggOrder).one()
+        self.assertEqual(order.timestamp, datetime.fromtimestamp(1556672523))
+
+    def test_execute_batch(self):
+        self.assertEqual(InsertAction([create_agg_order_batch(1)]).execute(self.session), 3)
+        orders = self.session.query(models.AggOrder).order_by(models.AggOrder.price).all()
+        self.assertEqual([(order.order_type, order.price) for order in orders],
+                         [("bid", 0.5), ("bid", 1.0), ("ask", 1.5)])
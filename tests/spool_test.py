@@ -0,0 +1,84 @@
+import datetime
+import os
+import tempfile
+import unittest
+
+from antalla import models
+from antalla.actions import InsertAction, UpdateAction
+from antalla.records import AggOrderBatch
+from antalla.spool import Spool
+
+
+def create_agg_order(last_update_id):
+    return models.AggOrder(
+        last_update_id=last_update_id,
+        timestamp=datetime.datetime(2019, 5, 1, 1, 0, 0),
+        buy_sym_id="ETH",
+        sell_sym_id="BTC",
+        exchange_id=1,
+        order_type="bid",
+        price=1.0,
+        size=2.0,
+    )
+
+
+class SpoolTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.spool = Spool(os.path.join(self.directory.name, "antalla.spool"))
+
+    def tearDown(self):
+        self.spool.close()
+        self.directory.cleanup()
+
+    def test_append_and_read(self):
+        self.spool.append([InsertAction([create_agg_order(1), create_agg_order(2)])])
+        self.spool.append([UpdateAction(models.Coin, dict(symbol="ETH"), dict(name="Ether"))])
+        self.assertTrue(self.spool.pending)
+        segments = self.spool.rotate()
+        self.assertEqual(len(segments), 1)
+        batches = list(Spool.read(segments[0]))
+        self.assertEqual(len(batches), 2)
+        orders = batches[0][0].items
+        self.assertEqual([order.last_update_id for order in orders], [1, 2])
+        self.assertEqual(orders[0].first_coin_id, "BTC")
+        self.assertEqual(orders[0].timestamp, datetime.datetime(2019, 5, 1, 1, 0, 0))
+        self.assertEqual(batches[1][0].model, models.Coin)
+        self.assertEqual(batches[1][0].query, dict(symbol="ETH"))
+
+    def test_append_after_insert_executed(self):
+        action = InsertAction([create_agg_order(1)])
+        # executing an insert action removes the instance state of its items
+        vars(action.items[0]).pop("_sa_instance_state")
+        self.spool.append([action])
+        batch = next(Spool.read(self.spool.rotate()[0]))
+        self.assertEqual(batch[0].items[0].price, 1.0)
+
+    def test_append_batch(self):
+        batch = AggOrderBatch.from_levels([["1.0", "2.0"]], [["1.5", "3.0"]],
+                                          last_update_id=1, buy_sym_id="ETH", sell_sym_id="BTC")
+        self.spool.append([InsertAction([batch, create_agg_order(2)])])
+        actions = next(Spool.read(self.spool.rotate()[0]))
+        self.assertEqual([action.row_count for action in actions], [1, 2])
+        self.assertEqual(actions[1].items[0].prices.tolist(), [1.0, 1.5])
+        self.assertEqual(actions[1].items[0].first_coin_id, "BTC")
+
+    def test_rotate(self):
+        self.assertEqual(self.spool.rotate(), [])
+        self.spool.append([InsertAction([create_agg_order(1)])])
+        first = self.spool.rotate()
+        self.spool.append([InsertAction([create_agg_order(2)])])
+        segments = self.spool.rotate()
+        self.assertEqual(segments[0], first[0])
+        self.assertEqual(len(segments), 2)
+        for segment in segments:
+            os.remove(segment)
+        self.assertFalse(self.spool.pending)
+
+    def test_read_skips_incomplete_record(self):
+        self.spool.append([InsertAction([create_agg_order(1)])])
+        self.spool.append([InsertAction([create_agg_order(2)])])
+        segment = self.spool.rotate()[0]
+        with open(segment, "r+b") as f:
+            f.truncate(os.path.getsize(segment) - 3)
+        self.assertEqual(len(list(Spool.read(segment))), 1)
@@ -0,0 +1,56 @@
+import time
+import unittest
+
+from antalla.supervisor import Supervisor, shard_markets
+
+
+def exit_worker(index, markets, options, heartbeat):
+    pass
+
+
+def idle_worker(index, markets, options, heartbeat):
+    time.sleep(30)
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.05)
+
+
+class ShardMarketsTest(unittest.TestCase):
+    def test_balanced_shards(self):
+        markets = {"binance": ["A_B", "C_D", "E_F", "G_H"], "coinbase": ["A_B", "C_D"]}
+        shards = shard_markets(markets, 4)
+        self.assertEqual([sum(len(m) for m in shard.values()) for shard in shards], [2, 2, 1, 1])
+        self.assertEqual(shards[2], {"coinbase": ["A_B"]})
+
+    def test_single_shard(self):
+        markets = {"binance": ["A_B"], "coinbase": ["A_B"]}
+        self.assertEqual(shard_markets(markets, 1), [markets])
+
+
+class SupervisorTest(unittest.TestCase):
+    def test_restart_exited_worker(self):
+        supervisor = Supervisor([{"binance": ["A_B"]}], target=exit_worker, restart_delay=0)
+        supervisor.start()
+        worker = supervisor.workers[0]
+        worker.process.join(10)
+        supervisor.check_workers()
+        self.assertIsNone(worker.process)
+        self.assertEqual(worker.failures, 1)
+        supervisor.check_workers()
+        self.assertEqual(supervisor.restarts, 1)
+        self.assertIsNotNone(worker.process)
+        supervisor.stop()
+
+    def test_terminate_worker_without_heartbeat(self):
+        supervisor = Supervisor([{"binance": ["A_B"]}], target=idle_worker, heartbeat_timeout=0.1)
+        supervisor.start()
+        process = supervisor.workers[0].process
+        wait_for(process.is_alive)
+        time.sleep(0.2)
+        supervisor.check_workers()
+        self.assertFalse(process.is_alive())
+        self.assertIsNone(supervisor.workers[0].process)
+        supervisor.stop()
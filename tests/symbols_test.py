@@ -0,0 +1,53 @@
+import unittest
+
+from antalla import models
+from antalla.symbols import SymbolRegistry, split_market
+from tests.fixtures import dummy_db
+from tests.support import TransactionalTestCase
+
+
+class SymbolRegistryTest(unittest.TestCase):
+    def test_for_exchange(self):
+        registry = SymbolRegistry.for_exchange("symbols-test")
+        self.assertIs(SymbolRegistry.for_exchange("symbols-test"), registry)
+        self.assertIsNot(SymbolRegistry.for_exchange("symbols-test-other"), registry)
+
+    def test_get(self):
+        registry = SymbolRegistry()
+        registry.update({"ETH_BTC": ("ETH", "BTC")})
+        self.assertEqual(registry.get("ETH_BTC"), ("ETH", "BTC"))
+        self.assertEqual(registry.get("eth_btc"), ("ETH", "BTC"))
+        self.assertIsNone(registry.get("LTC_BTC"))
+
+    def test_add_exchange_markets(self):
+        registry = SymbolRegistry()
+        registry.add_exchange_markets([
+            models.ExchangeMarket(original_name="BNBBTC", first_coin_id="BNB",
+                                  second_coin_id="BTC", quoted_volume_id="BNB"),
+            models.ExchangeMarket(original_name="USDTUSD", first_coin_id="USD",
+                                  second_coin_id="USDT", quoted_volume_id="USD"),
+            models.ExchangeMarket(original_name="XBT", first_coin_id="BTC",
+                                  second_coin_id="ETH", quoted_volume_id="ETH"),
+        ])
+        self.assertEqual(registry.get("BNBBTC"), ("BNB", "BTC"))
+        self.assertEqual(registry.get("USDTUSD"), ("USDT", "USD"))
+        self.assertEqual(registry.get("XBT"), ("ETH", "BTC"))
+
+    def test_split_market(self):
+        self.assertEqual(split_market("BTC-EUR", []), ("BTC", "EUR"))
+        with self.assertRaises(Exception):
+            split_market("WAVEBTC", ["BTC"])
+
+
+class SymbolRegistryLoadTest(TransactionalTestCase):
+    def test_load(self):
+        dummy_db.insert_exchanges(self.session)
+        dummy_db.insert_coins(self.session)
+        dummy_db.insert_markets(self.session)
+        dummy_db.insert_exchange_markets(self.session)
+        self.session.flush()
+        registry = SymbolRegistry()
+        registry.load(self.session, 1)
+        self.assertTrue(registry.loaded)
+        self.assertEqual(registry.get("ETH_FTM"), ("ETH", "FTM"))
+        self.assertEqual(registry.get("ETH_BTC"), ("ETH", "BTC"))
@@ -0,0 +1,32 @@
+import unittest
+from datetime import datetime, timezone
+
+from dateutil.parser import parse as parse_date
+
+from antalla.timestamps import TimestampCache, from_epoch_ms, parse_iso, to_datetime
+
+
+class TimestampsTest(unittest.TestCase):
+    def test_parse_iso(self):
+        for value in ["2014-11-07T08:19:27.028459Z", "2019-04-24T15:10:05.535Z",
+                      "2019-04-11T18:27:46.000Z", "2019-04-11T18:27:46+05:30",
+                      "2019-04-11T18:27:46", "2019-04-11T18:27:46.1234567-02:00"]:
+            parsed = parse_iso(value)
+            self.assertEqual(parsed, parse_date(value))
+            self.assertEqual(parsed.utcoffset(), parse_date(value).utcoffset())
+
+    def test_parse_iso_fallback(self):
+        self.assertEqual(parse_iso("Apr 11 2019 18:27"), datetime(2019, 4, 11, 18, 27))
+
+    def test_to_datetime(self):
+        self.assertEqual(to_datetime(1556672523000), datetime.fromtimestamp(1556672523))
+        self.assertEqual(to_datetime(1556672523000), from_epoch_ms(1556672523000))
+        self.assertEqual(to_datetime("2019-05-01T01:02:03Z"),
+                         datetime(2019, 5, 1, 1, 2, 3, tzinfo=timezone.utc))
+        self.assertIsNone(to_datetime(None))
+
+    def test_cache(self):
+        timestamps = TimestampCache()
+        first = timestamps.parse_iso("2019-04-11T18:27:46.000Z")
+        self.assertIs(timestamps.parse_iso("2019-04-11T18:27:46.000Z"), first)
+        self.assertEqual(timestamps.from_epoch(1555007266), datetime.fromtimestamp(1555007266))
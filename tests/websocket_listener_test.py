@@ -0,0 +1,98 @@
+import asyncio
+import collections
+import unittest
+from unittest.mock import MagicMock, patch
+
+import sqlalchemy
+
+from antalla import models
+from antalla.websocket_listener import WebsocketListener
+
+
+class DummyWebsocket:
+    def __init__(self, frames):
+        self.messages = collections.deque(frames)
+
+    async def recv(self):
+        return self.messages.popleft()
+
+
+class DummyListener(WebsocketListener):
+    def _get_existing_markets(self, markets):
+        return markets
+
+    def _parse_message(self, message):
+        return [message["id"]]
+
+
+class DummyTypedListener(DummyListener):
+    message_type_key = "type"
+
+    def _parse_match(self, message):
+        return [message["id"]]
+
+
+class DummyShardedListener(DummyListener):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.attempts = collections.Counter()
+
+    def _get_ws_urls(self):
+        return ["wss://example.com/a", "wss://example.com/b"]
+
+    async def _listen(self, ws_url):
+        self.attempts[ws_url] += 1
+        if ws_url.endswith("a") and self.attempts[ws_url] < 3:
+            raise ConnectionError("connection lost")
+        await asyncio.sleep(0.01)
+        self.running = False
+
+
+class WebsocketListenerTest(unittest.TestCase):
+    def setUp(self):
+        self.listener = DummyListener(models.Exchange(id=1, name="dummy"), MagicMock(),
+                                      ["ETH_BTC"], "wss://example.com")
+
+    def test_receive_pending(self):
+        websocket = DummyWebsocket(['{"id": 1}', '{"id": 2}'])
+        frames = asyncio.get_event_loop().run_until_complete(
+            self.listener._receive_pending(websocket))
+        self.assertEqual(frames, ['{"id": 1}', '{"id": 2}'])
+        self.assertEqual(len(websocket.messages), 0)
+
+    def test_receive_pending_without_buffer(self):
+        frames = asyncio.get_event_loop().run_until_complete(
+            self.listener._receive_pending(object()))
+        self.assertEqual(frames, [])
+
+    def test_handle_frame(self):
+        self.assertEqual(self.listener._handle_frame('{"id": 3}'), [3])
+
+    def test_handle_frame_skips_unhandled_types(self):
+        listener = DummyTypedListener(models.Exchange(id=1, name="dummy"), MagicMock(),
+                                      ["ETH_BTC"], "wss://example.com")
+        self.assertIn("match", DummyTypedListener.handled_message_types())
+        self.assertEqual(listener._handle_frame('{"type": "open", "id": 3}'), [])
+        self.assertEqual(listener._handle_frame(b'{"type": "match", "id": 4}'), [4])
+        self.assertEqual(listener.skipped_frames, 1)
+
+    def test_listen_reconnects_connections_independently(self):
+        listener = DummyShardedListener(models.Exchange(id=1, name="dummy"), MagicMock(),
+                                        ["ETH_BTC"], "wss://example.com")
+        asyncio.get_event_loop().run_until_complete(listener.listen())
+        self.assertEqual(listener.attempts["wss://example.com/a"], 3)
+        self.assertEqual(listener.attempts["wss://example.com/b"], 1)
+
+    def test_db_error_handler(self):
+        error = sqlalchemy.exc.OperationalError("commit", {}, None)
+        self.listener.on_db_error = MagicMock()
+
+        async def listen(ws_url):
+            self.listener.running = False
+            raise error
+
+        self.listener.running = True
+        with patch.object(self.listener, "_listen", listen):
+            asyncio.get_event_loop().run_until_complete(
+                self.listener._listen_forever("wss://example.com"))
+        self.listener.on_db_error.assert_called_once_with(error)